@@ -1,21 +1,32 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, url_for, Response, stream_with_context
 from flask_cors import CORS
+import asyncio
 import os
 import tempfile
 import logging
 import sys
 import re
-import yt_dlp
-import uuid
-import time
-import PIL.Image
 from dotenv import load_dotenv
-from transcriber import transcribe_audio
-from ocr import ocr_image, ocr_pdf
 
-# Load environment variables from .env file
+# Load environment variables from .env file, before the other modules read their settings
 load_dotenv()
 
+from transcriber import transcribe_audio, transcribe_audio_async, transcript_cache_key
+from ocr import ocr_image, ocr_image_async, ocr_pdf_detailed, ocr_pdf_detailed_async
+from cache import result_cache
+from remote_files import reaper_stats
+from imaging import image_stats, open_image, heif_supported
+from gemini_client import admission_delay, gemini_stats, GEMINI_ADMISSION_TIMEOUT
+from youtube import extract_video_id, youtube_cache_stats
+from pipeline import download_and_transcribe, download_and_transcribe_async
+from registry import register_temp_file, get_temp_file_info, remove_temp_file
+from ingest import MAX_AUDIO_UPLOAD_MB, MAX_IMAGE_UPLOAD_MB, MAX_PDF_UPLOAD_MB, IngestRequest, claim_upload, discard_unclaimed_uploads
+from werkzeug.exceptions import RequestEntityTooLarge
+from metrics import render_metrics, count_error
+from store import save_document, get_document, delete_document, search_segments
+from uploads import create_upload, upload_status, write_chunk, finalize_upload, UploadError, MAX_RESUMABLE_UPLOAD_MB
+from jobs import submit_or_join_job, find_active_job, get_job, wait_for_job_update, job_response, partial_text_reporter, JobEventStream, QueueFullError
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -24,16 +35,42 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Dictionary to store mapping between file_id and actual file path
-# Format: {file_id: {"path": file_path, "timestamp": creation_time}}
-temp_file_map = {}
+# The Gemini client is created on first use, so a missing key would otherwise only show up then
+if not os.getenv('GEMINI_API_KEY'):
+    logger.warning("GEMINI_API_KEY environment variable is not set, transcription and OCR requests will fail")
+
+# Audio formats accepted for transcription
+AUDIO_EXTENSIONS = {'wav', 'mp3', 'aiff', 'aac', 'ogg', 'flac'}
+
+# "sync" runs jobs on the thread pool, "async" runs them as coroutines on the SDK's asyncio client (served by asgi.py)
+SERVER_MODE = os.getenv('SERVER_MODE', 'sync').lower()
+ASYNC_JOBS = SERVER_MODE == 'async'
 
 app = Flask(__name__)
+# Uploaded files are streamed to disk, hashed and size-checked as they arrive
+app.request_class = IngestRequest
 CORS(app)
 
+@app.teardown_request
+def cleanup_uploads(exc):
+    # Uploads that were rejected or not handed over to a job are deleted with the request
+    discard_unclaimed_uploads(request)
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    logger.warning(f"Upload rejected for {request.path}: {e.description}")
+    count_error('upload_temp', e)
+    return jsonify({'error': e.description}), 413
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template(
+        'index.html',
+        max_audio_mb=MAX_AUDIO_UPLOAD_MB,
+        max_image_mb=MAX_IMAGE_UPLOAD_MB,
+        max_pdf_mb=MAX_PDF_UPLOAD_MB,
+        max_resumable_mb=MAX_RESUMABLE_UPLOAD_MB
+    )
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -45,65 +82,225 @@ def upload_file():
         return jsonify({'error': 'No selected file'}), 400
 
     # Check if file has an allowed extension
-    allowed_extensions = {'wav', 'mp3', 'aiff', 'aac', 'ogg', 'flac'}
-    if '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() not in allowed_extensions:
+    if '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() not in AUDIO_EXTENSIONS:
         return jsonify({'error': 'Unsupported file format'}), 400
 
-    # Check file size (15MB limit)
-    MAX_FILE_SIZE = 15 * 1024 * 1024  # 15MB in bytes
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-
-    if file_size > MAX_FILE_SIZE:
-        logger.warning(f"File too large: {file.filename}, size: {file_size/1024/1024:.2f}MB")
-        return jsonify({'error': f'File too large. Maximum size is 15MB. Your file is {file_size/1024/1024:.2f}MB.'}), 400
-
     try:
-        # Save file to a temporary location
-        temp_file = tempfile.NamedTemporaryFile(delete=False)
-        file.save(temp_file.name)
-        temp_file.close()
-        
-        # Generate a secure unique ID for this file
-        file_id = str(uuid.uuid4())
-        
-        # Store the mapping between ID and actual path
-        temp_file_map[file_id] = {
-            "path": temp_file.name, 
-            "timestamp": time.time()
-        }
+        # The file was already streamed to a temporary location within the size limit
+        temp_path, content_hash, file_size = claim_upload(file)
         
-        # Clean up old temp files
-        cleanup_temp_files()
+        # Register the file under a secure unique ID, shared by all server processes.
+        # Expired files are removed by the registry's background reaper
+        file_id = register_temp_file(temp_path, content_hash=content_hash)
         
-        logger.info(f"File uploaded successfully: {file.filename}, assigned ID: {file_id}")
+        logger.info(f"File uploaded successfully: {file.filename} ({file_size/1024/1024:.2f}MB), assigned ID: {file_id}")
         return jsonify({'success': True, 'file_id': file_id}), 200
     except Exception as e:
         logger.error(f"Error uploading file: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-# Function to clean up old temporary files
-def cleanup_temp_files():
-    """Remove mapping entries older than 30 minutes and delete their associated files"""
-    current_time = time.time()
-    expired_time = current_time - (30 * 60)  # 30 minutes in seconds
-    
-    # Find expired entries
-    expired_ids = [file_id for file_id, data in temp_file_map.items() 
-                if data["timestamp"] < expired_time]
-    
-    # Delete expired files and remove from map
-    for file_id in expired_ids:
-        try:
-            file_path = temp_file_map[file_id]["path"]
-            if os.path.exists(file_path):
-                os.unlink(file_path)
-                logger.info(f"Deleted expired temp file: {file_path}")
-            del temp_file_map[file_id]
-            logger.info(f"Removed expired file_id: {file_id}")
-        except Exception as e:
-            logger.warning(f"Error cleaning up file_id {file_id}: {str(e)}")
+# Resumable uploads: POST /uploads starts one, chunks are sent with PUT and a Content-Range
+# header, and finalizing registers the file under a file_id like /upload does
+@app.errorhandler(UploadError)
+def upload_error(e):
+    count_error('upload_chunk', e)
+    return jsonify({'error': str(e)}), e.status
+
+@app.route('/uploads', methods=['POST'])
+def start_upload():
+    data = request.json or {}
+    filename = data.get('filename') or ''
+    if '.' not in filename or filename.rsplit('.', 1)[1].lower() not in AUDIO_EXTENSIONS:
+        return jsonify({'error': 'Unsupported file format'}), 400
+
+    upload = create_upload(filename, data.get('size'), data.get('sha256'))
+    upload['upload_url'] = url_for('upload_chunk', upload_id=upload['upload_id'])
+    return jsonify(upload), 201
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    # The chunk is streamed from the request body to its place in the file
+    return jsonify(write_chunk(upload_id, request.headers.get('Content-Range'), request.stream,
+                               request.headers.get('X-Chunk-SHA256'))), 200
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    return jsonify(upload_status(upload_id)), 200
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finish_upload(upload_id):
+    file_id, filename, size = finalize_upload(upload_id, (request.get_json(silent=True) or {}).get('sha256'))
+    logger.info(f"File uploaded successfully: {filename} ({size/1024/1024:.2f}MB), assigned ID: {file_id}")
+    return jsonify({'success': True, 'file_id': file_id}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus text format, added up over all server processes
+    body, content_type = render_metrics()
+    return Response(body, mimetype=content_type)
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        'cache': result_cache.stats(),
+        'youtube_cache': youtube_cache_stats(),
+        'image_preprocessing': image_stats(),
+        'gemini': gemini_stats(),
+        'remote_file_reaper': reaper_stats()
+    }), 200
+
+# Search over stored transcripts and OCR text, answered from the local store without calling Gemini
+@app.route('/search', methods=['GET'])
+def search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'No search query provided'}), 400
+    limit = request.args.get('limit', 20, type=int)
+    results = search_segments(query, kind=request.args.get('kind'), limit=limit)
+    return jsonify({'query': query, 'results': results}), 200
+
+@app.route('/documents/<int:document_id>', methods=['GET'])
+def document(document_id):
+    stored = get_document(document_id)
+    if stored is None:
+        return jsonify({'error': 'Unknown document ID'}), 404
+    return jsonify(stored), 200
+
+@app.route('/documents/<int:document_id>', methods=['DELETE'])
+def remove_document(document_id):
+    if not delete_document(document_id):
+        return jsonify({'error': 'Unknown document ID'}), 404
+    return jsonify({'success': True}), 200
+
+def job_accepted_response(job_id, joined):
+    """Point the client at the status of a queued job, or of the in-flight job it joined"""
+    response = {
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('job_status', job_id=job_id),
+        'events_url': url_for('job_events', job_id=job_id)
+    }
+    if joined:
+        job = get_job(job_id)
+        if job:
+            response['status'] = job['status']
+        response['deduplicated'] = True
+    return jsonify(response), 202
+
+def submit_job_response(kind, func, *args, temp_path=None, file_id=None, dedupe_key=None):
+    """Queue a job and return the HTTP response pointing the client at its status
+
+    temp_path is a file handed over to the job, deleted here if the job is rejected
+    or not needed. file_id is a registered upload the job reads, removed here only
+    when the job is not needed, since a rejected request can be retried with it.
+    With a dedupe_key, a request for work that is already queued or running in any
+    server process joins that job instead of starting another one.
+    """
+    # Joining a job costs no Gemini calls, so it is not subject to load shedding
+    job_id = find_active_job(dedupe_key) if dedupe_key else None
+    if job_id:
+        logger.info(f"Joined in-flight {kind} job {job_id}")
+        discard_joined_upload(temp_path, file_id)
+        return job_accepted_response(job_id, joined=True)
+
+    # Shed new work while the Gemini quota is exhausted instead of queueing jobs that would time out
+    delay = admission_delay()
+    if delay > GEMINI_ADMISSION_TIMEOUT:
+        if temp_path:
+            remove_file(temp_path)
+        logger.warning(f"Rejected {kind} job, Gemini rate limit frees up in {delay:.0f}s")
+        return jsonify({'error': 'Gemini API is busy, please try again in a moment'}), 503, {'Retry-After': str(int(delay) + 1)}
+
+    try:
+        job_id, joined = submit_or_join_job(kind, dedupe_key, func, *args)
+    except QueueFullError as e:
+        if temp_path:
+            remove_file(temp_path)
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+
+    if joined:
+        discard_joined_upload(temp_path, file_id)
+    return job_accepted_response(job_id, joined)
+
+def discard_joined_upload(temp_path, file_id):
+    """Delete the input of a request that joined another job, which reads its own copy"""
+    if temp_path:
+        remove_file(temp_path)
+    if file_id:
+        remove_temp_file(file_id)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Invalid or expired job ID'}), 404
+    return jsonify(job_response(job)), 200
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    if get_job(job_id) is None:
+        return jsonify({'error': 'Invalid or expired job ID'}), 404
+
+    def generate():
+        stream = JobEventStream(job_id)
+        while not stream.finished:
+            job = wait_for_job_update(job_id, stream.version, timeout=15)
+            yield from stream.events(job)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def remove_file(path):
+    """Delete a temp file, logging instead of failing"""
+    try:
+        os.unlink(path)
+        logger.info(f"Deleted temp file: {path}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Could not delete temp file {path}: {str(e)}")
+
+def store_result(kind, text, content_key=None, title=None, source=None):
+    """Keep a finished result in the transcript store, logging instead of failing the job
+
+    Returns:
+        int: ID of the stored document, or None if it was not stored
+    """
+    try:
+        return save_document(kind, text, content_key, title, source)
+    except Exception as e:
+        logger.warning(f"Could not store {kind} result: {str(e)}")
+        return None
+
+def run_transcription(file_id, temp_path, include_timestamps, content_hash=None, title=None):
+    """Job task: transcribe an uploaded file and drop it once done"""
+    transcript = transcribe_audio(temp_path, include_timestamps, on_text=partial_text_reporter(),
+                                  content_hash=content_hash)
+    return finish_transcription(file_id, transcript, include_timestamps, content_hash, title)
+
+async def run_transcription_async(file_id, temp_path, include_timestamps, content_hash=None, title=None):
+    """Async job task: transcribe an uploaded file and drop it once done"""
+    transcript = await transcribe_audio_async(temp_path, include_timestamps, on_text=partial_text_reporter(),
+                                              content_hash=content_hash)
+    return await asyncio.to_thread(finish_transcription, file_id, transcript, include_timestamps, content_hash, title)
+
+def finish_transcription(file_id, transcript, include_timestamps, content_hash, title):
+    """Drop the transcribed file and store its transcript, returning the job result"""
+    logger.info(f"File transcribed successfully")
+
+    # Delete the temporary file after processing
+    try:
+        remove_temp_file(file_id)
+        logger.info(f"Deleted temp file and removed mapping for {file_id}")
+    except Exception as e:
+        logger.warning(f"Could not delete temp file: {str(e)}")
+
+    content_key = f"transcribe:{transcript_cache_key(content_hash, include_timestamps)}" if content_hash else None
+    document_id = store_result('transcribe', transcript, content_key, title)
+    return {'transcript': transcript, 'document_id': document_id}
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
@@ -114,10 +311,10 @@ def transcribe():
         return jsonify({'error': 'No file ID provided'}), 400
     
     # Look up the actual file path using the provided ID
-    if file_id not in temp_file_map:
+    temp_file = get_temp_file_info(file_id)
+    if temp_file is None:
         return jsonify({'error': 'Invalid or expired file ID'}), 400
-    
-    temp_path = temp_file_map[file_id]["path"]
+    temp_path = temp_file['path']
     
     # Validate that the temporary path is within the expected temporary directory
     expected_temp_dir = tempfile.gettempdir()
@@ -125,28 +322,54 @@ def transcribe():
         logger.error(f"Security violation: temp_path {temp_path} is outside of expected temp directory {expected_temp_dir}")
         return jsonify({'error': 'Security violation detected'}), 400
     
-    try:
-        # Get timestamp preference from request
-        include_timestamps = data.get('include_timestamps', True)
-        logger.info(f"Timestamp preference: {'include' if include_timestamps else 'exclude'}")
-        
-        # Process the audio file
-        transcript = transcribe_audio(temp_path, include_timestamps)
-        logger.info(f"File transcribed successfully")
-        
-        # Delete the temporary file after processing
-        try:
-            os.unlink(temp_path)
-            # Remove from our mapping after successful processing
-            del temp_file_map[file_id]
-            logger.info(f"Deleted temp file and removed mapping for {file_id}")
-        except Exception as e:
-            logger.warning(f"Could not delete temp file: {str(e)}")
-        
-        return jsonify({'transcript': transcript}), 200
-    except Exception as e:
-        logger.error(f"Error transcribing file: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+    # Get timestamp preference from request
+    include_timestamps = data.get('include_timestamps', True)
+    logger.info(f"Timestamp preference: {'include' if include_timestamps else 'exclude'}")
+
+    # Identical uploads transcribed with the same options share one job
+    content_hash = temp_file['content_hash']
+    dedupe_key = f"transcribe:{transcript_cache_key(content_hash, include_timestamps)}" if content_hash else None
+
+    # The file name, when the client sends it, labels the transcript in the store
+    return submit_job_response('transcribe', run_transcription_async if ASYNC_JOBS else run_transcription,
+                               file_id, temp_path, include_timestamps, content_hash, data.get('title'),
+                               file_id=file_id, dedupe_key=dedupe_key)
+
+def run_youtube_transcription(youtube_url, include_timestamps):
+    """Job task: download the audio of a YouTube video and transcribe it"""
+    # Videos transcribed before are answered from the cache without contacting YouTube
+    cache_key, result = cached_youtube_result(youtube_url, include_timestamps)
+    if result is None:
+        # Download the audio, or reuse an earlier download of the same video, and transcribe it
+        result = download_and_transcribe(youtube_url, include_timestamps, on_text=partial_text_reporter())
+        if cache_key:
+            result_cache.set(cache_key, result)
+    return store_youtube_result(youtube_url, cache_key, result)
+
+async def run_youtube_transcription_async(youtube_url, include_timestamps):
+    """Async job task: download the audio of a YouTube video and transcribe it"""
+    cache_key, result = await asyncio.to_thread(cached_youtube_result, youtube_url, include_timestamps)
+    if result is None:
+        result = await download_and_transcribe_async(youtube_url, include_timestamps, on_text=partial_text_reporter())
+        if cache_key:
+            await asyncio.to_thread(result_cache.set, cache_key, result)
+    return await asyncio.to_thread(store_youtube_result, youtube_url, cache_key, result)
+
+def cached_youtube_result(youtube_url, include_timestamps):
+    """Return the result cache key of a video and its cached transcript, or None for the transcript"""
+    video_id = extract_video_id(youtube_url)
+    cache_key = transcript_cache_key(f"youtube:{video_id}", include_timestamps) if video_id else None
+    result = result_cache.get(cache_key) if cache_key else None
+    if result is not None:
+        logger.info(f"YouTube transcript found in cache: {result['title']}")
+    return cache_key, result
+
+def store_youtube_result(youtube_url, cache_key, result):
+    """Store the transcript of a video and return the job result"""
+    content_key = f"transcribe_youtube:{cache_key}" if cache_key else None
+    result['document_id'] = store_result('transcribe_youtube', result['transcript'], content_key,
+                                         result['title'], youtube_url)
+    return result
 
 @app.route('/transcribe_youtube', methods=['POST'])
 def transcribe_youtube():
@@ -161,100 +384,49 @@ def transcribe_youtube():
     if not re.match(youtube_pattern, youtube_url):
         return jsonify({'error': 'Invalid YouTube URL format'}), 400
     
+    # Get timestamp preference from request
+    include_timestamps = data.get('include_timestamps', True)
+    logger.info(f"Timestamp preference: {'include' if include_timestamps else 'exclude'}")
+
+    # Requests for the same video with the same options share one download and transcription
+    video_id = extract_video_id(youtube_url)
+    dedupe_key = f"transcribe_youtube:{transcript_cache_key(f'youtube:{video_id}', include_timestamps)}"
+
+    return submit_job_response('transcribe_youtube',
+                               run_youtube_transcription_async if ASYNC_JOBS else run_youtube_transcription,
+                               youtube_url, include_timestamps, dedupe_key=dedupe_key)
+
+def run_image_ocr(filename, image_path, content_hash):
+    """Job task: OCR an uploaded image and drop it once done"""
     try:
-        # Get timestamp preference from request
-        include_timestamps = data.get('include_timestamps', True)
-        logger.info(f"Timestamp preference: {'include' if include_timestamps else 'exclude'}")
-        
-        # Download audio from YouTube
-        logger.info(f"Downloading audio from YouTube: {youtube_url}")
-        
-        # Create a temporary directory for the download
-        temp_dir = tempfile.mkdtemp()
-        
-        # Simplified approach - create a more predictable output file
-        output_template = os.path.join(temp_dir, 'audio.mp3')
-        
-        # Define options for yt-dlp - simple approach without ffmpeg dependency
-        ydl_opts = {
-            # Extract audio only - use a format that doesn't need conversion
-            'format': 'bestaudio[ext=m4a]/bestaudio[ext=mp3]/bestaudio',
-            # Fixed output name to avoid path issues
-            'outtmpl': os.path.join(temp_dir, 'audio.%(ext)s'),
-            # No post-processing to avoid ffmpeg dependency
-            # 'postprocessors': [],
-            'writethumbnail': False,
-            'noplaylist': True,
-        }
-        
-        # Download the video and extract audio
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info_dict = ydl.extract_info(youtube_url, download=True)
-                video_title = info_dict.get('title', 'Unknown Title')
-                logger.info(f"Downloaded and extracted audio from: {video_title}")
-        except Exception as e:
-            logger.error(f"Error during YouTube download: {str(e)}")
-            raise
-        
-        # Find any audio file in the temp directory
-        logger.info(f"Searching for downloaded audio files in: {temp_dir}")
-        files = os.listdir(temp_dir)
-        logger.info(f"Files in directory: {files}")
-        
-        if not files:
-            raise Exception("No files found after YouTube download")
-        
-        # Check for common audio extensions first
-        for ext in ['.m4a', '.mp3', '.webm', '.opus', '.ogg']:
-            for file in files:
-                if file.endswith(ext):
-                    final_temp_path = os.path.join(temp_dir, file)
-                    logger.info(f"Found audio file with {ext} extension: {final_temp_path}")
-                    break
-            if 'final_temp_path' in locals():
-                break
-        
-        # If no audio file with known extension, just use the first file
-        if 'final_temp_path' not in locals():
-            final_temp_path = os.path.join(temp_dir, files[0])
-            logger.info(f"No known audio format found, using first file: {final_temp_path}")
-        
-        # Process the audio file
-        logger.info(f"Transcribing YouTube audio: {video_title}")
-        transcript = transcribe_audio(final_temp_path, include_timestamps)
-        logger.info(f"YouTube audio transcribed successfully: {video_title}")
-        
-        # Delete the temporary files after processing
-        try:
-            # Remove the temp file we used
-            if os.path.exists(final_temp_path):
-                os.unlink(final_temp_path)
-                logger.info(f"Deleted temp file: {final_temp_path}")
-            
-            # Clean up any other files in the temp directory
-            for f in os.listdir(temp_dir):
-                try:
-                    file_path = os.path.join(temp_dir, f)
-                    if os.path.isfile(file_path):
-                        os.unlink(file_path)
-                        logger.info(f"Deleted additional temp file: {file_path}")
-                except Exception as e:
-                    logger.warning(f"Could not delete temp file {f}: {str(e)}")
+        # Process the image
+        with open_image(image_path) as image:
+            logger.info(f"Image loaded successfully: {filename}")
             
-            # Remove the temp directory
-            os.rmdir(temp_dir)
-            logger.info(f"Deleted temp directory: {temp_dir}")
-        except Exception as e:
-            logger.warning(f"Could not delete all temp files: {str(e)}")
-        
-        return jsonify({'transcript': transcript, 'title': video_title}), 200
-    except yt_dlp.utils.DownloadError as e:
-        logger.error(f"YouTube download error: {str(e)}")
-        return jsonify({'error': f'Error downloading YouTube video: {str(e)}'}), 400
-    except Exception as e:
-        logger.error(f"Error transcribing YouTube audio: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+            # Process the image with OCR, keyed on the uploaded bytes for caching
+            extracted_text = ocr_image(image, content_hash=content_hash, on_text=partial_text_reporter(),
+                                       input_bytes=os.path.getsize(image_path))
+    finally:
+        remove_file(image_path)
+    return store_image_result(filename, content_hash, extracted_text)
+
+async def run_image_ocr_async(filename, image_path, content_hash):
+    """Async job task: OCR an uploaded image and drop it once done"""
+    try:
+        image = await asyncio.to_thread(open_image, image_path)
+        with image:
+            logger.info(f"Image loaded successfully: {filename}")
+            extracted_text = await ocr_image_async(image, content_hash=content_hash, on_text=partial_text_reporter(),
+                                                   input_bytes=await asyncio.to_thread(os.path.getsize, image_path))
+    finally:
+        await asyncio.to_thread(remove_file, image_path)
+    return await asyncio.to_thread(store_image_result, filename, content_hash, extracted_text)
+
+def store_image_result(filename, content_hash, extracted_text):
+    """Store the text of an image and return the job result"""
+    logger.info(f"OCR processing complete for image: {filename}")
+    document_id = store_result('ocr_image', extracted_text, f"ocr_image:{content_hash}", filename)
+    return {'text': extracted_text, 'document_id': document_id}
 
 # OCR Image processing
 @app.route('/ocr_image', methods=['POST'])
@@ -270,30 +442,40 @@ def process_image_ocr():
     allowed_extensions = {'jpg', 'jpeg', 'png', 'webp', 'heic', 'heif'}
     if '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() not in allowed_extensions:
         return jsonify({'error': 'Unsupported file format'}), 400
+    if file.filename.rsplit('.', 1)[1].lower() in ('heic', 'heif') and not heif_supported():
+        return jsonify({'error': 'HEIC images are not supported by this server, please upload a JPG or PNG'}), 400
 
-    # Check file size (20MB limit)
-    MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB in bytes
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
+    # Hand the streamed upload over to the job, it deletes the file once done
+    image_path, content_hash, _ = claim_upload(file)
 
-    if file_size > MAX_FILE_SIZE:
-        logger.warning(f"File too large: {file.filename}, size: {file_size/1024/1024:.2f}MB")
-        return jsonify({'error': f'File too large. Maximum size is 20MB. Your file is {file_size/1024/1024:.2f}MB.'}), 400
+    # Identical images share one job
+    return submit_job_response('ocr_image', run_image_ocr_async if ASYNC_JOBS else run_image_ocr,
+                               file.filename, image_path, content_hash, temp_path=image_path,
+                               dedupe_key=f"ocr_image:{content_hash}")
 
+def run_pdf_ocr(filename, pdf_path, content_hash):
+    """Job task: OCR an uploaded PDF and drop it once done"""
+    # Process the PDF, reading the text layer where possible and OCR elsewhere
     try:
-        # Process the image
-        image = PIL.Image.open(file)
-        logger.info(f"Image loaded successfully: {file.filename}")
-        
-        # Process the image with OCR
-        extracted_text = ocr_image(image)
-        logger.info(f"OCR processing complete for image: {file.filename}")
-        
-        return jsonify({'text': extracted_text}), 200
-    except Exception as e:
-        logger.error(f"Error processing image: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+        result = ocr_pdf_detailed(pdf_path, on_text=partial_text_reporter(), content_hash=content_hash)
+    finally:
+        remove_file(pdf_path)
+    return store_pdf_result(filename, content_hash, result)
+
+async def run_pdf_ocr_async(filename, pdf_path, content_hash):
+    """Async job task: OCR an uploaded PDF and drop it once done"""
+    try:
+        result = await ocr_pdf_detailed_async(pdf_path, on_text=partial_text_reporter(), content_hash=content_hash)
+    finally:
+        await asyncio.to_thread(remove_file, pdf_path)
+    return await asyncio.to_thread(store_pdf_result, filename, content_hash, result)
+
+def store_pdf_result(filename, content_hash, result):
+    """Store the text of a PDF and return the job result"""
+    logger.info(f"OCR processing complete for PDF: {filename} "
+                f"({result['text_layer_pages']} pages from text layer, {result['ocr_pages']} pages OCR'd)")
+    result['document_id'] = store_result('ocr_pdf', result['text'], f"ocr_pdf:{content_hash}", filename)
+    return result
 
 # OCR PDF processing
 @app.route('/ocr_pdf', methods=['POST'])
@@ -309,29 +491,14 @@ def process_pdf_ocr():
     if '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() != 'pdf':
         return jsonify({'error': 'Unsupported file format. Only PDF files are allowed.'}), 400
 
-    # Check file size (20MB limit)
-    MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB in bytes
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
+    # Hand the streamed upload over to the job, it deletes the file once done
+    pdf_path, content_hash, file_size = claim_upload(file)
+    logger.info(f"PDF received successfully: {file.filename} ({file_size/1024/1024:.2f}MB)")
 
-    if file_size > MAX_FILE_SIZE:
-        logger.warning(f"File too large: {file.filename}, size: {file_size/1024/1024:.2f}MB")
-        return jsonify({'error': f'File too large. Maximum size is 20MB. Your file is {file_size/1024/1024:.2f}MB.'}), 400
-
-    try:
-        # Read the PDF content
-        pdf_content = file.read()
-        logger.info(f"PDF loaded successfully: {file.filename}")
-        
-        # Process the PDF with OCR
-        extracted_text = ocr_pdf(pdf_content)
-        logger.info(f"OCR processing complete for PDF: {file.filename}")
-        
-        return jsonify({'text': extracted_text}), 200
-    except Exception as e:
-        logger.error(f"Error processing PDF: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+    # Identical PDFs share one job
+    return submit_job_response('ocr_pdf', run_pdf_ocr_async if ASYNC_JOBS else run_pdf_ocr,
+                               file.filename, pdf_path, content_hash, temp_path=pdf_path,
+                               dedupe_key=f"ocr_pdf:{content_hash}")
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+import re
+from a2wsgi import WSGIMiddleware
+from app import app
+from ingest import UPLOAD_LIMITS, MULTIPART_OVERHEAD
+from jobs import get_job, wait_for_job_update_async, JobEventStream
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# ASGI entry point of the async serving mode (SERVER_MODE=async), run with
+# uvicorn workers. Job event streams are served natively on the event loop so
+# a worker can hold hundreds of them open, every other route is handled by the
+# Flask app in a thread pool
+EVENTS_PATH = re.compile(r'^/jobs/([^/]+)/events$')
+MAX_REQUEST_BYTES = max(UPLOAD_LIMITS.values()) + MULTIPART_OVERHEAD
+WSGI_THREADS = 16  # Flask requests handled at the same time per worker, as many as a threaded worker serves
+
+# Each request runs on its own pool thread with its body streamed in, so slow uploads,
+# chunk hashing and polling do not wait for each other
+flask_application = WSGIMiddleware(app, workers=WSGI_THREADS)
+
+
+async def send_json(send, status, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'access-control-allow-origin', b'*')],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def job_events(job_id, receive, send):
+    """Stream server-sent events for a job until it finishes or the client goes away"""
+    if await asyncio.to_thread(get_job, job_id) is None:
+        await send_json(send, 404, {'error': 'Invalid or expired job ID'})
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+            (b'access-control-allow-origin', b'*'),
+        ],
+    })
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        stream = JobEventStream(job_id)
+        while not stream.finished and not disconnected.done():
+            job = await wait_for_job_update_async(job_id, stream.version, timeout=15)
+            for event in stream.events(job):
+                await send({'type': 'http.response.body', 'body': event.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            logger.info("Async serving mode started")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    if scope['type'] == 'http':
+        match = EVENTS_PATH.match(scope['path'])
+        if match and scope['method'] == 'GET':
+            await job_events(match.group(1), receive, send)
+            return
+
+        # Refuse uploads over every limit before reading any of their body
+        content_length = dict(scope['headers']).get(b'content-length')
+        if content_length and content_length.isdigit() and int(content_length) > MAX_REQUEST_BYTES:
+            await send_json(send, 413, {'error': f"Upload too large, the limit is {MAX_REQUEST_BYTES // (1024 * 1024)}MB"})
+            return
+
+    await flask_application(scope, receive, send)
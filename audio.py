@@ -0,0 +1,220 @@
+import logging
+import os
+import re
+import shutil
+import subprocess
+import time
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# ffmpeg is optional, features relying on it are skipped when it is not installed
+FFMPEG_BIN = os.getenv('FFMPEG_BIN', 'ffmpeg')
+
+# Speech encoding: mono Opus at a speech sample rate, plenty for transcription
+SPEECH_SAMPLE_RATE = int(os.getenv('SPEECH_SAMPLE_RATE', '16000'))  # Hz, Opus accepts 8000, 12000, 16000, 24000 or 48000
+SPEECH_BITRATE_KBPS = int(os.getenv('SPEECH_BITRATE_KBPS', '32'))  # Opus bitrate of transcoded audio
+SPEECH_EXTENSION = 'ogg'
+SPEECH_CODEC_ARGS = ['-vn', '-ac', '1', '-ar', str(SPEECH_SAMPLE_RATE), '-c:a', 'libopus', '-b:a', f'{SPEECH_BITRATE_KBPS}k']
+
+# Chunks are re-encoded for speech as well, so cuts are sample accurate and uploads stay small
+CHUNK_EXTENSION = SPEECH_EXTENSION
+CHUNK_CODEC_ARGS = SPEECH_CODEC_ARGS
+
+DURATION_PATTERN = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+SILENCE_START_PATTERN = re.compile(r'silence_start: (-?\d+(?:\.\d+)?)')
+SILENCE_END_PATTERN = re.compile(r'silence_end: (\d+(?:\.\d+)?)')
+
+
+def ffmpeg_available():
+    """Return True if the ffmpeg binary can be found"""
+    return shutil.which(FFMPEG_BIN) is not None
+
+
+def _run_ffmpeg(args, check=True):
+    """Run ffmpeg with the given arguments and return its stderr output"""
+    result = subprocess.run(
+        [FFMPEG_BIN, '-hide_banner', '-nostdin'] + args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors='replace'
+    )
+    if check and result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[-500:]}")
+    return result.stderr
+
+
+def probe_duration(filepath):
+    """Return the duration of an audio file in seconds, or None if it cannot be determined"""
+    # ffmpeg exits with an error when no output is given, but still prints the input details
+    output = _run_ffmpeg(['-i', filepath], check=False)
+    match = DURATION_PATTERN.search(output)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def detect_silences(filepath, noise_db=-35, min_silence=0.4):
+    """Find silent stretches in an audio file
+
+    Returns:
+        list: (start, end) tuples in seconds
+    """
+    output = _run_ffmpeg([
+        '-i', filepath,
+        '-af', f'silencedetect=noise={noise_db}dB:d={min_silence}',
+        '-f', 'null', '-'
+    ])
+    starts = [max(0.0, float(value)) for value in SILENCE_START_PATTERN.findall(output)]
+    ends = [float(value) for value in SILENCE_END_PATTERN.findall(output)]
+    return list(zip(starts, ends))
+
+
+def plan_chunks(duration, chunk_seconds, silences=None, search_window=None):
+    """Split a duration into consecutive chunks of roughly chunk_seconds
+
+    When silences are given, each boundary moves to the middle of the silence
+    closest to the fixed-window boundary (within search_window seconds), so
+    words are not cut in half.
+
+    Returns:
+        list: (start, end) tuples in seconds covering the whole duration
+    """
+    if search_window is None:
+        search_window = chunk_seconds / 5
+    midpoints = [(start + end) / 2 for start, end in (silences or [])]
+
+    boundaries = [0.0]
+    while duration - boundaries[-1] > chunk_seconds * 1.25:
+        target = boundaries[-1] + chunk_seconds
+        candidates = [point for point in midpoints
+                      if abs(point - target) <= search_window and point > boundaries[-1]]
+        boundaries.append(min(candidates, key=lambda point: abs(point - target)) if candidates else target)
+    boundaries.append(duration)
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def extract_segment(filepath, start, duration, output_path):
+    """Write [start, start + duration) of an audio file to output_path as a speech chunk"""
+    _run_ffmpeg([
+        '-ss', f'{start:.3f}',
+        '-i', filepath,
+        '-t', f'{duration:.3f}',
+        *CHUNK_CODEC_ARGS,
+        '-y', output_path
+    ])
+    return output_path
+
+
+def transcode_for_speech(filepath, output_path):
+    """Downmix, resample and re-encode a whole audio file for speech recognition"""
+    _run_ffmpeg([
+        '-i', filepath,
+        *SPEECH_CODEC_ARGS,
+        '-y', output_path
+    ])
+    return output_path
+
+
+def prepend_tail(previous_path, path, seconds, output_path):
+    """Write the last seconds of one audio file followed by the whole of the next to output_path as a speech chunk"""
+    _run_ffmpeg([
+        '-sseof', f'-{seconds:.3f}',
+        '-i', previous_path,
+        '-i', path,
+        '-filter_complex', '[0:a][1:a]concat=n=2:v=0:a=1[a]',
+        '-map', '[a]',
+        *CHUNK_CODEC_ARGS,
+        '-y', output_path
+    ])
+    return output_path
+
+
+class SegmentWriter:
+    """Cuts audio into chunks while it is still arriving
+
+    Data written to it is piped through ffmpeg's segment muxer, which closes a
+    chunk every segment_seconds. The audio is copied into Matroska chunks as is,
+    encoding it for speech is left to whoever processes the chunks, so it can
+    run in parallel. This needs a container that can be read front to back,
+    like the fragmented MP4 and WebM audio YouTube serves, MP3 or WAV.
+    """
+
+    def __init__(self, directory, segment_seconds):
+        self.directory = directory
+        self.failed = False
+        self.closed = False
+        self._list_path = os.path.join(directory, 'segments.csv')
+        self._log_path = os.path.join(directory, 'ffmpeg.log')
+        with open(self._log_path, 'w') as log:
+            self._process = subprocess.Popen(
+                # -xerror makes ffmpeg fail on audio it cannot read instead of ending the chunks early
+                [FFMPEG_BIN, '-hide_banner', '-nostdin', '-loglevel', 'error', '-xerror',
+                 '-i', 'pipe:0',
+                 '-vn', '-c:a', 'copy',
+                 '-f', 'segment',
+                 '-segment_format', 'matroska',
+                 '-segment_time', str(segment_seconds),
+                 '-segment_list', self._list_path,
+                 '-segment_list_type', 'csv',
+                 '-reset_timestamps', '1',
+                 os.path.join(directory, 'segment%04d.mka')],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=log
+            )
+
+    def _error(self):
+        self.failed = True
+        with open(self._log_path, 'r', errors='replace') as log:
+            return RuntimeError(f"ffmpeg failed: {log.read().strip()[-500:]}")
+
+    def write(self, data):
+        try:
+            self._process.stdin.write(data)
+        except BrokenPipeError:
+            raise self._error()
+
+    def close(self):
+        """Signal the end of the audio, ffmpeg then finishes the last chunk"""
+        self.closed = True
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    def abort(self):
+        self._process.kill()
+        self.close()
+
+    def segments(self, poll_interval=0.2):
+        """Yield (path, start, end) of each chunk once ffmpeg finished it, in order
+
+        Raises:
+            RuntimeError: If ffmpeg could not read the audio or was aborted
+        """
+        position = 0
+        while True:
+            # Check before reading, so the chunks listed last are seen once ffmpeg exits
+            exited = self._process.poll() is not None
+            if exited and self._process.returncode != 0:
+                raise self._error()
+            try:
+                with open(self._list_path, 'r') as f:
+                    listing = f.read()
+            except FileNotFoundError:
+                listing = ''
+            # Only lines ending in a newline are complete
+            complete = listing[:listing.rfind('\n') + 1]
+            for line in complete[position:].splitlines():
+                name, start, end = line.rsplit(',', 2)
+                if float(end) > float(start):
+                    yield os.path.join(self.directory, name), float(start), float(end)
+            position = len(complete)
+
+            if exited:
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,222 @@
+import asyncio
+import itertools
+import os
+import random
+import threading
+import time
+import types
+from google.genai import errors
+
+# Stand-ins for the Gemini client and yt-dlp, so benchmarks measure this
+# service without spending quota or depending on the network
+
+
+class FakeGeminiConfig:
+    """Behaviour of the fake Gemini API
+
+    Args:
+        latency: Seconds a request takes before the response starts
+        jitter: Up to this many seconds are added to the latency at random
+        rate_429: Share of requests (0-1) answered with a 429 rate limit error
+        retry_delay: Seconds the 429 errors ask the client to wait
+        stream_chunks: Chunks a streamed response is split into
+        chunk_delay: Seconds between streamed chunks
+        upload_mbps: Simulated upload bandwidth in MB/s, 0 for instant uploads
+    """
+
+    def __init__(self, latency=0.5, jitter=0.1, rate_429=0.0, retry_delay=1.0,
+                 stream_chunks=5, chunk_delay=0.05, upload_mbps=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_delay = retry_delay
+        self.stream_chunks = stream_chunks
+        self.chunk_delay = chunk_delay
+        self.upload_mbps = upload_mbps
+
+
+class FakeGeminiClient:
+    """Mimics the parts of google.genai.Client used by this service, including client.aio"""
+
+    def __init__(self, config):
+        self.config = config
+        self.stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'rate_limited': 0, 'uploads': 0, 'deletes': 0}
+        self.files = _FakeFiles(self)
+        self.models = _FakeModels(self)
+        self.aio = types.SimpleNamespace(files=_FakeAsyncFiles(self.files), models=_FakeAsyncModels(self.models))
+
+    def count(self, counter):
+        with self.stats_lock:
+            self.stats[counter] += 1
+
+    def delay(self):
+        return self.config.latency + random.uniform(0, self.config.jitter)
+
+    def check_rate_limit(self):
+        """Count a request and raise a 429 like the real API for the configured share of them"""
+        self.count('requests')
+        if random.random() < self.config.rate_429:
+            self.count('rate_limited')
+            raise errors.ClientError(429, {'error': {
+                'code': 429,
+                'message': 'Resource has been exhausted (e.g. check quota).',
+                'status': 'RESOURCE_EXHAUSTED',
+                'details': [{
+                    '@type': 'type.googleapis.com/google.rpc.RetryInfo',
+                    'retryDelay': f"{self.config.retry_delay:g}s",
+                }],
+            }}, None)
+
+    def response_text(self, contents):
+        """A deterministic transcript-like text, longer for bigger inputs"""
+        words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit']
+        return ' '.join(words[index % len(words)] for index in range(40 + 10 * len(contents)))
+
+    def chunks(self, contents):
+        text = self.response_text(contents)
+        size = max(1, len(text) // self.config.stream_chunks + 1)
+        return [text[start:start + size] for start in range(0, len(text), size)]
+
+
+class _FakeFiles:
+    def __init__(self, client):
+        self.client = client
+        self.names = itertools.count()
+        self.uploaded = {}
+        self.lock = threading.Lock()
+
+    def upload_delay(self, file):
+        if not self.client.config.upload_mbps:
+            return 0
+        return os.path.getsize(file) / (self.client.config.upload_mbps * 1024 * 1024)
+
+    def register(self, file, config):
+        self.client.count('uploads')
+        name = f"files/benchmark-{next(self.names)}"
+        mime_type = (config or {}).get('mime_type', 'application/octet-stream')
+        remote_file = types.SimpleNamespace(name=name, uri=f"https://example.invalid/{name}", mime_type=mime_type,
+                                            expiration_time=None, create_time=None)
+        with self.lock:
+            self.uploaded[name] = remote_file
+        return remote_file
+
+    def upload(self, file=None, config=None):
+        self.client.check_rate_limit()
+        time.sleep(self.upload_delay(file))
+        return self.register(file, config)
+
+    def get(self, name=None):
+        with self.lock:
+            if name not in self.uploaded:
+                raise errors.ClientError(404, {'error': {'code': 404, 'message': 'File not found', 'status': 'NOT_FOUND'}}, None)
+            return self.uploaded[name]
+
+    def delete(self, name=None):
+        self.client.count('deletes')
+        with self.lock:
+            self.uploaded.pop(name, None)
+
+    def list(self):
+        # A single page, shaped like the SDK's pager
+        with self.lock:
+            return types.SimpleNamespace(page=list(self.uploaded.values()), config={})
+
+
+class _FakeModels:
+    def __init__(self, client):
+        self.client = client
+
+    def generate_content(self, model=None, contents=None):
+        self.client.check_rate_limit()
+        time.sleep(self.client.delay())
+        return types.SimpleNamespace(text=self.client.response_text(contents))
+
+    def generate_content_stream(self, model=None, contents=None):
+        self.client.check_rate_limit()
+        time.sleep(self.client.delay())
+        for chunk in self.client.chunks(contents):
+            yield types.SimpleNamespace(text=chunk)
+            time.sleep(self.client.config.chunk_delay)
+
+
+class _FakeAsyncFiles:
+    def __init__(self, files):
+        self.files = files
+
+    async def upload(self, file=None, config=None):
+        self.files.client.check_rate_limit()
+        await asyncio.sleep(self.files.upload_delay(file))
+        return self.files.register(file, config)
+
+    async def get(self, name=None):
+        return self.files.get(name)
+
+    async def delete(self, name=None):
+        self.files.delete(name)
+
+
+class _FakeAsyncModels:
+    def __init__(self, models):
+        self.client = models.client
+
+    async def generate_content(self, model=None, contents=None):
+        self.client.check_rate_limit()
+        await asyncio.sleep(self.client.delay())
+        return types.SimpleNamespace(text=self.client.response_text(contents))
+
+    async def generate_content_stream(self, model=None, contents=None):
+        self.client.check_rate_limit()
+        await asyncio.sleep(self.client.delay())
+
+        async def stream():
+            for chunk in self.client.chunks(contents):
+                yield types.SimpleNamespace(text=chunk)
+                await asyncio.sleep(self.client.config.chunk_delay)
+
+        return stream()
+
+
+class FakeYoutubeDL:
+    """Stands in for yt_dlp.YoutubeDL, "downloading" a copy of a local audio file
+
+    Set FakeYoutubeDL.source to the audio file, FakeYoutubeDL.delay to the
+    download time and FakeYoutubeDL.duration to the length reported for the
+    video. Like yt-dlp, the copy grows in a .part file over the download time,
+    with progress hooks called along the way.
+    """
+
+    source = None
+    delay = 1.0
+    duration = None
+    pieces = 20
+
+    def __init__(self, options):
+        self.options = options
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def extract_info(self, url, download=True):
+        extension = os.path.splitext(self.source)[1].lstrip('.')
+        path = self.options['outtmpl'] % {'ext': extension}
+        info = {'title': f"Benchmark video {url[-11:]}", 'format_id': 'fake', 'abr': 48, 'duration': self.duration}
+        hooks = self.options.get('progress_hooks', [])
+        with open(self.source, 'rb') as f:
+            data = f.read()
+        piece_size = -(-len(data) // self.pieces) or 1
+        with open(path + '.part', 'wb') as target:
+            for offset in range(0, len(data), piece_size):
+                target.write(data[offset:offset + piece_size])
+                target.flush()
+                for hook in hooks:
+                    hook({'status': 'downloading', 'filename': path, 'tmpfilename': path + '.part',
+                          'downloaded_bytes': min(offset + piece_size, len(data)), 'total_bytes': len(data), 'info_dict': info})
+                time.sleep(self.delay / self.pieces)
+        os.rename(path + '.part', path)
+        for hook in hooks:
+            hook({'status': 'finished', 'filename': path, 'total_bytes': len(data), 'info_dict': info})
+        return info
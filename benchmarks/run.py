@@ -0,0 +1,336 @@
+"""Load-test the Flask routes against a local Gemini stand-in
+
+Each scenario runs in its own process, so peak RSS is measured per scenario.
+Jobs are submitted through the HTTP routes and followed through their event
+stream until they finish, at the requested concurrency.
+
+Usage:
+    python benchmarks/run.py --scenarios ocr_image,transcribe --requests 50 --concurrency 8 --output after.json
+    python benchmarks/run.py --rate-429 0.05 --compare before.json --output after.json
+"""
+import argparse
+import concurrent.futures
+import datetime
+import io
+import json
+import math
+import os
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+SCENARIOS = ('ocr_image', 'ocr_pdf', 'transcribe', 'transcribe_youtube')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated scenarios to run')
+    parser.add_argument('--requests', type=int, default=40, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at the same time')
+    parser.add_argument('--server-mode', choices=('sync', 'async'), default='sync', help='SERVER_MODE of the app')
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds before a fake Gemini response starts')
+    parser.add_argument('--jitter', type=float, default=0.1, help='Random extra latency, in seconds')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='Share of fake Gemini requests answered with 429')
+    parser.add_argument('--retry-delay', type=float, default=1.0, help='Seconds the 429 errors ask to wait')
+    parser.add_argument('--stream-chunks', type=int, default=5, help='Chunks per streamed response')
+    parser.add_argument('--chunk-delay', type=float, default=0.05, help='Seconds between streamed chunks')
+    parser.add_argument('--upload-mbps', type=float, default=0, help='Fake Gemini upload bandwidth in MB/s, 0 for instant')
+    parser.add_argument('--download-delay', type=float, default=1.0, help='Seconds a fake YouTube download takes')
+    parser.add_argument('--image-megapixels', type=float, default=12, help='Size of the benchmark image')
+    parser.add_argument('--pdf-pages', type=int, default=8, help='Pages of the benchmark PDF, all needing OCR')
+    parser.add_argument('--audio-seconds', type=int, default=60, help='Length of the benchmark recording')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--compare', help='Earlier JSON report to compare against')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--child-output', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def percentile(values, share):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(share * len(ordered)) - 1)]
+
+
+def make_image(directory, megapixels):
+    """A noisy photo-sized JPEG, so preprocessing does realistic work"""
+    import PIL.Image
+    width = int(math.sqrt(megapixels * 1_000_000 * 4 / 3))
+    height = int(width * 3 / 4)
+    image = PIL.Image.effect_noise((width, height), 40).convert('RGB')
+    path = os.path.join(directory, 'benchmark.jpg')
+    image.save(path, format='JPEG', quality=90)
+    return path
+
+
+def make_pdf(directory, pages):
+    """A PDF of blank pages, none of which has a text layer"""
+    from pypdf import PdfWriter
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=612, height=792)
+    path = os.path.join(directory, 'benchmark.pdf')
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return path
+
+
+def make_audio(directory, seconds):
+    """A 16kHz mono WAV with a tone, so ffmpeg has something to encode"""
+    path = os.path.join(directory, 'benchmark.wav')
+    sample_rate = 16000
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        period = [int(8000 * math.sin(2 * math.pi * 440 * index / sample_rate)) for index in range(sample_rate)]
+        second = struct.pack(f'<{sample_rate}h', *period)
+        for _ in range(seconds):
+            f.writeframes(second)
+    return path
+
+
+def configure_environment(args, directory):
+    """Settings for the app under test, real environment variables take precedence"""
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+    os.environ['SERVER_MODE'] = args.server_mode
+    os.environ.setdefault('REGISTRY_DB', os.path.join(directory, 'registry.db'))
+    os.environ.setdefault('YOUTUBE_CACHE_DIR', os.path.join(directory, 'youtube'))
+    os.environ.setdefault('TRANSCRIPT_STORE_DB', os.path.join(directory, 'transcripts.db'))
+    # Every request must reach the fake API, not an earlier result
+    os.environ.setdefault('RESULT_CACHE_ENABLED', 'false')
+    os.environ.setdefault('FILE_HANDLE_CACHE_TTL', '0')
+    # The fake has no quota, the rate limiter still applies to 429s it returns
+    os.environ.setdefault('GEMINI_RPM', '100000')
+    os.environ.setdefault('GEMINI_BURST', '1000')
+    os.environ.setdefault('GEMINI_MAX_CONCURRENCY', str(max(8, args.concurrency * 4)))
+    os.environ.setdefault('JOB_QUEUE_SIZE', str(max(32, args.requests)))
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+
+def install_fakes(args, audio_path):
+    """Swap the shared Gemini client and yt-dlp's downloader for the local stand-ins"""
+    import yt_dlp
+    from gemini_client import use_client
+    from fake_gemini import FakeGeminiClient, FakeGeminiConfig, FakeYoutubeDL
+
+    fake = FakeGeminiClient(FakeGeminiConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_429=args.rate_429,
+        retry_delay=args.retry_delay,
+        stream_chunks=args.stream_chunks,
+        chunk_delay=args.chunk_delay,
+        upload_mbps=args.upload_mbps,
+    ))
+    use_client(fake)
+    FakeYoutubeDL.source = audio_path
+    FakeYoutubeDL.delay = args.download_delay
+    FakeYoutubeDL.duration = args.audio_seconds
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+    return fake
+
+
+def wait_for_job(client, events_url):
+    """Follow a job's event stream and return its final status"""
+    response = client.get(events_url)
+    status = None
+    try:
+        buffer = ''
+        for chunk in response.response:
+            buffer += chunk.decode() if isinstance(chunk, bytes) else chunk
+            while '\n\n' in buffer:
+                event, buffer = buffer.split('\n\n', 1)
+                if event.startswith('event: status'):
+                    status = json.loads(event.split('data: ', 1)[1])['status']
+    finally:
+        response.close()
+    return status
+
+
+def unique_payload(path, index):
+    """The bytes of a fixture with the request index appended
+
+    Identical uploads in flight at the same time are merged into one job, so
+    each request sends different bytes to measure throughput rather than job
+    joining. JPEG, PDF and WAV readers all ignore the trailing line.
+    """
+    with open(path, 'rb') as f:
+        return io.BytesIO(f.read() + f"\n% benchmark request {index}\n".encode())
+
+
+def submit(client, scenario, index, fixtures):
+    """Send one request for a scenario, returning the HTTP response"""
+    if scenario == 'ocr_image':
+        return client.post('/ocr_image', data={'image': (unique_payload(fixtures['image'], index), f'benchmark-{index}.jpg')})
+    if scenario == 'ocr_pdf':
+        return client.post('/ocr_pdf', data={'pdf': (unique_payload(fixtures['pdf'], index), f'benchmark-{index}.pdf')})
+    if scenario == 'transcribe':
+        upload = client.post('/upload', data={'audio': (unique_payload(fixtures['audio'], index), f'benchmark-{index}.wav')})
+        if upload.status_code != 200:
+            return upload
+        return client.post('/transcribe', json={'file_id': upload.get_json()['file_id']})
+    if scenario == 'transcribe_youtube':
+        # A new video ID per request, so each one is downloaded
+        video_id = f"bench{index:06d}"[:11]
+        return client.post('/transcribe_youtube', json={'youtube_url': f"https://www.youtube.com/watch?v={video_id}"})
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def run_scenario(args, scenario):
+    """Run one scenario in this process and return its measurements"""
+    directory = tempfile.mkdtemp(prefix='voxlogai-benchmark-')
+    configure_environment(args, directory)
+    sys.path[:0] = [REPO_DIR, BENCHMARK_DIR]
+
+    fixtures = {'audio': make_audio(directory, args.audio_seconds)}
+    if scenario == 'ocr_image':
+        fixtures['image'] = make_image(directory, args.image_megapixels)
+    elif scenario == 'ocr_pdf':
+        fixtures['pdf'] = make_pdf(directory, args.pdf_pages)
+
+    import logging
+    from app import app
+    from gemini_client import gemini_stats
+    logging.getLogger().setLevel(logging.WARNING)
+    fake = install_fakes(args, fixtures['audio'])
+    client = app.test_client()
+
+    def one_request(index):
+        start_time = time.perf_counter()
+        response = submit(client, scenario, index, fixtures)
+        if response.status_code != 202:
+            return {'ok': False, 'error': f"HTTP {response.status_code}", 'seconds': time.perf_counter() - start_time}
+        status = wait_for_job(client, response.get_json()['events_url'])
+        return {'ok': status == 'done', 'error': None if status == 'done' else status,
+                'seconds': time.perf_counter() - start_time}
+
+    start_time = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(one_request, range(args.requests)))
+    duration = time.perf_counter() - start_time
+
+    latencies = [result['seconds'] * 1000 for result in results if result['ok']]
+    errors = {}
+    for result in results:
+        if not result['ok']:
+            errors[result['error']] = errors.get(result['error'], 0) + 1
+    gemini = gemini_stats()
+    return {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'succeeded': len(latencies),
+        'failed': args.requests - len(latencies),
+        'errors': errors,
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(len(latencies) / duration, 3) if duration else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 1) if latencies else None,
+            'p95': round(percentile(latencies, 0.95), 1) if latencies else None,
+            'p99': round(percentile(latencies, 0.99), 1) if latencies else None,
+            'mean': round(sum(latencies) / len(latencies), 1) if latencies else None,
+            'max': round(max(latencies), 1) if latencies else None,
+        },
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'gemini': {
+            'requests': fake.stats['requests'],
+            'rate_limited': fake.stats['rate_limited'],
+            'uploads': fake.stats['uploads'],
+            'retries': gemini['retries'],
+            'wait_ms': gemini['wait_ms'],
+        },
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(report, baseline):
+    """Print the change of each scenario's throughput and latency against an earlier report"""
+    print(f"\nCompared with {baseline.get('revision')} ({baseline.get('created')}):")
+    print(f"{'scenario':<20} {'metric':<16} {'before':>10} {'after':>10} {'change':>8}")
+    for scenario, result in report['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(scenario)
+        if not before:
+            continue
+        rows = [('throughput_rps', before['throughput_rps'], result['throughput_rps'])]
+        rows += [(f"{name} ms", before['latency_ms'][name], result['latency_ms'][name]) for name in ('p50', 'p95', 'p99')]
+        rows.append(('peak_rss_mb', before['peak_rss_mb'], result['peak_rss_mb']))
+        for metric, old, new in rows:
+            change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else 'n/a'
+            print(f"{scenario:<20} {metric:<16} {old if old is not None else '-':>10} {new if new is not None else '-':>10} {change:>8}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+
+    if args.child:
+        # The app logs to stdout, so results are handed back through a file
+        result = run_scenario(args, args.child)
+        with open(args.child_output, 'w') as f:
+            json.dump(result, f)
+        return
+
+    # Options shared with the child processes, minus the ones only the parent uses
+    child_args = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in ('--output', '--compare', '--scenarios'):
+            skip = True
+        elif not arg.startswith(('--output=', '--compare=', '--scenarios=')):
+            child_args.append(arg)
+
+    report = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'settings': {name: value for name, value in vars(args).items()
+                     if name not in ('output', 'compare', 'child', 'child_output')},
+        'scenarios': {},
+    }
+    for scenario in [name.strip() for name in args.scenarios.split(',') if name.strip()]:
+        if scenario not in SCENARIOS:
+            sys.exit(f"Unknown scenario {scenario}, choose from {', '.join(SCENARIOS)}")
+        print(f"Running {scenario}: {args.requests} requests, {args.concurrency} at a time...", file=sys.stderr)
+        with tempfile.NamedTemporaryFile(suffix='.json') as result_file:
+            process = subprocess.run([sys.executable, os.path.abspath(__file__), *child_args,
+                                      '--child', scenario, '--child-output', result_file.name],
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            if process.returncode != 0:
+                sys.exit(f"Scenario {scenario} failed:\n{process.stderr[-2000:]}")
+            result = json.load(result_file)
+        report['scenarios'][scenario] = result
+        print(f"  {result['throughput_rps']} req/s, p50 {result['latency_ms']['p50']}ms, "
+              f"p95 {result['latency_ms']['p95']}ms, p99 {result['latency_ms']['p99']}ms, "
+              f"peak RSS {result['peak_rss_mb']}MB, {result['failed']} failed", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Measure how fast a server process becomes ready
+
+Reports, as JSON:
+- cold start: importing the app in a fresh interpreter, and serving the first request
+- worker respawn: forking a process that already imported the app (as Gunicorn
+  does with preload_app), up to the child serving its first request
+- the modules imported by app.py that take longest to import
+
+Usage:
+    python benchmarks/startup.py --output after.json --compare before.json
+    python benchmarks/startup.py --max-import-ms 800   # exits with an error above this budget
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Runs in a fresh interpreter: time the import of the app and its first request
+COLD_START = """
+import json, sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+app.test_client().get('/')
+served = time.perf_counter()
+print(json.dumps({{'import_ms': (imported - start) * 1000, 'first_request_ms': (served - start) * 1000}}))
+"""
+
+# Runs in a fresh interpreter: import the app once, then time forked children serving a request
+RESPAWN = """
+import json, os, sys, time
+sys.path.insert(0, {repo!r})
+from app import app
+timings = []
+for _ in range({runs}):
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        response = app.test_client().get('/')
+        os._exit(0 if response.status_code == 200 else 1)
+    _, status = os.waitpid(pid, 0)
+    if status != 0:
+        sys.exit('Forked worker failed to serve a request')
+    timings.append((time.perf_counter() - start) * 1000)
+print(json.dumps({{'respawn_ms': timings}}))
+"""
+
+IMPORT_TIME_PATTERN = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Cold starts and respawns measured')
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports listed')
+    parser.add_argument('--max-import-ms', type=float, help='Fail if the median cold import takes longer')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--compare', help='Earlier JSON report to compare against')
+    return parser.parse_args(argv)
+
+
+def child_environment(directory):
+    environment = dict(os.environ)
+    environment.setdefault('GEMINI_API_KEY', 'benchmark')
+    environment.setdefault('REGISTRY_DB', os.path.join(directory, 'registry.db'))
+    environment.setdefault('TRANSCRIPT_STORE_DB', os.path.join(directory, 'transcripts.db'))
+    environment.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    return environment
+
+
+def run_python(code, environment, extra_args=()):
+    process = subprocess.run([sys.executable, *extra_args, '-c', code], cwd=REPO_DIR, env=environment,
+                             capture_output=True, text=True)
+    if process.returncode != 0:
+        sys.exit(f"Startup benchmark failed:\n{process.stderr[-2000:]}")
+    return process
+
+
+def slowest_imports(environment, top):
+    """Modules imported directly by app.py, slowest first, with their cumulative import time"""
+    process = run_python(f"import sys; sys.path.insert(0, {REPO_DIR!r}); import app", environment, ['-X', 'importtime'])
+    imports = []
+    for line in process.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        # Modules imported by app.py itself are indented by one level
+        if match and len(match.group(3)) == 2:
+            imports.append({'module': match.group(4), 'ms': round(int(match.group(2)) / 1000, 1)})
+    return sorted(imports, key=lambda entry: entry['ms'], reverse=True)[:top]
+
+
+def summary(values):
+    return {
+        'median': round(statistics.median(values), 1),
+        'min': round(min(values), 1),
+        'max': round(max(values), 1),
+    }
+
+
+def compare(report, baseline):
+    print(f"\nCompared with {baseline.get('revision')} ({baseline.get('created')}):")
+    print(f"{'metric':<24} {'before':>10} {'after':>10} {'change':>8}")
+    for metric in ('import_ms', 'first_request_ms', 'respawn_ms'):
+        old = baseline.get(metric, {}).get('median')
+        new = report[metric]['median']
+        change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+        print(f"{metric + ' (median)':<24} {old if old is not None else '-':>10} {new:>10} {change:>8}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    directory = tempfile.mkdtemp(prefix='voxlogai-startup-')
+    environment = child_environment(directory)
+
+    cold_starts = []
+    for _ in range(args.runs):
+        process = run_python(COLD_START.format(repo=REPO_DIR), environment)
+        cold_starts.append(json.loads(process.stdout.strip().splitlines()[-1]))
+    respawn = run_python(RESPAWN.format(repo=REPO_DIR, runs=args.runs), environment)
+
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+    except Exception:
+        revision = None
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'revision': revision,
+        'runs': args.runs,
+        'import_ms': summary([run['import_ms'] for run in cold_starts]),
+        'first_request_ms': summary([run['first_request_ms'] for run in cold_starts]),
+        'respawn_ms': summary(json.loads(respawn.stdout.strip().splitlines()[-1])['respawn_ms']),
+        'slowest_imports': slowest_imports(environment, args.top),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+    if args.max_import_ms and report['import_ms']['median'] > args.max_import_ms:
+        sys.exit(f"Median import time {report['import_ms']['median']}ms is over the {args.max_import_ms}ms budget")
+
+
+if __name__ == '__main__':
+    main()
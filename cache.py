@@ -0,0 +1,209 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Result cache configuration
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'voxlogai-cache'))
+RESULT_CACHE_MAX_MB = int(os.getenv('RESULT_CACHE_MAX_MB', '200'))  # Size cap for all cached results
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', str(7 * 24 * 60 * 60)))  # Seconds before an entry expires
+
+# Gemini file handle cache configuration
+FILE_HANDLE_CACHE_TTL = int(os.getenv('FILE_HANDLE_CACHE_TTL', str(60 * 60)))  # Seconds an uploaded file is reused
+FILE_HANDLE_EXPIRY_MARGIN = 10 * 60  # Stop reusing a remote file this long before Gemini expires it
+
+HASH_CHUNK_SIZE = 1024 * 1024  # Read files in 1MB blocks when hashing
+
+
+def hash_bytes(data):
+    """Return the SHA-256 hex digest of a bytes object"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(filepath):
+    """Return the SHA-256 hex digest of a file, reading it in blocks"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_key(content_hash, prompt, model):
+    """Build a cache key from the input content hash, the prompt and the model"""
+    return hash_bytes(f"{content_hash}\0{prompt}\0{model}".encode('utf-8'))
+
+
+class DiskCache:
+    """Directory of JSON entries with a size cap, TTL expiry and LRU eviction
+
+    Each entry is stored as <key>.json. The file modification time doubles as the
+    last-access time, so the cache can be shared by several processes without an index.
+    """
+
+    def __init__(self, directory, max_bytes, ttl, enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _expired(self, entry):
+        expires = entry.get("expires") or entry["created"] + self.ttl
+        return time.time() > expires
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._count('misses')
+            return None
+
+        if self._expired(entry):
+            logger.info(f"Cache entry expired: {key}")
+            self._remove(path)
+            self._count('misses')
+            return None
+
+        # Mark as recently used for LRU eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        self._count('hits')
+        return entry["value"]
+
+    def set(self, key, value, ttl=None):
+        """Store a JSON-serializable value under key and evict entries over the size cap
+
+        Args:
+            key: Cache key
+            value: JSON-serializable value
+            ttl: Seconds this entry stays valid (default: the cache TTL)
+        """
+        if not self.enabled:
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temp file first so readers never see a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                entry = {"created": time.time(), "value": value}
+                if ttl is not None:
+                    entry["expires"] = entry["created"] + ttl
+                json.dump(entry, f)
+            os.replace(temp_path, self._path(key))
+            self._evict()
+        except Exception as e:
+            logger.warning(f"Could not write cache entry {key}: {str(e)}")
+
+    def delete(self, key):
+        """Remove an entry if it exists"""
+        self._remove(self._path(key))
+
+    def values(self):
+        """Return the values of all entries that have not expired"""
+        values = []
+        for path, _, _ in self._entries():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            if not self._expired(entry):
+                values.append(entry["value"])
+        return values
+
+    def _entries(self):
+        """List (path, size, mtime) for every entry in the cache directory"""
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for item in it:
+                    if not item.name.endswith('.json'):
+                        continue
+                    try:
+                        stat = item.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((item.path, stat.st_size, stat.st_mtime))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _evict(self):
+        """Drop the least recently used entries until the cache fits in max_bytes"""
+        entries = self._entries()
+        total_size = sum(size for _, size, _ in entries)
+        if total_size <= self.max_bytes:
+            return
+
+        for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            self._remove(path)
+            self._count('evictions')
+            total_size -= size
+            if total_size <= self.max_bytes:
+                break
+        logger.info(f"Cache evicted entries, size now {total_size/1024/1024:.2f}MB")
+
+    def stats(self):
+        """Return hit/miss counters for this process and the current cache size"""
+        entries = self._entries()
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(entries),
+                'size_bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+            }
+
+
+# Shared cache for transcription and OCR results
+result_cache = DiskCache(
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_MAX_MB * 1024 * 1024,
+    RESULT_CACHE_TTL,
+    enabled=RESULT_CACHE_ENABLED
+)
+
+# Remote Gemini files by content, so the same audio is not uploaded twice
+file_handle_cache = DiskCache(
+    os.path.join(RESULT_CACHE_DIR, 'file-handles'),
+    10 * 1024 * 1024,
+    FILE_HANDLE_CACHE_TTL,
+    enabled=FILE_HANDLE_CACHE_TTL > 0
+)
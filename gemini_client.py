@@ -0,0 +1,369 @@
+import asyncio
+import contextlib
+import fcntl
+import logging
+import os
+import random
+import re
+import threading
+import time
+import httpx
+import requests
+from google import genai
+from google.genai import errors
+from registry import REGISTRY_DB, connect, register_schema
+from metrics import GEMINI_RETRIES
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Limits shared by every Gemini call from every server process on this host
+GEMINI_RPM = float(os.getenv('GEMINI_RPM', '60'))  # Requests per minute allowed by the quota
+GEMINI_BURST = int(os.getenv('GEMINI_BURST', '5'))  # Requests that may be sent back to back after a quiet period
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))  # Requests in flight at the same time
+GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '5'))  # Retries of rate limited and transient failures
+GEMINI_BACKOFF_MAX = float(os.getenv('GEMINI_BACKOFF_MAX', '60'))  # Longest wait between retries, in seconds
+GEMINI_ADMISSION_TIMEOUT = float(os.getenv('GEMINI_ADMISSION_TIMEOUT', '120'))  # Longest wait for capacity before giving up
+
+GEMINI_MIN_RATE_FRACTION = 0.1  # Rate limited bursts never throttle below this share of GEMINI_RPM
+GEMINI_RATE_RECOVERY = 0.05  # Share of GEMINI_RPM restored after each successful request
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+# Transport failures worth retrying: the SDK talks to the API over httpx, and google-auth
+# refreshes credentials over requests
+TRANSPORT_ERRORS = (httpx.TransportError, requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)
+
+LIMITER_NAME = 'gemini'
+SLOT_PATH = f"{REGISTRY_DB}.gemini-slot"
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS rate_limiter (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    rate REAL NOT NULL,
+    updated REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0
+);
+""")
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    'calls': 0,
+    'retries': 0,
+    'rate_limited': 0,
+    'overloaded': 0,
+    'wait_ms': 0,
+}
+
+
+class GeminiOverloadedError(Exception):
+    """Raised when a Gemini call cannot get capacity within GEMINI_ADMISSION_TIMEOUT"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__("Gemini API is busy, please try again in a moment")
+
+
+def get_client():
+    """Return the Gemini client shared by all modules, creating it on first use
+
+    A single client per process keeps one pool of HTTP connections for every
+    upload, generation and deletion. It is created in each server process after
+    Gunicorn forks, so connections are never shared between processes.
+
+    Raises:
+        ValueError: If GEMINI_API_KEY is not set
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid not in (None, os.getpid()):
+            api_key = os.getenv('GEMINI_API_KEY')
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY environment variable is not set")
+            _client = genai.Client(api_key=api_key)
+            _client_pid = os.getpid()
+            logger.info("Created Gemini client")
+        return _client
+
+
+def use_client(client):
+    """Replace the shared Gemini client, e.g. with a local stand-in for benchmarks
+
+    Unlike the client created by get_client, it is kept by forked worker processes.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        _client = client
+        _client_pid = None
+
+
+def _count(counter, amount=1):
+    with _stats_lock:
+        _stats[counter] += amount
+
+
+def _max_rate():
+    return GEMINI_RPM / 60
+
+
+def _update_bucket(take):
+    """Refill the shared token bucket and optionally take a token from it
+
+    Returns:
+        float: 0 if a token was taken, otherwise seconds until one is available
+    """
+    connection = connect()
+    now = time.time()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        row = connection.execute('SELECT * FROM rate_limiter WHERE name = ?', (LIMITER_NAME,)).fetchone()
+        if row is None:
+            tokens, rate, blocked_until = float(GEMINI_BURST), _max_rate(), 0.0
+        else:
+            rate, blocked_until = row['rate'], row['blocked_until']
+            tokens = min(float(GEMINI_BURST), row['tokens'] + max(0.0, now - row['updated']) * rate)
+
+        if now < blocked_until:
+            wait = blocked_until - now
+        elif tokens >= 1:
+            wait = 0.0
+            if take:
+                tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+
+        connection.execute(
+            'INSERT OR REPLACE INTO rate_limiter (name, tokens, rate, updated, blocked_until) VALUES (?, ?, ?, ?, ?)',
+            (LIMITER_NAME, tokens, rate, now, blocked_until)
+        )
+        connection.execute('COMMIT')
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+    return wait
+
+
+def _acquire_token(deadline):
+    """Wait for a token from the shared bucket, giving up at deadline"""
+    while True:
+        wait = _update_bucket(take=True)
+        if wait == 0:
+            return
+        if time.time() + wait > deadline:
+            _count('overloaded')
+            raise GeminiOverloadedError(retry_after=wait)
+        # Spread waiters out so they do not all come back at the same moment
+        time.sleep(wait + random.uniform(0, 0.1))
+
+
+async def _acquire_token_async(deadline):
+    """Awaitable variant of _acquire_token"""
+    while True:
+        # The bucket lives in SQLite, which may block briefly while another process holds the lock
+        wait = await asyncio.to_thread(_update_bucket, True)
+        if wait == 0:
+            return
+        if time.time() + wait > deadline:
+            _count('overloaded')
+            raise GeminiOverloadedError(retry_after=wait)
+        await asyncio.sleep(wait + random.uniform(0, 0.1))
+
+
+def _try_slot():
+    """Lock a free concurrency slot, returning its open file, or None if all are taken
+
+    Slots are locks on small files shared by all server processes, released by
+    the OS if the process dies.
+    """
+    first = random.randrange(GEMINI_MAX_CONCURRENCY)
+    for index in range(GEMINI_MAX_CONCURRENCY):
+        slot_file = open(f"{SLOT_PATH}.{(first + index) % GEMINI_MAX_CONCURRENCY}", 'a')
+        try:
+            fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return slot_file
+        except BlockingIOError:
+            slot_file.close()
+    return None
+
+
+def _release_slot(slot_file):
+    fcntl.flock(slot_file, fcntl.LOCK_UN)
+    slot_file.close()
+
+
+def _slot_unavailable(deadline):
+    if time.time() > deadline:
+        _count('overloaded')
+        raise GeminiOverloadedError(retry_after=5)
+    return random.uniform(0.05, 0.2)
+
+
+@contextlib.contextmanager
+def _concurrency_slot(deadline):
+    """Hold one of GEMINI_MAX_CONCURRENCY slots shared by all server processes"""
+    while (slot_file := _try_slot()) is None:
+        time.sleep(_slot_unavailable(deadline))
+    try:
+        yield
+    finally:
+        _release_slot(slot_file)
+
+
+@contextlib.asynccontextmanager
+async def _concurrency_slot_async(deadline):
+    """Awaitable variant of _concurrency_slot"""
+    while (slot_file := _try_slot()) is None:
+        await asyncio.sleep(_slot_unavailable(deadline))
+    try:
+        yield
+    finally:
+        _release_slot(slot_file)
+
+
+def _record_success():
+    """Restore the shared rate a little after a successful request"""
+    max_rate = _max_rate()
+    connect().execute(
+        'UPDATE rate_limiter SET rate = MIN(?, rate + ?) WHERE name = ? AND rate < ?',
+        (max_rate, max_rate * GEMINI_RATE_RECOVERY, LIMITER_NAME, max_rate)
+    )
+
+
+def _record_rate_limited(delay):
+    """Pause every process for delay seconds and halve the shared rate"""
+    max_rate = _max_rate()
+    connect().execute(
+        'UPDATE rate_limiter SET rate = MAX(?, rate / 2), tokens = MIN(tokens, 0), '
+        'blocked_until = MAX(blocked_until, ?) WHERE name = ?',
+        (max_rate * GEMINI_MIN_RATE_FRACTION, time.time() + delay, LIMITER_NAME)
+    )
+
+
+def _retry_after(error):
+    """Return the delay the API asked for in a rate limit error, or None"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if headers and headers.get('retry-after'):
+        try:
+            return float(headers.get('retry-after'))
+        except ValueError:
+            pass
+    # Gemini reports the delay as a RetryInfo detail, e.g. "retryDelay": "37s"
+    match = re.search(r"'retryDelay': '(\d+(?:\.\d+)?)s'", str(getattr(error, 'details', '')))
+    return float(match.group(1)) if match else None
+
+
+def _is_retryable(error):
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    # Connection resets, timeouts and other transport errors, but not bugs such as a TypeError
+    return isinstance(error, TRANSPORT_ERRORS)
+
+
+def _backoff(attempt):
+    """Exponential backoff with full jitter"""
+    return random.uniform(1, min(GEMINI_BACKOFF_MAX, 4 * 2 ** attempt))
+
+
+def call_gemini(func, description='request'):
+    """Call the Gemini API under the shared rate limit and concurrency cap
+
+    Rate limited (429) and transient failures are retried up to GEMINI_MAX_RETRIES
+    times. A 429 pauses all server processes for the delay the API asks for and
+    lowers the shared request rate, which recovers gradually as calls succeed.
+
+    Args:
+        func: Callable making the API call, called again on every retry
+        description: What is being done, for log messages
+
+    Returns:
+        The return value of func
+
+    Raises:
+        GeminiOverloadedError: If no capacity became available within GEMINI_ADMISSION_TIMEOUT
+    """
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        start_time = time.time()
+        deadline = start_time + GEMINI_ADMISSION_TIMEOUT
+        _acquire_token(deadline)
+        with _concurrency_slot(deadline):
+            _count('wait_ms', int((time.time() - start_time) * 1000))
+            _count('calls')
+            try:
+                result = func()
+                _record_success()
+                return result
+            except Exception as e:
+                pause = _handle_failure(e, attempt, description)
+        _count('retries')
+        time.sleep(pause)
+
+
+async def call_gemini_async(func, description='request'):
+    """Awaitable variant of call_gemini, for calls made with the asyncio client
+
+    Args:
+        func: Callable returning an awaitable that makes the API call, called again on every retry
+        description: What is being done, for log messages
+
+    Returns:
+        The result of the awaitable returned by func
+    """
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        start_time = time.time()
+        deadline = start_time + GEMINI_ADMISSION_TIMEOUT
+        await _acquire_token_async(deadline)
+        async with _concurrency_slot_async(deadline):
+            _count('wait_ms', int((time.time() - start_time) * 1000))
+            _count('calls')
+            try:
+                result = await func()
+                await asyncio.to_thread(_record_success)
+                return result
+            except Exception as e:
+                pause = await asyncio.to_thread(_handle_failure, e, attempt, description)
+        _count('retries')
+        await asyncio.sleep(pause)
+
+
+def _handle_failure(error, attempt, description):
+    """Decide whether a failed call is retried
+
+    Returns:
+        float: Seconds to wait before the next attempt
+
+    Raises:
+        The error itself if it is not retryable or no retries are left
+    """
+    if attempt == GEMINI_MAX_RETRIES or not _is_retryable(error):
+        raise error
+    if isinstance(error, errors.APIError) and error.code == 429:
+        # Everyone waits for the rate limiter until the pause is over
+        _count('rate_limited')
+        GEMINI_RETRIES.labels(reason='rate_limited').inc()
+        delay = _retry_after(error) or _backoff(attempt)
+        _record_rate_limited(delay)
+        pause = 0
+    else:
+        GEMINI_RETRIES.labels(reason='server_error' if isinstance(error, errors.APIError) else 'connection').inc()
+        delay = pause = _backoff(attempt)
+    logger.warning(f"Gemini {description} failed (attempt {attempt + 1}), retrying in {delay:.1f}s: {str(error)}")
+    return pause
+
+
+def admission_delay():
+    """Return the seconds a new Gemini call would currently wait for the rate limiter"""
+    return _update_bucket(take=False)
+
+
+def gemini_stats():
+    """Return call counters for this process and the state of the shared limiter"""
+    with _stats_lock:
+        stats = dict(_stats)
+    row = connect().execute('SELECT rate, blocked_until FROM rate_limiter WHERE name = ?', (LIMITER_NAME,)).fetchone()
+    stats['rate_per_minute'] = round(row['rate'] * 60, 1) if row else GEMINI_RPM
+    stats['blocked_for_s'] = round(max(0.0, row['blocked_until'] - time.time()), 1) if row else 0
+    stats['max_rate_per_minute'] = GEMINI_RPM
+    return stats
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+from dotenv import load_dotenv
+
+# Settings below may come from the .env file as well
+load_dotenv()
+
+# Gunicorn settings used by the Docker image, logs are forwarded to stdout
+bind = '0.0.0.0:5000'
+loglevel = 'info'
+accesslog = '-'
+errorlog = '-'
+workers = int(os.getenv('WEB_WORKERS', '2'))
+
+# Import the app once in the master process, so new and respawned workers start
+# from a fork with everything loaded. Clients, connections and threads are
+# created lazily in each worker
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+# SERVER_MODE selects threaded workers ("sync") or the asyncio serving path ("async")
+if os.getenv('SERVER_MODE', 'sync').lower() == 'async':
+    # Jobs run as coroutines on the Gemini asyncio client and event streams are served on the
+    # event loop, so a single worker holds hundreds of in-flight requests
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'asgi:application'
+else:
+    # Transcription and OCR run on the background job pool, so threaded workers only serve
+    # short requests and SSE streams
+    worker_class = 'gthread'
+    threads = 16
+    wsgi_app = 'app:app'
+
+# Workers write their Prometheus metrics to files in this directory, so /metrics
+# reports the sum over all of them whichever worker answers
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'voxlogai-metrics'))
+
+
+def on_starting(server):
+    # Metrics of a previous run would otherwise be added to this one
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    # Drop the in-flight gauges of workers that are gone, their counters and histograms are kept
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,200 @@
+import importlib.util
+import io
+import logging
+import math
+import os
+import threading
+import time
+from metrics import observe_stage
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+
+# Image preprocessing before OCR
+IMAGE_PREPROCESS = os.getenv('IMAGE_PREPROCESS', 'true').lower() in ('1', 'true', 'yes')
+IMAGE_TARGET_MEGAPIXELS = float(os.getenv('IMAGE_TARGET_MEGAPIXELS', '4'))  # Images are downscaled to about this size
+IMAGE_MIN_SCALE = float(os.getenv('IMAGE_MIN_SCALE', '0.5'))  # Never shrink more than this, tile larger images instead
+IMAGE_GRAYSCALE = os.getenv('IMAGE_GRAYSCALE', 'false').lower() in ('1', 'true', 'yes')
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '85'))  # Quality of the recompressed image
+IMAGE_TILE_CONCURRENCY = int(os.getenv('IMAGE_TILE_CONCURRENCY', '4'))  # Tiles OCR'd at the same time
+
+TILE_CUT_WINDOW = 0.1  # Tile edges move by up to this fraction of the tile height to land between lines of text
+
+_pil_lock = threading.Lock()
+_pil_ready = False
+
+_stats_lock = threading.Lock()
+_stats = {
+    'images': 0,
+    'tiles': 0,
+    'input_bytes': 0,
+    'output_bytes': 0,
+    'megapixels': 0.0,
+    'preprocess_ms': 0,
+    'ocr_ms': 0,
+}
+
+
+def load_pil():
+    """Import Pillow on first use, so it stays out of server startup
+
+    Returns:
+        module: The PIL package, with Image and ImageOps loaded
+    """
+    global _pil_ready
+    import PIL.Image
+    import PIL.ImageOps
+    with _pil_lock:
+        if not _pil_ready:
+            # HEIC/HEIF support comes from pillow-heif, uploads are refused up front without it
+            try:
+                from pillow_heif import register_heif_opener
+                register_heif_opener()
+            except ImportError:
+                pass
+            _pil_ready = True
+    return PIL
+
+
+def heif_supported():
+    """Return True if HEIC/HEIF images can be opened, without importing Pillow or pillow-heif"""
+    return importlib.util.find_spec('pillow_heif') is not None
+
+
+def open_image(path):
+    """Open an image file with Pillow, including HEIC/HEIF when supported"""
+    return load_pil().Image.open(path)
+
+
+def preprocess_signature():
+    """Describe the preprocessing settings, so cached results are tied to them"""
+    if not IMAGE_PREPROCESS:
+        return 'raw'
+    return f"{IMAGE_TARGET_MEGAPIXELS}:{IMAGE_MIN_SCALE}:{IMAGE_GRAYSCALE}:{IMAGE_JPEG_QUALITY}"
+
+
+def _normalize_mode(image):
+    """Convert to RGB (or L in grayscale mode), flattening transparency onto white"""
+    PIL = load_pil()
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = PIL.Image.new('RGBA', image.size, (255, 255, 255, 255))
+        image = PIL.Image.alpha_composite(background, image)
+    return image.convert('L' if IMAGE_GRAYSCALE else 'RGB')
+
+
+def _quietest_row(profile, width, target, window):
+    """Return the row near target with the least contrast, i.e. most likely between lines of text"""
+    best_row, best_score = target, None
+    for row in range(max(1, target - window), min(len(profile) // width - 1, target + window) + 1):
+        values = profile[row * width:(row + 1) * width]
+        score = (max(values) - min(values), abs(row - target))
+        if best_score is None or score < best_score:
+            best_row, best_score = row, score
+    return best_row
+
+
+def split_into_tiles(image, tile_count):
+    """Cut an image into horizontal strips, top to bottom, at rows without text where possible
+
+    Returns:
+        list: Images in reading order
+    """
+    if tile_count <= 1:
+        return [image]
+    PIL = load_pil()
+    width, height = image.size
+    tile_height = height / tile_count
+
+    # A narrow grayscale copy is enough to find rows without text
+    profile_width = 32
+    profile = image.convert('L').resize((profile_width, height), PIL.Image.Resampling.BOX).tobytes()
+    window = int(tile_height * TILE_CUT_WINDOW)
+    cuts = [0]
+    for index in range(1, tile_count):
+        cuts.append(_quietest_row(profile, profile_width, int(index * tile_height), window))
+    cuts.append(height)
+    return [image.crop((0, top, width, bottom)) for top, bottom in zip(cuts[:-1], cuts[1:])]
+
+
+def prepare_image(image, input_bytes=None):
+    """Orient, downscale, optionally convert to grayscale and recompress an image for OCR
+
+    Images are downscaled to about IMAGE_TARGET_MEGAPIXELS. When that would take
+    more than IMAGE_MIN_SCALE, they are downscaled by IMAGE_MIN_SCALE only and cut
+    into tiles of about IMAGE_TARGET_MEGAPIXELS each, so small text stays legible.
+    PNG images are recompressed losslessly, everything else becomes JPEG.
+
+    Args:
+        image: PIL Image object
+        input_bytes: Size of the uploaded file, used for the bytes saved metric
+
+    Returns:
+        dict: "tiles" as encoded images in reading order, with their "mime_type",
+        "input_bytes", "output_bytes", "megapixels" of the original image and
+        "preprocess_ms"
+    """
+    PIL = load_pil()
+    start_time = time.time()
+    source_format = image.format
+    image = PIL.ImageOps.exif_transpose(image)
+    megapixels = image.width * image.height / 1_000_000
+
+    scale = min(1.0, math.sqrt(IMAGE_TARGET_MEGAPIXELS / megapixels)) if megapixels else 1.0
+    scale = max(scale, IMAGE_MIN_SCALE)
+    image = _normalize_mode(image)
+    if scale < 1.0:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, PIL.Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    scaled_megapixels = image.width * image.height / 1_000_000
+    tile_count = math.ceil(scaled_megapixels / IMAGE_TARGET_MEGAPIXELS - 0.25) if scaled_megapixels > IMAGE_TARGET_MEGAPIXELS else 1
+
+    # Screenshots and scans saved as PNG stay lossless so text edges remain sharp, photos become JPEG
+    image_format = 'PNG' if source_format == 'PNG' else 'JPEG'
+    tiles = []
+    for tile in split_into_tiles(image, tile_count):
+        buffer = io.BytesIO()
+        if image_format == 'PNG':
+            tile.save(buffer, format='PNG', optimize=True)
+        else:
+            tile.save(buffer, format='JPEG', quality=IMAGE_JPEG_QUALITY, optimize=True)
+        tiles.append(buffer.getvalue())
+
+    prepared = {
+        'tiles': tiles,
+        'mime_type': f"image/{image_format.lower()}",
+        'input_bytes': input_bytes,
+        'output_bytes': sum(len(tile) for tile in tiles),
+        'megapixels': megapixels,
+        'preprocess_ms': int((time.time() - start_time) * 1000),
+    }
+    logger.info(f"Prepared {megapixels:.1f}MP image for OCR in {prepared['preprocess_ms']}ms: "
+                f"{len(tiles)} tile(s) of {image.width}px wide, {prepared['output_bytes']/1024:.0f}KB"
+                + (f" (uploaded {input_bytes/1024:.0f}KB)" if input_bytes else ""))
+    return prepared
+
+
+def record_image_metrics(prepared, ocr_ms):
+    """Add a processed image to the preprocessing metrics"""
+    observe_stage('image_preprocess', prepared['preprocess_ms'] / 1000)
+    with _stats_lock:
+        _stats['images'] += 1
+        _stats['tiles'] += len(prepared['tiles'])
+        _stats['input_bytes'] += prepared['input_bytes'] or prepared['output_bytes']
+        _stats['output_bytes'] += prepared['output_bytes']
+        _stats['megapixels'] += prepared['megapixels']
+        _stats['preprocess_ms'] += prepared['preprocess_ms']
+        _stats['ocr_ms'] += ocr_ms
+
+
+def image_stats():
+    """Return bytes saved by preprocessing and latency per megapixel for this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    megapixels = stats.pop('megapixels')
+    stats['bytes_saved'] = stats['input_bytes'] - stats['output_bytes']
+    stats['preprocess_ms_per_megapixel'] = round(stats['preprocess_ms'] / megapixels, 1) if megapixels else None
+    stats['ocr_ms_per_megapixel'] = round(stats['ocr_ms'] / megapixels, 1) if megapixels else None
+    return stats
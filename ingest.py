@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from metrics import observe_stage, count_bytes
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Upload size limits
+MAX_AUDIO_UPLOAD_MB = int(os.getenv('MAX_AUDIO_UPLOAD_MB', '100'))  # Largest audio file accepted by /upload
+MAX_IMAGE_UPLOAD_MB = int(os.getenv('MAX_IMAGE_UPLOAD_MB', '20'))  # Largest image accepted by /ocr_image
+MAX_PDF_UPLOAD_MB = int(os.getenv('MAX_PDF_UPLOAD_MB', '20'))  # Largest PDF accepted by /ocr_pdf
+
+MULTIPART_OVERHEAD = 64 * 1024  # Allowance for form fields and multipart headers around the file
+
+# Upload limit in bytes for each endpoint taking files
+UPLOAD_LIMITS = {
+    'upload_file': MAX_AUDIO_UPLOAD_MB * 1024 * 1024,
+    'process_image_ocr': MAX_IMAGE_UPLOAD_MB * 1024 * 1024,
+    'process_pdf_ocr': MAX_PDF_UPLOAD_MB * 1024 * 1024,
+}
+DEFAULT_UPLOAD_LIMIT = min(UPLOAD_LIMITS.values())
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    """Raised as soon as an upload is known to exceed the endpoint's limit"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        super().__init__(f"File too large. Maximum size is {limit/1024/1024:.0f}MB.")
+
+
+class IngestFile:
+    """Temp file that hashes and counts what is written to it
+
+    The multipart parser writes each uploaded file to one of these in small
+    blocks, so an upload is never held in memory and is rejected as soon as it
+    goes over the limit.
+    """
+
+    def __init__(self, limit, suffix=''):
+        self.limit = limit
+        self.size = 0
+        self.claimed = False
+        self.started = time.perf_counter()
+        self._digest = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+        self.path = self._file.name
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            raise UploadTooLarge(self.limit)
+        self._digest.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        """SHA-256 hex digest of the content written so far"""
+        return self._digest.hexdigest()
+
+    def __getattr__(self, name):
+        # read, seek, tell, close, ... go to the underlying file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def discard(self):
+        """Close and delete the temp file"""
+        self._file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class IngestRequest(Request):
+    """Request that streams uploaded files straight to disk under per-endpoint size limits"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        limit = UPLOAD_LIMITS.get(self.endpoint, DEFAULT_UPLOAD_LIMIT)
+
+        # Refuse before reading anything when the client announces an oversized body
+        if total_content_length is not None and total_content_length > limit + MULTIPART_OVERHEAD:
+            logger.warning(f"Rejected upload to {self.endpoint}: {total_content_length/1024/1024:.2f}MB announced")
+            raise UploadTooLarge(limit)
+
+        # Keep the extension so the file type can still be told from the path
+        extension = filename.rsplit('.', 1)[1].lower() if filename and '.' in filename else ''
+        suffix = f".{extension}" if re.fullmatch(r'[a-z0-9]{1,5}', extension) else ''
+
+        stream = IngestFile(limit, suffix)
+        self.__dict__.setdefault('ingested_files', []).append(stream)
+        return stream
+
+
+def claim_upload(file):
+    """Take ownership of an uploaded file so it outlives the request
+
+    Args:
+        file: FileStorage from request.files
+
+    Returns:
+        tuple: (path of the temp file, SHA-256 of its content, size in bytes)
+    """
+    stream = file.stream
+    stream.close()
+    stream.claimed = True
+    observe_stage('upload_temp', time.perf_counter() - stream.started)
+    count_bytes('in', 'upload_temp', stream.size)
+    return stream.path, stream.sha256, stream.size
+
+
+def discard_unclaimed_uploads(request):
+    """Delete the temp files of a request's uploads nobody claimed"""
+    for stream in request.__dict__.get('ingested_files', ()):
+        if not stream.claimed:
+            stream.discard()
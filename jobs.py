@@ -0,0 +1,498 @@
+import asyncio
+import contextlib
+import contextvars
+import inspect
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from registry import connect, register_schema, process_alive
+from metrics import JOB_SECONDS, JOBS_IN_FLIGHT
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Job subsystem configuration
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))  # Jobs processed concurrently
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', '32'))  # Jobs allowed to wait for a worker
+JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', str(30 * 60)))  # Seconds finished jobs are kept
+JOB_ASYNC_CONCURRENCY = int(os.getenv('JOB_ASYNC_CONCURRENCY', '256'))  # Coroutine jobs processed concurrently
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED_STATES = (DONE, FAILED)
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job"""
+
+
+def _migrate_jobs(connection):
+    """Add the deduplication columns to job tables created before them"""
+    columns = {row['name'] for row in connection.execute('PRAGMA table_info(jobs)')}
+    if 'dedupe_key' not in columns:
+        connection.execute('ALTER TABLE jobs ADD COLUMN dedupe_key TEXT')
+    if 'owner_pid' not in columns:
+        connection.execute('ALTER TABLE jobs ADD COLUMN owner_pid INTEGER')
+    # At most one queued or running job per key, across all server processes
+    connection.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS jobs_dedupe_key ON jobs (dedupe_key) WHERE status IN ('queued', 'running')"
+    )
+
+
+# Job records live in the shared registry, so any server process can report on any job
+register_schema("""
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    partial TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    version INTEGER NOT NULL DEFAULT 0,
+    dedupe_key TEXT,
+    owner_pid INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+""", migration=_migrate_jobs)
+
+JOB_POLL_INTERVAL = 0.25  # Seconds between checks for changes made by other processes
+
+_jobs_changed = threading.Condition()  # Wakes up waiters in this process right after a local update
+_queue = queue.Queue(maxsize=JOB_QUEUE_SIZE)
+_workers = []
+_workers_lock = threading.Lock()
+_current = contextvars.ContextVar('job_id', default=None)  # ID of the job run by the current thread or task
+
+# Coroutine jobs run on one event loop thread per process, with job updates written in order by a single thread
+_loop = None
+_loop_thread = None
+_async_slots = None
+_async_pending = 0
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-writer')
+
+# Partial output waiting to be written, by job ID. A flusher thread writes the
+# latest text of every job at most once per JOB_POLL_INTERVAL, in one transaction
+_partials = {}
+_partials_lock = threading.Lock()
+_flusher_pid = None
+
+
+def _start_workers():
+    """Start the worker pool on first use so forked server workers each get their own threads"""
+    with _workers_lock:
+        if _workers:
+            return
+        for index in range(JOB_WORKERS):
+            worker = threading.Thread(target=_worker_loop, name=f"job-worker-{index}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+        logger.info(f"Started {JOB_WORKERS} job workers (queue size: {JOB_QUEUE_SIZE})")
+
+
+def _start_event_loop():
+    """Start the event loop running coroutine jobs on first use"""
+    global _loop, _loop_thread, _async_slots
+    with _workers_lock:
+        if _loop is not None:
+            return
+        _loop = asyncio.new_event_loop()
+        _async_slots = asyncio.Semaphore(JOB_ASYNC_CONCURRENCY)
+        _loop_thread = threading.Thread(target=_loop.run_forever, name="job-event-loop", daemon=True)
+        _loop_thread.start()
+        logger.info(f"Started job event loop (concurrency: {JOB_ASYNC_CONCURRENCY})")
+
+
+def _update_job(job_id, **fields):
+    """Apply changes to a job and wake up anyone waiting on it"""
+    if 'result' in fields:
+        fields['result'] = json.dumps(fields['result'])
+    assignments = ', '.join(f"{name} = ?" for name in fields)
+    connect().execute(
+        f"UPDATE jobs SET {assignments}, version = version + 1 WHERE job_id = ?",
+        (*fields.values(), job_id)
+    )
+    with _jobs_changed:
+        _jobs_changed.notify_all()
+
+
+def _job_started(job_id):
+    logger.info(f"Job {job_id} started")
+    return dict(status=RUNNING, started_at=time.time())
+
+
+def _job_done(job_id, result):
+    logger.info(f"Job {job_id} finished successfully")
+    return dict(status=DONE, result=result, partial="", finished_at=time.time())
+
+
+def _job_failed(job_id, error):
+    logger.error(f"Job {job_id} failed: {str(error)}")
+    return dict(status=FAILED, error=str(error), partial="", finished_at=time.time())
+
+
+@contextlib.contextmanager
+def _job_metrics(kind):
+    """Count a job as in flight and record its duration under the status it ends with"""
+    outcome = {'status': FAILED}
+    in_flight = JOBS_IN_FLIGHT.labels(kind=kind)
+    in_flight.inc()
+    start_time = time.perf_counter()
+    try:
+        yield outcome
+    finally:
+        in_flight.dec()
+        JOB_SECONDS.labels(kind=kind, status=outcome['status']).observe(time.perf_counter() - start_time)
+
+
+def _worker_loop():
+    while True:
+        job_id, kind, func, args, kwargs = _queue.get()
+        token = _current.set(job_id)
+        try:
+            with _job_metrics(kind) as outcome:
+                _update_job(job_id, **_job_started(job_id))
+                result = func(*args, **kwargs)
+                _update_job(job_id, **_job_done(job_id, result))
+                outcome['status'] = DONE
+        except Exception as e:
+            _update_job(job_id, **_job_failed(job_id, e))
+        finally:
+            _current.reset(token)
+            _queue.task_done()
+
+
+async def _run_async_job(job_id, kind, func, args, kwargs):
+    """Run a coroutine job, waiting for one of JOB_ASYNC_CONCURRENCY slots first"""
+    global _async_pending
+
+    async def write(fields):
+        # Database writes stay off the event loop, in the order they were made
+        await asyncio.wrap_future(_writer.submit(_update_job, job_id, **fields))
+
+    try:
+        async with _async_slots:
+            _current.set(job_id)
+            try:
+                with _job_metrics(kind) as outcome:
+                    await write(_job_started(job_id))
+                    result = await func(*args, **kwargs)
+                    await write(_job_done(job_id, result))
+                    outcome['status'] = DONE
+            except Exception as e:
+                await write(_job_failed(job_id, e))
+    finally:
+        with _workers_lock:
+            _async_pending -= 1
+
+
+def _purge_expired_jobs():
+    """Remove finished jobs older than the configured retention"""
+    expired_count = connect().execute(
+        'DELETE FROM jobs WHERE finished_at < ?',
+        (time.time() - JOB_RESULT_TTL,)
+    ).rowcount
+    if expired_count:
+        logger.info(f"Removed {expired_count} expired jobs")
+
+
+def find_active_job(dedupe_key):
+    """Return the ID of the queued or running job submitted with a dedupe key, or None
+
+    A job left behind by a server process that stopped is marked as failed
+    instead, so it does not hold on to its key.
+    """
+    row = connect().execute(
+        'SELECT job_id, owner_pid FROM jobs WHERE dedupe_key = ? AND status IN (?, ?)',
+        (dedupe_key, QUEUED, RUNNING)
+    ).fetchone()
+    if row is None:
+        return None
+    if row['owner_pid'] and not process_alive(row['owner_pid']):
+        logger.warning(f"Job {row['job_id']} was left behind by stopped process {row['owner_pid']}")
+        _update_job(row['job_id'], **_job_failed(row['job_id'], "The server process running this job stopped"))
+        return None
+    return row['job_id']
+
+
+def _create_job(kind, dedupe_key):
+    """Record a new queued job, unless one with the same dedupe key is already in flight
+
+    Returns:
+        tuple: (job ID, whether it is an existing job)
+    """
+    while True:
+        if dedupe_key:
+            job_id = find_active_job(dedupe_key)
+            if job_id:
+                logger.info(f"Joined in-flight {kind} job {job_id}")
+                return job_id, True
+
+        job_id = str(uuid.uuid4())
+        try:
+            connect().execute(
+                'INSERT INTO jobs (job_id, kind, status, created_at, dedupe_key, owner_pid) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, kind, QUEUED, time.time(), dedupe_key, os.getpid())
+            )
+            return job_id, False
+        except sqlite3.IntegrityError:
+            # Another process submitted the same work in the meantime, join its job
+            continue
+
+
+def _reject_job(job_id, kind):
+    connect().execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+    logger.warning(f"Job queue full, rejected {kind} job")
+    raise QueueFullError("Server is busy, please try again in a moment")
+
+
+def submit_job(kind, func, *args, **kwargs):
+    """Queue a function to run on the worker pool
+
+    Coroutine functions run on the job event loop instead, up to
+    JOB_ASYNC_CONCURRENCY at a time, so a single process can hold hundreds of
+    jobs that are waiting on the network.
+
+    Args:
+        kind: Short label describing the job (e.g. "transcribe")
+        func: Callable doing the work, its return value becomes the job result
+        *args, **kwargs: Arguments passed to func
+
+    Returns:
+        string: The ID of the queued job
+
+    Raises:
+        QueueFullError: If the queue already holds JOB_QUEUE_SIZE pending jobs
+    """
+    return submit_or_join_job(kind, None, func, *args, **kwargs)[0]
+
+
+def submit_or_join_job(kind, dedupe_key, func, *args, **kwargs):
+    """Queue a function like submit_job, unless the same work is already queued or running
+
+    Requests for identical work (e.g. the same video with the same options)
+    share one job: while a job submitted with dedupe_key is in flight in any
+    server process, later submissions with that key get its ID and func is not
+    run. Once it finishes the key is free again, repeated work is then answered
+    by the result cache.
+
+    Args:
+        kind: Short label describing the job (e.g. "transcribe")
+        dedupe_key: Identifies the work done by func, None to always queue a new job
+        func: Callable doing the work, its return value becomes the job result
+        *args, **kwargs: Arguments passed to func
+
+    Returns:
+        tuple: (job ID, whether an in-flight job was joined)
+
+    Raises:
+        QueueFullError: If the queue already holds JOB_QUEUE_SIZE pending jobs
+    """
+    if inspect.iscoroutinefunction(func):
+        return _submit_async_job(kind, dedupe_key, func, args, kwargs)
+    _start_workers()
+    _purge_expired_jobs()
+
+    job_id, joined = _create_job(kind, dedupe_key)
+    if joined:
+        return job_id, True
+
+    try:
+        _queue.put_nowait((job_id, kind, func, args, kwargs))
+    except queue.Full:
+        _reject_job(job_id, kind)
+
+    logger.info(f"Queued {kind} job {job_id} (pending: {_queue.qsize()})")
+    return job_id, False
+
+
+def _submit_async_job(kind, dedupe_key, func, args, kwargs):
+    global _async_pending
+    _start_event_loop()
+    _purge_expired_jobs()
+
+    job_id, joined = _create_job(kind, dedupe_key)
+    if joined:
+        return job_id, True
+
+    with _workers_lock:
+        full = _async_pending >= JOB_ASYNC_CONCURRENCY + JOB_QUEUE_SIZE
+        if not full:
+            _async_pending += 1
+        pending = _async_pending
+    if full:
+        _reject_job(job_id, kind)
+
+    asyncio.run_coroutine_threadsafe(_run_async_job(job_id, kind, func, args, kwargs), _loop)
+    logger.info(f"Queued {kind} job {job_id} (pending: {pending})")
+    return job_id, False
+
+
+def _start_partial_flusher():
+    """Start the thread writing partial output on first use, once per process"""
+    global _flusher_pid
+    with _partials_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _partials.clear()
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_partials_loop, name='job-partial-flusher', daemon=True).start()
+
+
+def _flush_partials_loop():
+    while True:
+        # Readers poll every JOB_POLL_INTERVAL, writing more often would not show text any sooner
+        time.sleep(JOB_POLL_INTERVAL)
+        with _partials_lock:
+            pending = list(_partials.items())
+            _partials.clear()
+        if not pending:
+            continue
+        try:
+            _write_partials(pending)
+        except Exception as e:
+            logger.warning(f"Could not write partial job output: {str(e)}")
+
+
+def _write_partials(pending):
+    """Write the latest partial output of several jobs, skipping jobs that finished meanwhile"""
+    connection = connect()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        connection.executemany(
+            'UPDATE jobs SET partial = ?, version = version + 1 WHERE job_id = ? AND status = ?',
+            [(text, job_id, RUNNING) for job_id, text in pending]
+        )
+        connection.execute('COMMIT')
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+    with _jobs_changed:
+        _jobs_changed.notify_all()
+
+
+def partial_text_reporter():
+    """Return a callback publishing partial output of the job running on this thread or task
+
+    The callback takes the full text produced so far and can be called from any
+    thread. It only keeps the text, which is written to the registry shortly
+    after, so streaming never waits on the database and a burst of chunks costs
+    one write. Outside of a job it does nothing.
+    """
+    job_id = _current.get()
+    if job_id is not None:
+        _start_partial_flusher()
+
+    def report(text):
+        if job_id is None:
+            return
+        with _partials_lock:
+            _partials[job_id] = text
+
+    return report
+
+
+def _load_job(job_id):
+    row = connect().execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job["id"] = job.pop("job_id")
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    return job
+
+
+def get_job(job_id):
+    """Return a snapshot of a job, or None if it does not exist or has expired"""
+    _purge_expired_jobs()
+    return _load_job(job_id)
+
+
+def wait_for_job_update(job_id, version, timeout):
+    """Block until the job changes past the given version or the timeout elapses
+
+    Returns:
+        dict: Snapshot of the job (unchanged if the timeout elapsed), or None if it is gone
+    """
+    deadline = time.time() + timeout
+    while True:
+        job = _load_job(job_id)
+        if job is None or job["version"] != version or time.time() >= deadline:
+            return job
+        # Local updates wake us immediately, updates from other processes are seen on the next poll
+        with _jobs_changed:
+            _jobs_changed.wait(min(JOB_POLL_INTERVAL, max(0, deadline - time.time())))
+
+
+async def wait_for_job_update_async(job_id, version, timeout):
+    """Awaitable variant of wait_for_job_update, polling the registry without blocking the event loop"""
+    deadline = time.time() + timeout
+    while True:
+        job = await asyncio.to_thread(_load_job, job_id)
+        if job is None or job["version"] != version or time.time() >= deadline:
+            return job
+        await asyncio.sleep(min(JOB_POLL_INTERVAL, max(0, deadline - time.time())))
+
+
+class JobEventStream:
+    """Turns successive snapshots of a job into server-sent events
+
+    Partial output is relayed as "partial" events, appending to the text sent
+    so far when possible, and status changes as "status" events.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.version = None
+        self.status = None
+        self.sent_text = ''
+        self.finished = False
+
+    def events(self, job):
+        """Return the events for a snapshot from wait_for_job_update (None if the job is gone)"""
+        if job is None:
+            self.finished = True
+            return [f"event: status\ndata: {json.dumps({'job_id': self.job_id, 'status': 'failed', 'error': 'Job expired'})}\n\n"]
+        if job["version"] == self.version:
+            # Keep the connection alive through proxies while the job is still running
+            return [": keep-alive\n\n"]
+        self.version = job["version"]
+
+        events = []
+        if job["status"] not in FINISHED_STATES and job["partial"] != self.sent_text:
+            if job["partial"].startswith(self.sent_text):
+                partial = {'append': job["partial"][len(self.sent_text):]}
+            else:
+                # The output was restarted (e.g. after a retry), send it whole
+                partial = {'replace': job["partial"]}
+            self.sent_text = job["partial"]
+            events.append(f"event: partial\ndata: {json.dumps(partial)}\n\n")
+
+        if job["status"] != self.status:
+            self.status = job["status"]
+            events.append(f"event: status\ndata: {json.dumps(job_response(job, include_partial=False))}\n\n")
+        self.finished = job["status"] in FINISHED_STATES
+        return events
+
+
+def job_response(job, include_partial=True):
+    """Build the public JSON representation of a job"""
+    response = {'job_id': job["id"], 'kind': job["kind"], 'status': job["status"]}
+    if job["status"] == DONE:
+        response['result'] = job["result"]
+    elif job["status"] == FAILED:
+        response['error'] = job["error"]
+    elif include_partial and job["partial"]:
+        response['partial'] = job["partial"]
+    return response
@@ -0,0 +1,117 @@
+import contextlib
+import logging
+import os
+import time
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Gunicorn workers write their metrics to files in this directory, which /metrics
+# adds up. It is set by gunicorn.conf.py; without it metrics cover this process only
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# Stages range from a few milliseconds (uploads to disk) to minutes (long transcriptions)
+STAGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1200)
+
+STAGE_SECONDS = Histogram(
+    'voxlogai_stage_seconds',
+    'Time spent in each processing stage, including rate limiter waits and retries',
+    ['stage'],
+    buckets=STAGE_BUCKETS
+)
+STAGE_IN_FLIGHT = Gauge(
+    'voxlogai_stage_in_flight',
+    'Operations currently in each processing stage',
+    ['stage'],
+    multiprocess_mode='livesum'
+)
+STAGE_ERRORS = Counter(
+    'voxlogai_stage_errors',
+    'Failed operations by stage and exception type',
+    ['stage', 'error']
+)
+JOB_SECONDS = Histogram(
+    'voxlogai_job_seconds',
+    'Time from a job starting to finishing',
+    ['kind', 'status'],
+    buckets=STAGE_BUCKETS
+)
+JOBS_IN_FLIGHT = Gauge(
+    'voxlogai_jobs_in_flight',
+    'Jobs currently running',
+    ['kind'],
+    multiprocess_mode='livesum'
+)
+GEMINI_RETRIES = Counter(
+    'voxlogai_gemini_retries',
+    'Gemini calls retried, by reason',
+    ['reason']
+)
+REMOTE_CLEANUP_BACKLOG = Gauge(
+    'voxlogai_remote_cleanup_backlog',
+    'Remote Gemini files queued for deletion',
+    multiprocess_mode='livesum'
+)
+REMOTE_CLEANUP_LATENCY = Histogram(
+    'voxlogai_remote_cleanup_latency_seconds',
+    'Time from a remote Gemini file being queued for deletion to it being deleted',
+    buckets=STAGE_BUCKETS
+)
+REMOTE_ORPHANS = Counter(
+    'voxlogai_remote_orphans',
+    'Orphaned remote Gemini files found by the sweeper'
+)
+BYTES = Counter(
+    'voxlogai_bytes',
+    'Bytes received from clients ("in") and sent to Gemini ("out")',
+    ['direction', 'stage']
+)
+
+
+@contextlib.contextmanager
+def track_stage(stage):
+    """Time a processing stage, counting it as in flight and recording its failures by exception type
+
+    Works around awaited code as well, so the same stage is measured in both serving modes.
+    """
+    in_flight = STAGE_IN_FLIGHT.labels(stage=stage)
+    in_flight.inc()
+    start_time = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        STAGE_ERRORS.labels(stage=stage, error=type(e).__name__).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage=stage).observe(time.perf_counter() - start_time)
+        in_flight.dec()
+
+
+def observe_stage(stage, seconds):
+    """Record the duration of a stage measured elsewhere"""
+    STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+
+def count_error(stage, error):
+    STAGE_ERRORS.labels(stage=stage, error=type(error).__name__).inc()
+
+
+def count_bytes(direction, stage, size):
+    if size:
+        BYTES.labels(direction=direction, stage=stage).inc(size)
+
+
+def render_metrics():
+    """Return the metrics of all server processes in the Prometheus text format
+
+    Returns:
+        tuple: (body, content type)
+    """
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,43 +1,96 @@
-from google import genai
 from google.genai import types
-from tenacity import retry, stop_after_attempt, wait_exponential
+import asyncio
+import io
 import logging
 import os
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cache import result_cache, hash_bytes, hash_file, make_key
+from gemini_client import call_gemini, call_gemini_async, get_client
+from metrics import track_stage, observe_stage, count_bytes
+from imaging import prepare_image, record_image_metrics, preprocess_signature, IMAGE_PREPROCESS, IMAGE_TILE_CONCURRENCY
 
 # Get logger
 logger = logging.getLogger(__name__)
 
 MODEL = 'gemini-2.5-pro-exp-03-25'
-API_KEY = os.getenv('GEMINI_API_KEY')  # Get API key from environment variable
 
-if not API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable is not set")
+# Define prompts for images and PDFs
+PROMPT_IMAGE = 'OCR this image and extract all text content. Format the text to maintain original paragraphs and layout as much as possible.'
+PROMPT_PDF = 'OCR this PDF and extract all text content. Format the text to maintain original paragraphs and layout as much as possible.'
+
+# Page-parallel PDF OCR
+PDF_PAGES_PER_RANGE = int(os.getenv('PDF_PAGES_PER_RANGE', '1'))  # Pages sent to Gemini in one request
+PDF_OCR_CONCURRENCY = int(os.getenv('PDF_OCR_CONCURRENCY', '4'))  # Page ranges processed at the same time
+PDF_RANGE_RETRIES = int(os.getenv('PDF_RANGE_RETRIES', '2'))  # Extra passes over page ranges that failed
 
-# Initialize client
-client = genai.Client(api_key=API_KEY)
+# Text-layer fast path for born-digital PDFs
+PDF_TEXT_LAYER = os.getenv('PDF_TEXT_LAYER', 'true').lower() in ('1', 'true', 'yes')
+PDF_TEXT_MIN_CHARS = int(os.getenv('PDF_TEXT_MIN_CHARS', '100'))  # Pages with less embedded text are OCR'd
 
-# Add retry decorator for content generation
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    reraise=True
-)
+# Content generation goes through the shared rate limiter, which retries rate limited and transient failures
 def generate_content_with_retry(client, model, contents):
     logger.info("Generating content with retry...")
-    return client.models.generate_content(
-        model=model,
-        contents=contents
-    )
+    with track_stage('ocr'):
+        return call_gemini(lambda: client.models.generate_content(
+            model=model,
+            contents=contents
+        ), 'OCR')
+
+def generate_content_stream_with_retry(client, model, contents, on_text):
+    """Generate content as a stream, passing the text produced so far to on_text
+
+    A failed stream is retried from the start.
+
+    Returns:
+        string: The complete generated text
+    """
+    logger.info("Generating content (streaming) with retry...")
+
+    def stream():
+        text = ''
+        for chunk in client.models.generate_content_stream(
+            model=model,
+            contents=contents
+        ):
+            if chunk.text:
+                text += chunk.text
+                on_text(text)
+        return text
 
-def ocr_image(image_file):
+    with track_stage('ocr'):
+        return call_gemini(stream, 'streamed OCR')
+
+def image_cache_key(content_hash):
+    """Result cache key for the text of an image processed with the current settings"""
+    return make_key(f"{content_hash}:{preprocess_signature()}", PROMPT_IMAGE, MODEL)
+
+def cached_ocr_text(cache_key):
+    """Return the text of an image already processed with the same settings, or None"""
+    cached_text = result_cache.get(cache_key)
+    if cached_text is not None:
+        logger.info(f"OCR result found in cache. Length: {len(cached_text)} chars")
+    return cached_text
+
+def store_ocr_text(cache_key, extracted_text):
+    """Cache the finished text of an image"""
+    text_preview = extracted_text[:100] + "..." if len(extracted_text) > 100 else extracted_text
+    logger.info(f"OCR successfully generated. Length: {len(extracted_text)} chars. Preview: {text_preview}")
+    result_cache.set(cache_key, extracted_text)
+
+def ocr_image(image_file, content_hash=None, on_text=None, input_bytes=None):
     """Extract text from an image using OCR
     
+    Unless IMAGE_PREPROCESS is off, the image is oriented, downscaled and
+    recompressed first. Very large images are cut into tiles that are OCR'd
+    concurrently and joined in reading order.
+    
     Args:
         image_file: PIL Image object
+        content_hash: SHA-256 of the uploaded image bytes, used as cache key (default: hash of the pixel data)
+        on_text: Optional callback receiving the text extracted so far while it is generated
+        input_bytes: Size of the uploaded file, reported in the preprocessing metrics
         
     Returns:
         string: The extracted text
@@ -45,17 +98,22 @@ def ocr_image(image_file):
     try:
         logger.info(f"Starting OCR process for image")
         
-        # Process the image with Gemini (with retry)
-        response = generate_content_with_retry(
-            client,
-            MODEL,
-            ["OCR this image and extract all text content. Format the text to maintain original paragraphs and layout as much as possible.", image_file]
-        )
+        # Return cached text if this image was already processed with the same settings
+        if content_hash is None:
+            content_hash = hash_bytes(image_file.tobytes())
+        cache_key = image_cache_key(content_hash)
+        cached_text = cached_ocr_text(cache_key)
+        if cached_text is not None:
+            return cached_text
         
-        # Get the extracted text
-        extracted_text = response.text
-        text_preview = extracted_text[:100] + "..." if len(extracted_text) > 100 else extracted_text
-        logger.info(f"OCR successfully generated. Length: {len(extracted_text)} chars. Preview: {text_preview}")
+        if IMAGE_PREPROCESS:
+            prepared = prepare_image(image_file, input_bytes)
+            start_time = time.time()
+            extracted_text = ocr_image_tiles(prepared['tiles'], prepared['mime_type'], on_text)
+            record_image_metrics(prepared, int((time.time() - start_time) * 1000))
+        else:
+            extracted_text = ocr_image_part(image_file, on_text)
+        store_ocr_text(cache_key, extracted_text)
             
         return extracted_text
 
@@ -63,38 +121,547 @@ def ocr_image(image_file):
         logger.error(f"An error occurred during OCR: {str(e)}")
         raise
 
-def ocr_pdf(pdf_content):
+def ocr_image_part(image_part, on_text=None):
+    """Send one image (PIL Image or Part) to Gemini and return the extracted text"""
+    # Process the image with Gemini (with retry)
+    if on_text:
+        return generate_content_stream_with_retry(get_client(), MODEL, [PROMPT_IMAGE, image_part], on_text)
+    response = generate_content_with_retry(
+        get_client(),
+        MODEL,
+        [PROMPT_IMAGE, image_part]
+    )
+    
+    # Get the extracted text
+    return response.text
+
+def ocr_image_tiles(tiles, mime_type, on_text=None):
+    """OCR image tiles concurrently and join their text in order
+
+    Args:
+        tiles: Encoded image tiles in reading order
+        mime_type: MIME type of the tiles
+        on_text: Optional callback receiving the text extracted so far, in tile order
+
+    Returns:
+        string: The extracted text
+    """
+    count_bytes('out', 'ocr', sum(len(tile) for tile in tiles))
+    parts = [types.Part.from_bytes(data=tile, mime_type=mime_type) for tile in tiles]
+    if len(parts) == 1:
+        return ocr_image_part(parts[0], on_text)
+
+    logger.info(f"Processing {len(parts)} image tiles, {IMAGE_TILE_CONCURRENCY} at a time")
+    partial_texts = [''] * len(parts)
+    partial_lock = threading.Lock()
+
+    def on_tile_text(index, text):
+        with partial_lock:
+            partial_texts[index] = text
+            on_text('\n\n'.join(tile_text for tile_text in partial_texts if tile_text))
+
+    with ThreadPoolExecutor(max_workers=IMAGE_TILE_CONCURRENCY) as executor:
+        texts = list(executor.map(
+            lambda index: ocr_image_part(
+                parts[index],
+                (lambda text: on_tile_text(index, text)) if on_text else None
+            ),
+            range(len(parts))
+        ))
+    return '\n\n'.join(text.strip() for text in texts)
+
+def has_usable_text(text):
+    """Return True if a page's embedded text is dense and readable enough to skip OCR"""
+    characters = ''.join(text.split())
+    if len(characters) < PDF_TEXT_MIN_CHARS:
+        return False
+    # Broken font encodings extract as symbols or private-use characters rather than words
+    readable = sum(character.isalnum() for character in characters)
+    return readable / len(characters) >= 0.6
+
+def extract_text_layer(reader):
+    """Return the embedded text of each page, or None for pages that need OCR"""
+    page_texts = []
+    for page_number, page in enumerate(reader.pages, start=1):
+        try:
+            text = page.extract_text() or ''
+        except Exception as e:
+            logger.warning(f"Could not extract text layer from page {page_number}: {str(e)}")
+            text = ''
+        page_texts.append(text.strip() if has_usable_text(text) else None)
+    return page_texts
+
+def group_page_ranges(page_numbers, pages_per_range):
+    """Group sorted page numbers into runs of consecutive pages, at most pages_per_range long
+
+    Returns:
+        list: (first_page, last_page) tuples
+    """
+    ranges = []
+    for page_number in page_numbers:
+        if ranges and page_number == ranges[-1][1] + 1 and page_number - ranges[-1][0] < pages_per_range:
+            ranges[-1] = (ranges[-1][0], page_number)
+        else:
+            ranges.append((page_number, page_number))
+    return ranges
+
+def extract_page_range(reader, first_page, last_page):
+    """Write pages first_page..last_page (starting at 1) of a PDF to a new PDF"""
+    from pypdf import PdfWriter
+    writer = PdfWriter()
+    for page_index in range(first_page - 1, last_page):
+        writer.add_page(reader.pages[page_index])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+def page_range_extractor(reader):
+    """Return a function writing out page ranges of a PDF that can be called from several threads
+
+    pypdf is not thread safe, so ranges are written out one at a time. Each
+    range is written by the worker about to OCR it, so no more than
+    PDF_OCR_CONCURRENCY ranges are held in memory at once.
+    """
+    lock = threading.Lock()
+
+    def extract(first_page, last_page):
+        with lock:
+            return extract_page_range(reader, first_page, last_page)
+    return extract
+
+def ocr_pdf_range(pdf_hash, first_page, last_page, range_content, on_text=None):
+    """OCR one page range of a PDF, using the result cache
+
+    Args:
+        pdf_hash: SHA-256 of the whole PDF, combined with the page range as cache key
+        first_page: First page of the range
+        last_page: Last page of the range
+        range_content: PDF bytes containing only this range
+        on_text: Optional callback receiving the text of this range produced so far
+
+    Returns:
+        string: The extracted text
+    """
+    cache_key = pdf_range_cache_key(pdf_hash, first_page, last_page)
+    cached_text = cached_range_text(cache_key, first_page, last_page, on_text)
+    if cached_text is not None:
+        return cached_text
+
+    # Process the page range with Gemini (with retry)
+    contents = pdf_range_contents(range_content)
+    if on_text:
+        extracted_text = generate_content_stream_with_retry(get_client(), MODEL, contents, on_text)
+    else:
+        response = generate_content_with_retry(get_client(), MODEL, contents)
+        extracted_text = response.text or ''
+    store_range_text(cache_key, first_page, last_page, extracted_text)
+    return extracted_text
+
+def pdf_range_cache_key(pdf_hash, first_page, last_page):
+    return make_key(f"{pdf_hash}:{first_page}-{last_page}", PROMPT_PDF, MODEL)
+
+def cached_range_text(cache_key, first_page, last_page, on_text=None):
+    """Return the text of a page range OCR'd before, passing it to on_text, or None"""
+    cached_text = result_cache.get(cache_key)
+    if cached_text is not None:
+        logger.info(f"OCR result for pages {first_page}-{last_page} found in cache")
+        if on_text:
+            on_text(cached_text)
+    return cached_text
+
+def pdf_range_contents(range_content):
+    """Return the request contents for OCR of a page range"""
+    count_bytes('out', 'ocr', len(range_content))
+    return [
+        types.Part.from_bytes(
+            data=range_content,
+            mime_type='application/pdf',
+        ),
+        PROMPT_PDF
+    ]
+
+def store_range_text(cache_key, first_page, last_page, extracted_text):
+    logger.info(f"OCR generated for pages {first_page}-{last_page}. Length: {len(extracted_text)} chars")
+    result_cache.set(cache_key, extracted_text)
+
+def ocr_page_ranges(reader, pdf_hash, page_ranges, on_range_text=None):
+    """OCR page ranges concurrently, retrying only the ranges that fail
+
+    Args:
+        reader: PdfReader of the document
+        pdf_hash: SHA-256 of the whole PDF
+        page_ranges: (first_page, last_page) tuples to OCR
+        on_range_text: Optional callback receiving (first_page, text so far) while ranges are generated
+
+    Returns:
+        dict: {first_page: text} for every range
+    """
+    logger.info(f"Processing {len(page_ranges)} page ranges, {PDF_OCR_CONCURRENCY} at a time")
+    extract = page_range_extractor(reader)
+
+    def ocr_range(first, last):
+        return ocr_pdf_range(
+            pdf_hash, first, last, extract(first, last),
+            (lambda text: on_range_text(first, text)) if on_range_text else None
+        )
+
+    results = {}
+    pending = page_ranges
+    last_error = None
+    for attempt in range(1 + PDF_RANGE_RETRIES):
+        with ThreadPoolExecutor(max_workers=PDF_OCR_CONCURRENCY) as executor:
+            futures = [executor.submit(ocr_range, first, last) for first, last in pending]
+        pending, last_error = sort_range_outcomes(
+            pending, [future.exception() or future.result() for future in futures], results, last_error
+        )
+        if not pending:
+            break
+        logger.info(f"Retrying {len(pending)} failed page ranges")
+
+    raise_failed_ranges(pending, last_error)
+    return results
+
+def sort_range_outcomes(page_ranges, outcomes, results, last_error):
+    """Store the text of the ranges of one pass in results and return the ranges that failed
+
+    Args:
+        page_ranges: (first_page, last_page) tuples of the pass
+        outcomes: Text or exception of each range, in the same order
+        results: {first_page: text} of the ranges done so far, updated in place
+        last_error: Error of an earlier pass, kept if no range fails in this one
+
+    Returns:
+        tuple: (failed page ranges, last error)
+    """
+    failed = []
+    for (first, last), outcome in zip(page_ranges, outcomes):
+        if isinstance(outcome, Exception):
+            logger.warning(f"OCR failed for pages {first}-{last}: {str(outcome)}")
+            failed.append((first, last))
+            last_error = outcome
+        else:
+            results[first] = outcome
+    return failed, last_error
+
+def raise_failed_ranges(page_ranges, last_error):
+    """Fail the document if some page ranges are still failing after every retry"""
+    if page_ranges:
+        failed_pages = ', '.join(f"{first}-{last}" for first, last in page_ranges)
+        raise Exception(f"OCR failed for pages {failed_pages}: {str(last_error)}")
+
+def page_marker(first_page, last_page):
+    if first_page == last_page:
+        return f"--- Page {first_page} ---"
+    return f"--- Pages {first_page}-{last_page} ---"
+
+def assemble_sections(sections, page_count):
+    """Join {first_page: (last_page, text)} sections in page order, with page markers for multi-page documents"""
+    if page_count == 1:
+        return sections[1][1] if sections else ''
+    return '\n\n'.join(
+        f"{page_marker(first, last)}\n{text.strip()}"
+        for first, (last, text) in sorted(sections.items())
+    )
+
+def open_pdf(pdf_file, content_hash=None):
+    """Return the SHA-256 and an open binary stream of PDF bytes or a PDF file path"""
+    if isinstance(pdf_file, (bytes, bytearray)):
+        return content_hash or hash_bytes(pdf_file), io.BytesIO(pdf_file)
+    # Pages are read from disk as they are needed instead of loading the whole file
+    return content_hash or hash_file(pdf_file), open(pdf_file, 'rb')
+
+def read_pdf(pdf_stream):
+    """Return a PdfReader for a PDF, or None if it cannot be split into pages locally"""
+    # pypdf is only loaded once a PDF is processed, keeping server startup fast
+    from pypdf import PdfReader
+    try:
+        reader = PdfReader(pdf_stream)
+        if reader.is_encrypted:
+            reader.decrypt('')
+        len(reader.pages)
+        return reader
+    except Exception as e:
+        logger.warning(f"Could not split PDF into pages, processing it as a whole: {str(e)}")
+        return None
+
+def plan_pdf_ocr(reader):
+    """Read the text layer of a PDF and work out which page ranges still need OCR
+
+    Returns:
+        dict: "page_texts" (None for pages needing OCR), "sections" {first_page: (last_page, text)}
+        holding the text-layer pages, "page_ranges" to OCR, "page_count" and "text_layer_ms"
+    """
+    page_count = len(reader.pages)
+
+    # Fast path: use the embedded text of born-digital pages
+    start_time = time.time()
+    page_texts = extract_text_layer(reader) if PDF_TEXT_LAYER else [None] * page_count
+    text_layer_ms = int((time.time() - start_time) * 1000)
+    observe_stage('pdf_text_layer', text_layer_ms / 1000)
+    sections = {page_number: (page_number, text)
+                for page_number, text in enumerate(page_texts, start=1) if text is not None}
+
+    # Slow path: OCR the image-only and sparse pages
+    ocr_pages = [page_number for page_number, text in enumerate(page_texts, start=1) if text is None]
+    logger.info(f"PDF has {page_count} pages: {page_count - len(ocr_pages)} with a text layer, {len(ocr_pages)} need OCR")
+    return {
+        'page_texts': page_texts,
+        'sections': sections,
+        'page_ranges': group_page_ranges(ocr_pages, PDF_PAGES_PER_RANGE),
+        'page_count': page_count,
+        'text_layer_ms': text_layer_ms,
+    }
+
+def partial_range_reporter(plan, on_text):
+    """Return a callback publishing the text-layer pages and every range's partial output in page order"""
+    if not on_text:
+        return None
+    range_ends = dict(plan['page_ranges'])
+    partial_sections = dict(plan['sections'])
+    partial_lock = threading.Lock()
+    on_text(assemble_sections(partial_sections, plan['page_count']))
+
+    def on_range_text(first, text):
+        with partial_lock:
+            partial_sections[first] = (range_ends[first], text)
+            on_text(assemble_sections(partial_sections, plan['page_count']))
+
+    return on_range_text
+
+def pdf_ocr_result(plan, ocr_results, ocr_ms):
+    """Reassemble the text of a PDF in page order and describe where each page came from"""
+    sections = dict(plan['sections'])
+    for first, last in plan['page_ranges']:
+        sections[first] = (last, ocr_results[first])
+    extracted_text = assemble_sections(sections, plan['page_count'])
+    
+    text_preview = extracted_text[:100] + "..." if len(extracted_text) > 100 else extracted_text
+    logger.info(f"OCR successfully generated. Length: {len(extracted_text)} chars. Preview: {text_preview}")
+    
+    ocr_pages = sum(last - first + 1 for first, last in plan['page_ranges'])
+    return {
+        'text': extracted_text,
+        'pages': [{'page': page_number, 'source': 'ocr' if text is None else 'text_layer'}
+                  for page_number, text in enumerate(plan['page_texts'], start=1)],
+        'text_layer_pages': plan['page_count'] - ocr_pages,
+        'ocr_pages': ocr_pages,
+        'text_layer_ms': plan['text_layer_ms'],
+        'ocr_ms': ocr_ms,
+    }
+
+def ocr_pdf_detailed(pdf_file, on_text=None, content_hash=None):
+    """Extract text from a PDF, reading embedded text where possible and OCR elsewhere
+    
+    Pages with a usable text layer are returned as-is. The remaining pages are
+    grouped into ranges of PDF_PAGES_PER_RANGE pages and sent to Gemini
+    PDF_OCR_CONCURRENCY at a time. Ranges that fail are retried on their own.
+    
+    Args:
+        pdf_file: PDF file content as bytes, or the path of the PDF file
+        on_text: Optional callback receiving the text extracted so far, in page order
+        content_hash: SHA-256 of the PDF if already known (default: computed from the content)
+        
+    Returns:
+        dict: "text" with the extracted text (with page markers for multi-page
+        documents), "pages" listing the source ("text_layer" or "ocr") of each
+        page, and page counts and timings for each source
+    """
+    try:
+        logger.info(f"Starting OCR process for PDF")
+        pdf_hash, pdf_stream = open_pdf(pdf_file, content_hash)
+        
+        with pdf_stream:
+            reader = read_pdf(pdf_stream)
+            if reader is None:
+                # Let Gemini try the document as a whole
+                pdf_stream.seek(0)
+                extracted_text = ocr_pdf_range(pdf_hash, 1, 'end', pdf_stream.read(), on_text)
+                return {'text': extracted_text, 'pages': [], 'text_layer_pages': 0, 'ocr_pages': None}
+        
+            plan = plan_pdf_ocr(reader)
+            start_time = time.time()
+            ocr_results = {}
+            if plan['page_ranges']:
+                ocr_results = ocr_page_ranges(reader, pdf_hash, plan['page_ranges'], partial_range_reporter(plan, on_text))
+            return pdf_ocr_result(plan, ocr_results, int((time.time() - start_time) * 1000))
+
+    except Exception as e:
+        logger.error(f"An error occurred during OCR: {str(e)}")
+        raise
+
+def ocr_pdf(pdf_content, on_text=None):
     """Extract text from a PDF using OCR
     
     Args:
         pdf_content: PDF file content as bytes
+        on_text: Optional callback receiving the text extracted so far while it is generated
         
     Returns:
         string: The extracted text
     """
+    return ocr_pdf_detailed(pdf_content, on_text)['text']
+
+# Asyncio variants, used by jobs in the async serving mode. Gemini calls are made with the
+# SDK's asyncio client, image and PDF processing runs in worker threads
+
+async def generate_content_with_retry_async(client, model, contents):
+    """Awaitable variant of generate_content_with_retry"""
+    logger.info("Generating content with retry...")
+    with track_stage('ocr'):
+        return await call_gemini_async(lambda: client.aio.models.generate_content(
+            model=model,
+            contents=contents
+        ), 'OCR')
+
+async def generate_content_stream_with_retry_async(client, model, contents, on_text):
+    """Awaitable variant of generate_content_stream_with_retry"""
+    logger.info("Generating content (streaming) with retry...")
+
+    async def stream():
+        text = ''
+        async for chunk in await client.aio.models.generate_content_stream(
+            model=model,
+            contents=contents
+        ):
+            if chunk.text:
+                text += chunk.text
+                on_text(text)
+        return text
+
+    with track_stage('ocr'):
+        return await call_gemini_async(stream, 'streamed OCR')
+
+async def ocr_image_part_async(image_part, on_text=None):
+    """Awaitable variant of ocr_image_part"""
+    if on_text:
+        return await generate_content_stream_with_retry_async(get_client(), MODEL, [PROMPT_IMAGE, image_part], on_text)
+    response = await generate_content_with_retry_async(get_client(), MODEL, [PROMPT_IMAGE, image_part])
+    return response.text
+
+async def ocr_image_tiles_async(tiles, mime_type, on_text=None):
+    """Awaitable variant of ocr_image_tiles"""
+    count_bytes('out', 'ocr', sum(len(tile) for tile in tiles))
+    parts = [types.Part.from_bytes(data=tile, mime_type=mime_type) for tile in tiles]
+    if len(parts) == 1:
+        return await ocr_image_part_async(parts[0], on_text)
+
+    logger.info(f"Processing {len(parts)} image tiles, {IMAGE_TILE_CONCURRENCY} at a time")
+    partial_texts = [''] * len(parts)
+    semaphore = asyncio.Semaphore(IMAGE_TILE_CONCURRENCY)
+
+    def on_tile_text(index, text):
+        partial_texts[index] = text
+        on_text('\n\n'.join(tile_text for tile_text in partial_texts if tile_text))
+
+    async def ocr_tile(index):
+        async with semaphore:
+            return await ocr_image_part_async(
+                parts[index],
+                (lambda text: on_tile_text(index, text)) if on_text else None
+            )
+
+    texts = await asyncio.gather(*(ocr_tile(index) for index in range(len(parts))))
+    return '\n\n'.join(text.strip() for text in texts)
+
+async def ocr_image_async(image_file, content_hash=None, on_text=None, input_bytes=None):
+    """Awaitable variant of ocr_image"""
     try:
-        logger.info(f"Starting OCR process for PDF")
+        logger.info(f"Starting OCR process for image")
         
-        # Process the PDF with Gemini (with retry)
-        response = generate_content_with_retry(
-            client,
-            MODEL,
-            [
-                types.Part.from_bytes(
-                    data=pdf_content,
-                    mime_type='application/pdf',
-                ),
-                "OCR this PDF and extract all text content. Format the text to maintain original paragraphs and layout as much as possible."
-            ]
-        )
+        # Return cached text if this image was already processed with the same settings
+        if content_hash is None:
+            content_hash = await asyncio.to_thread(lambda: hash_bytes(image_file.tobytes()))
+        cache_key = image_cache_key(content_hash)
+        # The result cache is on disk, it is read and written in worker threads
+        cached_text = await asyncio.to_thread(cached_ocr_text, cache_key)
+        if cached_text is not None:
+            return cached_text
         
-        # Get the extracted text
-        extracted_text = response.text
-        text_preview = extracted_text[:100] + "..." if len(extracted_text) > 100 else extracted_text
-        logger.info(f"OCR successfully generated. Length: {len(extracted_text)} chars. Preview: {text_preview}")
+        if IMAGE_PREPROCESS:
+            prepared = await asyncio.to_thread(prepare_image, image_file, input_bytes)
+            start_time = time.time()
+            extracted_text = await ocr_image_tiles_async(prepared['tiles'], prepared['mime_type'], on_text)
+            record_image_metrics(prepared, int((time.time() - start_time) * 1000))
+        else:
+            extracted_text = await ocr_image_part_async(image_file, on_text)
+        await asyncio.to_thread(store_ocr_text, cache_key, extracted_text)
             
         return extracted_text
 
     except Exception as e:
         logger.error(f"An error occurred during OCR: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+async def ocr_pdf_range_async(pdf_hash, first_page, last_page, range_content, on_text=None):
+    """Awaitable variant of ocr_pdf_range"""
+    cache_key = pdf_range_cache_key(pdf_hash, first_page, last_page)
+    cached_text = await asyncio.to_thread(cached_range_text, cache_key, first_page, last_page)
+    if cached_text is not None:
+        if on_text:
+            on_text(cached_text)
+        return cached_text
+
+    contents = pdf_range_contents(range_content)
+    if on_text:
+        extracted_text = await generate_content_stream_with_retry_async(get_client(), MODEL, contents, on_text)
+    else:
+        response = await generate_content_with_retry_async(get_client(), MODEL, contents)
+        extracted_text = response.text or ''
+    await asyncio.to_thread(store_range_text, cache_key, first_page, last_page, extracted_text)
+    return extracted_text
+
+async def ocr_page_ranges_async(reader, pdf_hash, page_ranges, on_range_text=None):
+    """Awaitable variant of ocr_page_ranges"""
+    logger.info(f"Processing {len(page_ranges)} page ranges, {PDF_OCR_CONCURRENCY} at a time")
+    extract = page_range_extractor(reader)
+    semaphore = asyncio.Semaphore(PDF_OCR_CONCURRENCY)
+
+    async def ocr_range(first, last):
+        async with semaphore:
+            return await ocr_pdf_range_async(
+                pdf_hash, first, last, await asyncio.to_thread(extract, first, last),
+                (lambda text: on_range_text(first, text)) if on_range_text else None
+            )
+
+    results = {}
+    pending = page_ranges
+    last_error = None
+    for attempt in range(1 + PDF_RANGE_RETRIES):
+        outcomes = await asyncio.gather(*(ocr_range(first, last) for first, last in pending), return_exceptions=True)
+        pending, last_error = sort_range_outcomes(pending, outcomes, results, last_error)
+        if not pending:
+            break
+        logger.info(f"Retrying {len(pending)} failed page ranges")
+
+    raise_failed_ranges(pending, last_error)
+    return results
+
+async def ocr_pdf_detailed_async(pdf_file, on_text=None, content_hash=None):
+    """Awaitable variant of ocr_pdf_detailed"""
+    try:
+        logger.info(f"Starting OCR process for PDF")
+        pdf_hash, pdf_stream = await asyncio.to_thread(open_pdf, pdf_file, content_hash)
+        
+        with pdf_stream:
+            reader = await asyncio.to_thread(read_pdf, pdf_stream)
+            if reader is None:
+                # Let Gemini try the document as a whole
+                pdf_stream.seek(0)
+                pdf_content = await asyncio.to_thread(pdf_stream.read)
+                extracted_text = await ocr_pdf_range_async(pdf_hash, 1, 'end', pdf_content, on_text)
+                return {'text': extracted_text, 'pages': [], 'text_layer_pages': 0, 'ocr_pages': None}
+        
+            plan = await asyncio.to_thread(plan_pdf_ocr, reader)
+            start_time = time.time()
+            ocr_results = {}
+            if plan['page_ranges']:
+                ocr_results = await ocr_page_ranges_async(reader, pdf_hash, plan['page_ranges'], partial_range_reporter(plan, on_text))
+            return pdf_ocr_result(plan, ocr_results, int((time.time() - start_time) * 1000))
+
+    except Exception as e:
+        logger.error(f"An error occurred during OCR: {str(e)}")
+        raise
+
+async def ocr_pdf_async(pdf_content, on_text=None):
+    """Awaitable variant of ocr_pdf"""
+    return (await ocr_pdf_detailed_async(pdf_content, on_text))['text']
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from audio import ffmpeg_available, SegmentWriter
+from youtube import extract_video_id, download_audio, release_audio
+from transcriber import (transcribe_audio, transcribe_audio_async, transcribe_segments, transcript_prompt,
+                         CHUNKED_TRANSCRIPTION, CHUNK_SECONDS, CHUNK_THRESHOLD_SECONDS)
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Long videos are transcribed chunk by chunk while the rest of their audio is still downloading
+YOUTUBE_STREAMING = os.getenv('YOUTUBE_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+
+FOLLOW_INTERVAL = 0.2  # Seconds between checks for newly downloaded audio
+FEED_BLOCK_SIZE = 1024 * 1024
+
+
+class BackgroundDownload:
+    """Downloads the audio of a YouTube video in a thread, following the file as it grows"""
+
+    def __init__(self, youtube_url):
+        self.path = None
+        self.final_path = None
+        self.duration = None
+        self.download = None
+        self.error = None
+        self._cancelled = False
+        self.started = threading.Event()
+        self.finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(youtube_url,), name='youtube-download', daemon=True)
+        self._thread.start()
+
+    def _run(self, youtube_url):
+        try:
+            self.download = download_audio(youtube_url, progress_hook=self._progress)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished.set()
+            self.started.set()
+
+    def _progress(self, progress):
+        if self._cancelled:
+            # yt-dlp stops downloading when a progress hook raises
+            raise Exception("YouTube download cancelled")
+        if progress['status'] == 'downloading' and not self.started.is_set():
+            self.path = progress.get('tmpfilename') or progress['filename']
+            self.final_path = progress['filename']
+            self.duration = (progress.get('info_dict') or {}).get('duration')
+            self.started.set()
+
+    def cancel(self):
+        """Stop the download at its next progress update, and wait for it to end"""
+        self._cancelled = True
+        self.finished.wait()
+
+    def streamable(self):
+        """Wait until the download starts, then return True if the video is long enough to stream"""
+        self.started.wait()
+        # Cached audio is available right away, without a download to follow
+        return self.path is not None and bool(self.duration) and self.duration > CHUNK_THRESHOLD_SECONDS
+
+    def feed(self, writer):
+        """Copy the audio into writer as it is downloaded, until the download ends"""
+        try:
+            try:
+                f = open(self.path, 'rb')
+            except FileNotFoundError:
+                # The download finished and was renamed before we got to it
+                f = open(self.final_path, 'rb')
+            with f:
+                while not writer.closed:
+                    # Check before reading, so the data written last is read once the download is over
+                    finished = self.finished.is_set()
+                    data = f.read(FEED_BLOCK_SIZE)
+                    if data:
+                        writer.write(data)
+                    elif finished:
+                        break
+                    else:
+                        time.sleep(FOLLOW_INTERVAL)
+        except Exception as e:
+            logger.warning(f"Stopped following the YouTube download: {str(e)}")
+            writer.abort()
+            return
+        if self.error:
+            writer.abort()
+        else:
+            writer.close()
+
+    def result(self):
+        """Wait for the download and return it like download_audio does"""
+        self._thread.join()
+        if self.error:
+            raise self.error
+        return self.download
+
+
+def _transcribe_while_downloading(background, youtube_url, include_timestamps, on_text):
+    """Transcribe the chunks of a download as they arrive, or return None if its audio cannot be streamed"""
+    prompt = transcript_prompt(include_timestamps)
+    segment_dir = tempfile.mkdtemp()
+    writer = SegmentWriter(segment_dir, CHUNK_SECONDS)
+    feeder = threading.Thread(target=background.feed, args=(writer,), name='youtube-feed', daemon=True)
+    feeder.start()
+    logger.info(f"Transcribing {background.duration:.0f}s of YouTube audio while it downloads")
+    try:
+        return transcribe_segments(writer.segments(), f"youtube:{extract_video_id(youtube_url)}", prompt,
+                                   include_timestamps, on_text)
+    except Exception as e:
+        if not writer.failed:
+            raise
+        # ffmpeg stops when the download fails, or when it cannot read the audio before it is complete
+        background.finished.wait()
+        if background.error:
+            raise background.error
+        logger.warning(f"Could not split the audio while downloading, transcribing it once downloaded: {str(e)}")
+        return None
+    finally:
+        writer.abort()
+        feeder.join()
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+
+def download_and_transcribe(youtube_url, include_timestamps=True, on_text=None):
+    """Download the audio of a YouTube video and transcribe it
+
+    Videos longer than CHUNK_THRESHOLD_SECONDS are cut into chunks while they
+    download, and each chunk is transcribed as soon as it is complete, so the
+    transcription overlaps with the download instead of following it.
+
+    Args:
+        youtube_url: URL of the video
+        include_timestamps: Whether to include timestamps in the transcript (default: True)
+        on_text: Optional callback receiving the transcript produced so far
+
+    Returns:
+        dict: "transcript" and video "title"
+    """
+    background = BackgroundDownload(youtube_url)
+    transcript = None
+    try:
+        if YOUTUBE_STREAMING and CHUNKED_TRANSCRIPTION and ffmpeg_available() and background.streamable():
+            transcript = _transcribe_while_downloading(background, youtube_url, include_timestamps, on_text)
+        download = background.result()
+    except Exception:
+        # Do not leave the download running, or its audio behind, when the transcription failed
+        background.cancel()
+        if background.download:
+            release_audio(background.download)
+        raise
+
+    try:
+        if transcript is None:
+            logger.info(f"Transcribing YouTube audio: {download['title']}")
+            transcript = transcribe_audio(download['path'], include_timestamps, on_text=on_text)
+    finally:
+        # Delete the temporary files if the download was not kept in the cache
+        release_audio(download)
+    logger.info(f"YouTube audio transcribed successfully: {download['title']}")
+    return {'transcript': transcript, 'title': download['title']}
+
+
+async def download_and_transcribe_async(youtube_url, include_timestamps=True, on_text=None):
+    """Awaitable variant of download_and_transcribe
+
+    Long videos are transcribed while they download in a worker thread, like
+    long recordings are chunked, others once downloaded with the asyncio client.
+    """
+    background = BackgroundDownload(youtube_url)
+    try:
+        streaming = (YOUTUBE_STREAMING and CHUNKED_TRANSCRIPTION and ffmpeg_available()
+                     and await asyncio.to_thread(background.streamable))
+        transcript = None
+        if streaming:
+            transcript = await asyncio.to_thread(
+                _transcribe_while_downloading, background, youtube_url, include_timestamps, on_text
+            )
+        download = await asyncio.to_thread(background.result)
+    except Exception:
+        await asyncio.to_thread(background.cancel)
+        if background.download:
+            await asyncio.to_thread(release_audio, background.download)
+        raise
+
+    try:
+        if transcript is None:
+            logger.info(f"Transcribing YouTube audio: {download['title']}")
+            transcript = await transcribe_audio_async(download['path'], include_timestamps, on_text=on_text)
+    finally:
+        await asyncio.to_thread(release_audio, download)
+    logger.info(f"YouTube audio transcribed successfully: {download['title']}")
+    return {'transcript': transcript, 'title': download['title']}
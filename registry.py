@@ -0,0 +1,162 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Registry shared by all server processes on this host
+REGISTRY_DB = os.getenv('REGISTRY_DB', os.path.join(tempfile.gettempdir(), 'voxlogai-registry.db'))
+TEMP_FILE_TTL = int(os.getenv('TEMP_FILE_TTL', str(30 * 60)))  # Seconds an uploaded file stays available
+REAPER_INTERVAL = int(os.getenv('REAPER_INTERVAL', '60'))  # Seconds between sweeps for expired temp files
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS temp_files (
+    file_id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    content_hash TEXT,
+    created REAL NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS temp_files_expires ON temp_files (expires);
+"""
+
+_local = threading.local()
+_schemas = []
+_migrations = []
+_reaper_lock = threading.Lock()
+_reaper_pid = None
+
+
+def connect():
+    """Return this thread's connection to the registry database
+
+    Connections are per thread and per process, so they are never shared across
+    a fork. Tables registered with register_schema are created on first use.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        connection = sqlite3.connect(REGISTRY_DB, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SCHEMA + ''.join(_schemas))
+        _migrate(connection)
+        for migration in _migrations:
+            migration(connection)
+        _local.connection = connection
+        _local.pid = os.getpid()
+    return _local.connection
+
+
+def _migrate(connection):
+    """Add columns introduced after a registry database was created"""
+    columns = {row['name'] for row in connection.execute('PRAGMA table_info(temp_files)')}
+    if 'content_hash' not in columns:
+        connection.execute('ALTER TABLE temp_files ADD COLUMN content_hash TEXT')
+
+
+def register_schema(schema, migration=None):
+    """Add CREATE statements for tables other modules keep in the registry
+
+    Args:
+        schema: CREATE statements, run on every new connection
+        migration: Optional function called with the connection afterwards, to
+            update tables created by an earlier version
+    """
+    _schemas.append(schema)
+    if migration:
+        _migrations.append(migration)
+
+
+def process_alive(pid):
+    """Return True if a server process on this host is still running, to spot work it left behind"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def register_temp_file(path, ttl=None, content_hash=None):
+    """Record an uploaded temp file and return the ID clients use to refer to it
+
+    Args:
+        path: Path of the temp file
+        ttl: Seconds the file stays available (default: TEMP_FILE_TTL)
+        content_hash: SHA-256 of the file, if it was computed while receiving it
+    """
+    _start_reaper()
+    file_id = str(uuid.uuid4())
+    now = time.time()
+    connect().execute(
+        'INSERT INTO temp_files (file_id, path, content_hash, created, expires) VALUES (?, ?, ?, ?, ?)',
+        (file_id, path, content_hash, now, now + (ttl or TEMP_FILE_TTL))
+    )
+    return file_id
+
+
+def get_temp_file(file_id):
+    """Return the path of a registered temp file, or None if it is unknown or expired"""
+    temp_file = get_temp_file_info(file_id)
+    return temp_file['path'] if temp_file else None
+
+
+def get_temp_file_info(file_id):
+    """Return the path and content hash of a registered temp file, or None if it is unknown or expired"""
+    row = connect().execute(
+        'SELECT path, content_hash FROM temp_files WHERE file_id = ? AND expires > ?',
+        (file_id, time.time())
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def remove_temp_file(file_id):
+    """Forget a temp file and delete it from disk"""
+    row = connect().execute('DELETE FROM temp_files WHERE file_id = ? RETURNING path', (file_id,)).fetchone()
+    if row:
+        _unlink(row['path'])
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+        logger.info(f"Deleted temp file: {path}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Could not delete temp file {path}: {str(e)}")
+
+
+def reap_expired_temp_files():
+    """Delete temp files whose registration expired"""
+    rows = connect().execute('DELETE FROM temp_files WHERE expires <= ? RETURNING file_id, path', (time.time(),)).fetchall()
+    for row in rows:
+        _unlink(row['path'])
+        logger.info(f"Removed expired file_id: {row['file_id']}")
+    return len(rows)
+
+
+def _start_reaper():
+    """Start the expiry reaper thread once per process"""
+    global _reaper_pid
+    with _reaper_lock:
+        if _reaper_pid == os.getpid():
+            return
+        _reaper_pid = os.getpid()
+    threading.Thread(target=_reaper_loop, name='temp-file-reaper', daemon=True).start()
+    logger.info("Started temp file reaper")
+
+
+def _reaper_loop():
+    while True:
+        time.sleep(REAPER_INTERVAL)
+        try:
+            reap_expired_temp_files()
+        except Exception as e:
+            logger.warning(f"Temp file reaper failed: {str(e)}")
@@ -0,0 +1,211 @@
+import logging
+import os
+import queue
+import threading
+import time
+from google.genai import errors
+from cache import file_handle_cache
+from gemini_client import call_gemini
+from registry import connect, register_schema, process_alive
+from metrics import track_stage, REMOTE_CLEANUP_BACKLOG, REMOTE_CLEANUP_LATENCY, REMOTE_ORPHANS
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Remote file reaper configuration
+REMOTE_SWEEP_INTERVAL = int(os.getenv('REMOTE_SWEEP_INTERVAL', str(15 * 60)))  # Seconds between orphan sweeps
+REMOTE_ORPHAN_AGE = int(os.getenv('REMOTE_ORPHAN_AGE', str(60 * 60)))  # Uploads older than this are orphans
+REMOTE_SWEEP_BATCH = int(os.getenv('REMOTE_SWEEP_BATCH', '20'))  # Orphans queued for deletion per batch
+REMOTE_FILE_LIFETIME = 48 * 60 * 60  # Gemini deletes uploaded files on its own after 48 hours
+
+# Names of the files this service uploaded and has not deleted yet, so the sweep
+# never touches files of other deployments sharing the API key. The single row of
+# remote_sweeper elects the one server process on this host that sweeps.
+register_schema("""
+CREATE TABLE IF NOT EXISTS remote_files (
+    name TEXT PRIMARY KEY,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS remote_files_created ON remote_files (created);
+CREATE TABLE IF NOT EXISTS remote_sweeper (
+    lease INTEGER PRIMARY KEY CHECK (lease = 1),
+    pid INTEGER NOT NULL,
+    expires REAL NOT NULL
+);
+""")
+
+# Deletion requests: (file_name, time queued)
+_deletions = queue.Queue()
+_reaper_lock = threading.Lock()
+_reaper_threads = []
+_client = None
+
+_stats_lock = threading.Lock()
+_stats = {
+    'deleted': 0,
+    'failed': 0,
+    'orphans_found': 0,
+    'last_latency_ms': None,
+    'max_latency_ms': 0,
+    'total_latency_ms': 0,
+    'last_sweep': None,
+}
+
+
+def start_reaper(client):
+    """Start the deletion and sweep threads on first use so forked server workers each get their own
+
+    Called for every file uploaded to Gemini, including the ones kept for reuse
+    that are only ever deleted by the orphan sweep.
+    """
+    global _client
+    with _reaper_lock:
+        _client = client
+        if _reaper_threads:
+            return
+        for target, name in ((_deletion_loop, 'remote-file-reaper'), (_sweep_loop, 'remote-file-sweeper')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            _reaper_threads.append(thread)
+        logger.info("Started remote file reaper")
+
+
+def record_upload(file_name):
+    """Remember a file uploaded to Gemini until it is deleted, so the sweep can find it if it is left behind"""
+    connect().execute('INSERT OR REPLACE INTO remote_files (name, created) VALUES (?, ?)', (file_name, time.time()))
+
+
+def forget_upload(file_name):
+    connect().execute('DELETE FROM remote_files WHERE name = ?', (file_name,))
+
+
+def schedule_delete(client, file_name):
+    """Queue a remote Gemini file for deletion off the request path"""
+    start_reaper(client)
+    _queue_delete(file_name)
+
+
+def _queue_delete(file_name):
+    REMOTE_CLEANUP_BACKLOG.inc()
+    _deletions.put((file_name, time.time()))
+
+
+def _deletion_loop():
+    while True:
+        file_name, queued_at = _deletions.get()
+        try:
+            with track_stage('remote_cleanup'):
+                call_gemini(lambda: _client.files.delete(name=file_name), 'file deletion')
+            forget_upload(file_name)
+            latency_ms = int((time.time() - queued_at) * 1000)
+            REMOTE_CLEANUP_LATENCY.observe(latency_ms / 1000)
+            with _stats_lock:
+                _stats['deleted'] += 1
+                _stats['last_latency_ms'] = latency_ms
+                _stats['max_latency_ms'] = max(_stats['max_latency_ms'], latency_ms)
+                _stats['total_latency_ms'] += latency_ms
+            logger.info(f"Deleted remote file {file_name} ({latency_ms}ms after it was queued)")
+        except errors.APIError as e:
+            if e.code == 404:
+                # Already deleted, or expired on the Gemini side
+                forget_upload(file_name)
+                logger.info(f"Remote file {file_name} was already gone")
+            else:
+                _deletion_failed(file_name, e)
+        except Exception as e:
+            _deletion_failed(file_name, e)
+        finally:
+            REMOTE_CLEANUP_BACKLOG.dec()
+            _deletions.task_done()
+
+
+def _deletion_failed(file_name, error):
+    # The file stays recorded, so the next sweep tries again
+    with _stats_lock:
+        _stats['failed'] += 1
+    logger.warning(f"Could not delete remote file {file_name}: {str(error)}")
+
+
+def _sweep_loop():
+    while True:
+        time.sleep(REMOTE_SWEEP_INTERVAL)
+        try:
+            if _claim_sweeper():
+                sweep_orphans()
+        except Exception as e:
+            logger.warning(f"Remote file sweep failed: {str(e)}")
+
+
+def _claim_sweeper():
+    """Take or renew the sweeper lease, so only one server process on this host sweeps
+
+    The lease outlives two sweep intervals, another process takes it over once
+    its holder exits or stops renewing it.
+    """
+    connection = connect()
+    now = time.time()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        holder = connection.execute('SELECT pid, expires FROM remote_sweeper WHERE lease = 1').fetchone()
+        if holder and holder['pid'] != os.getpid() and holder['expires'] > now and process_alive(holder['pid']):
+            connection.execute('ROLLBACK')
+            return False
+        connection.execute('INSERT OR REPLACE INTO remote_sweeper (lease, pid, expires) VALUES (1, ?, ?)',
+                           (os.getpid(), now + 2 * REMOTE_SWEEP_INTERVAL))
+        connection.execute('COMMIT')
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+    if not holder or holder['pid'] != os.getpid():
+        logger.info("This process is now the remote file sweeper")
+    return True
+
+
+def sweep_orphans():
+    """Queue files this service uploaded more than REMOTE_ORPHAN_AGE ago for deletion, REMOTE_SWEEP_BATCH at a time
+
+    Catches files left behind by crashed or restarted workers and uploads whose
+    handle cache entry expired. Younger files may belong to requests still in
+    flight and are left alone, and files uploaded by anything else are never
+    touched.
+    """
+    now = time.time()
+    connection = connect()
+    # Gemini has already deleted these
+    connection.execute('DELETE FROM remote_files WHERE created < ?', (now - REMOTE_FILE_LIFETIME,))
+    stale = [row['name'] for row in connection.execute(
+        'SELECT name FROM remote_files WHERE created < ? ORDER BY created', (now - REMOTE_ORPHAN_AGE,))]
+    # Files still referenced by the handle cache are kept for reuse
+    live_names = {handle["name"] for handle in file_handle_cache.values()}
+    orphans = [name for name in stale if name not in live_names]
+
+    found = 0
+    for index in range(0, len(orphans), REMOTE_SWEEP_BATCH):
+        found += _queue_batch(orphans[index:index + REMOTE_SWEEP_BATCH])
+
+    with _stats_lock:
+        _stats['orphans_found'] += found
+        _stats['last_sweep'] = time.time()
+    REMOTE_ORPHANS.inc(found)
+    logger.info(f"Remote file sweep complete, queued {found} orphaned files for deletion")
+
+
+def _queue_batch(batch):
+    """Queue a batch of orphans and wait until it is drained before listing more"""
+    for file_name in batch:
+        _queue_delete(file_name)
+    _deletions.join()
+    return len(batch)
+
+
+def reaper_stats():
+    """Return deletion counters, latency and backlog for this process
+
+    /metrics has the backlog and latency summed over all server processes.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['backlog'] = _deletions.qsize()
+    stats['avg_latency_ms'] = int(stats['total_latency_ms'] / stats['deleted']) if stats['deleted'] else None
+    del stats['total_latency_ms']
+    return stats
@@ -0,0 +1,197 @@
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from timestamps import TIMESTAMP_PATTERN, split_segments
+from metrics import track_stage
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Transcripts and OCR text are kept in a local database and searchable without calling Gemini again
+TRANSCRIPT_STORE_ENABLED = os.getenv('TRANSCRIPT_STORE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+TRANSCRIPT_STORE_DB = os.getenv('TRANSCRIPT_STORE_DB', os.path.join(tempfile.gettempdir(), 'voxlogai-transcripts.db'))
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', '100'))  # Most segments one search returns
+
+# Documents hold the full text and its metadata, segments the searchable pieces of it.
+# Segments keep their timestamps as integers and their text without the timestamp,
+# the full-text index reads the text from the segments table instead of copying it
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    document_id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    content_key TEXT UNIQUE,
+    title TEXT,
+    source TEXT,
+    text TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_created ON documents (created);
+CREATE TABLE IF NOT EXISTS segments (
+    segment_id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents (document_id) ON DELETE CASCADE,
+    start_ms INTEGER,
+    end_ms INTEGER,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_document ON segments (document_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts USING fts5(
+    text, content='segments', content_rowid='segment_id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS segments_insert AFTER INSERT ON segments BEGIN
+    INSERT INTO segments_fts (rowid, text) VALUES (new.segment_id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS segments_delete AFTER DELETE ON segments BEGIN
+    INSERT INTO segments_fts (segments_fts, rowid, text) VALUES ('delete', old.segment_id, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS segments_update AFTER UPDATE ON segments BEGIN
+    INSERT INTO segments_fts (segments_fts, rowid, text) VALUES ('delete', old.segment_id, old.text);
+    INSERT INTO segments_fts (rowid, text) VALUES (new.segment_id, new.text);
+END;
+"""
+
+_local = threading.local()
+
+
+def connect():
+    """Return this thread's connection to the transcript store
+
+    Like the registry, connections are per thread and per process so they are
+    never shared across a fork.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        connection = sqlite3.connect(TRANSCRIPT_STORE_DB, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('PRAGMA foreign_keys=ON')
+        connection.executescript(SCHEMA)
+        _local.connection = connection
+        _local.pid = os.getpid()
+    return _local.connection
+
+
+def split_document(text):
+    """Cut a transcript or OCR text into (start_ms, end_ms, text) rows for the index
+
+    Timestamped transcripts give one row per timestamp range, with the timestamp
+    removed from the text. Text without timestamps is cut into paragraphs, with
+    no position.
+    """
+    preamble, segments = split_segments(text)
+    rows = [(start_ms, end_ms, TIMESTAMP_PATTERN.sub('', segment, count=1).strip())
+            for start_ms, end_ms, segment in segments]
+    rows = [(None, None, paragraph.strip()) for paragraph in re.split(r'\n\s*\n', preamble)] + rows
+    return [row for row in rows if row[2]]
+
+
+def save_document(kind, text, content_key=None, title=None, source=None):
+    """Store a transcript or OCR text and index its segments
+
+    Saving a result with the same content_key again, for example after a cache
+    hit, replaces the text of the earlier copy instead of adding a duplicate,
+    and keeps its document ID so links to it stay valid.
+
+    Args:
+        kind: Job kind that produced the text ("transcribe", "transcribe_youtube", "ocr_image", "ocr_pdf")
+        text: Transcript or extracted text
+        content_key: Optional key identifying the input and options the text was produced from
+        title: Optional display name, such as the video title or file name
+        source: Optional origin of the input, such as the YouTube URL
+
+    Returns:
+        int: ID of the stored document, or None when the store is disabled or the text is empty
+    """
+    if not TRANSCRIPT_STORE_ENABLED or not text or not text.strip():
+        return None
+
+    rows = split_document(text)
+    connection = connect()
+    with track_stage('transcript_store'):
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            document_id = connection.execute(
+                'INSERT INTO documents (kind, content_key, title, source, text, created) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (content_key) DO UPDATE SET kind = excluded.kind, '
+                'title = COALESCE(excluded.title, title), source = COALESCE(excluded.source, source), '
+                'text = excluded.text, created = excluded.created '
+                'RETURNING document_id',
+                (kind, content_key, title, source, text, time.time())
+            ).fetchone()[0]
+            # The segments of an earlier copy are replaced, the delete trigger drops them from the index
+            connection.execute('DELETE FROM segments WHERE document_id = ?', (document_id,))
+            connection.executemany(
+                'INSERT INTO segments (document_id, start_ms, end_ms, text) VALUES (?, ?, ?, ?)',
+                [(document_id, start_ms, end_ms, segment) for start_ms, end_ms, segment in rows]
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+    logger.info(f"Stored {kind} document {document_id} with {len(rows)} segments")
+    return document_id
+
+
+def get_document(document_id):
+    """Return a stored document with its full text, or None if it is unknown"""
+    row = connect().execute('SELECT * FROM documents WHERE document_id = ?', (document_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def delete_document(document_id):
+    """Remove a stored document and its segments from the index
+
+    Returns:
+        bool: Whether the document existed
+    """
+    return connect().execute('DELETE FROM documents WHERE document_id = ?', (document_id,)).rowcount > 0
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query matching segments that contain every word
+
+    Words are quoted so punctuation and FTS5 operators in the query are taken
+    literally. A trailing * keeps prefix matching, so "transcri*" finds
+    "transcript" and "transcription".
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def search_segments(query, kind=None, limit=20):
+    """Find stored segments matching a query, best matches first
+
+    Args:
+        query: Words the segments must all contain
+        kind: Optional job kind to restrict the search to
+        limit: Largest number of segments returned, capped at SEARCH_MAX_RESULTS
+
+    Returns:
+        list: dicts with the "document_id", "kind", "title", "source" and
+        "created" time of the document, and the segment "start_ms", "end_ms"
+        (None for text without timestamps) and "text"
+    """
+    expression = match_expression(query)
+    if not expression:
+        return []
+    sql = ('SELECT d.document_id, d.kind, d.title, d.source, d.created, s.start_ms, s.end_ms, s.text '
+           'FROM segments_fts JOIN segments s ON s.segment_id = segments_fts.rowid '
+           'JOIN documents d ON d.document_id = s.document_id '
+           'WHERE segments_fts MATCH ?')
+    parameters = [expression]
+    if kind:
+        sql += ' AND d.kind = ?'
+        parameters.append(kind)
+    sql += ' ORDER BY segments_fts.rank, s.segment_id LIMIT ?'
+    parameters.append(max(1, min(limit, SEARCH_MAX_RESULTS)))
+
+    with track_stage('transcript_search'):
+        return [dict(row) for row in connect().execute(sql, parameters)]
@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+
+# Settings are read when the modules are imported, so point every on-disk store
+# at a scratch directory before any of them is
+_directory = tempfile.mkdtemp(prefix='voxlogai-tests-')
+os.environ.update({
+    'GEMINI_API_KEY': 'test',
+    'REGISTRY_DB': os.path.join(_directory, 'registry.db'),
+    'TRANSCRIPT_STORE_DB': os.path.join(_directory, 'transcripts.db'),
+    'RESULT_CACHE_DIR': os.path.join(_directory, 'cache'),
+    'YOUTUBE_CACHE_DIR': os.path.join(_directory, 'youtube'),
+    'RESULT_CACHE_ENABLED': 'false',
+    'SPEECH_TRANSCODE': 'false',
+    'CHUNKED_TRANSCRIPTION': 'false',
+    'GEMINI_RPM': '6000',
+})
+os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+
+import pytest
+from fake_gemini import FakeGeminiClient, FakeGeminiConfig
+from gemini_client import use_client
+
+
+@pytest.fixture
+def fake_client():
+    """Serve Gemini calls from the benchmark stand-in, without latency"""
+    client = FakeGeminiClient(FakeGeminiConfig(latency=0, jitter=0, chunk_delay=0))
+    use_client(client)
+    return client
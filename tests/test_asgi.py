@@ -0,0 +1,31 @@
+import asyncio
+import threading
+import time
+import httpx
+from flask import jsonify
+from app import app
+from asgi import application
+
+
+def test_flask_requests_run_concurrently(monkeypatch):
+    threads = set()
+
+    def slow_stats():
+        threads.add(threading.get_ident())
+        time.sleep(0.5)
+        return jsonify({})
+
+    monkeypatch.setitem(app.view_functions, 'stats', slow_stats)
+
+    async def run():
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*(client.get('/stats') for _ in range(5)))
+            return responses, time.perf_counter() - start
+
+    responses, elapsed = asyncio.run(run())
+    assert all(response.status_code == 200 for response in responses)
+    # Five half-second requests overlap instead of queueing behind one thread
+    assert elapsed < 1.5
+    assert len(threads) == 5
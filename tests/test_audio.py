@@ -0,0 +1,21 @@
+from audio import plan_chunks
+
+
+def test_short_file_is_a_single_chunk():
+    assert plan_chunks(30.0, 600) == [(0.0, 30.0)]
+    # Up to a quarter over the chunk length is not worth a separate chunk
+    assert plan_chunks(700.0, 600) == [(0.0, 700.0)]
+
+
+def test_exact_multiple_of_the_chunk_length():
+    assert plan_chunks(1800.0, 600) == [(0.0, 600.0), (600.0, 1200.0), (1200.0, 1800.0)]
+
+
+def test_tail_shorter_than_the_overlap_joins_the_last_chunk():
+    # A 2 second tail, shorter than the 3 second overlap added around each chunk, is not split off
+    assert plan_chunks(1202.0, 600) == [(0.0, 600.0), (600.0, 1202.0)]
+
+
+def test_boundaries_move_to_the_closest_silence():
+    silences = [(590.0, 594.0), (640.0, 650.0)]
+    assert plan_chunks(1500.0, 600, silences) == [(0.0, 592.0), (592.0, 1192.0), (1192.0, 1500.0)]
@@ -0,0 +1,88 @@
+import types
+import httpx
+import pytest
+import requests
+import gemini_client
+import remote_files
+from google.genai import errors
+from gemini_client import call_gemini, gemini_stats, _is_retryable, _update_bucket
+from registry import connect
+
+
+def test_only_transport_errors_and_retryable_statuses_are_retried():
+    assert _is_retryable(httpx.ConnectError('connection reset'))
+    assert _is_retryable(httpx.ReadTimeout('timed out'))
+    assert _is_retryable(requests.ConnectionError('token refresh failed'))
+    assert _is_retryable(ConnectionResetError('connection reset by peer'))
+    assert _is_retryable(errors.ClientError(429, {'error': {'code': 429, 'message': 'quota'}}, None))
+    assert _is_retryable(errors.ServerError(503, {'error': {'code': 503, 'message': 'unavailable'}}, None))
+    assert not _is_retryable(errors.ClientError(404, {'error': {'code': 404, 'message': 'not found'}}, None))
+    assert not _is_retryable(FileNotFoundError('recording.wav'))
+    assert not _is_retryable(TypeError('bad argument'))
+
+
+def test_bugs_fail_on_the_first_attempt():
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise TypeError('bad argument')
+
+    with pytest.raises(TypeError):
+        call_gemini(broken)
+    assert len(attempts) == 1
+
+
+def test_file_cleanup_goes_through_the_rate_limiter(fake_client):
+    fake_client.files.upload(file=__file__)
+    calls = gemini_stats()['calls']
+    remote_files.start_reaper(fake_client)
+    remote_files.sweep_orphans()
+    remote_files.schedule_delete(fake_client, 'files/benchmark-0')
+    remote_files._deletions.join()
+    # Only the deletion, the sweep reads the files to delete from the registry
+    assert gemini_stats()['calls'] == calls + 1
+
+
+@pytest.fixture
+def fresh_bucket():
+    connect().execute('DELETE FROM rate_limiter')
+    yield
+    # Later tests start from a full bucket at the configured rate
+    connect().execute('DELETE FROM rate_limiter')
+
+
+def test_token_bucket_refills_at_the_shared_rate(monkeypatch, fresh_bucket):
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(gemini_client, 'time', types.SimpleNamespace(time=lambda: clock.now))
+    monkeypatch.setattr(gemini_client, 'GEMINI_RPM', 60)
+    monkeypatch.setattr(gemini_client, 'GEMINI_BURST', 2)
+
+    # A full bucket allows a burst, then one token per second
+    assert _update_bucket(take=True) == 0
+    assert _update_bucket(take=True) == 0
+    assert _update_bucket(take=True) == pytest.approx(1.0)
+    clock.now += 0.25
+    assert _update_bucket(take=False) == pytest.approx(0.75)
+    clock.now += 0.75
+    assert _update_bucket(take=True) == 0
+
+    # A quiet period never refills more than the burst
+    clock.now += 100
+    assert _update_bucket(take=True) == 0
+    assert _update_bucket(take=True) == 0
+    assert _update_bucket(take=True) == pytest.approx(1.0)
+
+    # A 429 pauses everyone for the delay asked for and halves the rate
+    gemini_client._record_rate_limited(5)
+    clock.now += 2
+    assert _update_bucket(take=True) == pytest.approx(3.0)
+    clock.now += 3
+    assert connect().execute('SELECT rate FROM rate_limiter').fetchone()['rate'] == pytest.approx(0.5)
+    assert _update_bucket(take=True) == 0
+    assert _update_bucket(take=True) == 0
+    assert _update_bucket(take=True) == pytest.approx(2.0)
+
+    # Each success restores 5% of the full rate
+    gemini_client._record_success()
+    assert connect().execute('SELECT rate FROM rate_limiter').fetchone()['rate'] == pytest.approx(0.55)
@@ -0,0 +1,71 @@
+import io
+import os
+import threading
+import time
+import app as app_module
+from registry import get_temp_file_info
+from jobs import submit_or_join_job, get_job, partial_text_reporter, JOB_POLL_INTERVAL, DONE
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_partial_output_is_coalesced():
+    release = threading.Event()
+    reporters = []
+
+    def task():
+        report = partial_text_reporter()
+        reporters.append(report)
+        text = ''
+        for index in range(500):
+            text += f"word{index} "
+            report(text)
+        release.wait(5)
+        return {'text': text}
+
+    job_id, _ = submit_or_join_job('test_partial', None, task)
+    assert wait_for(lambda: get_job(job_id)['partial'].endswith('word499 '))
+
+    # 500 reports become a handful of writes, and the latest text is never lost
+    job = get_job(job_id)
+    assert job['version'] <= 5
+    release.set()
+    assert wait_for(lambda: get_job(job_id)['status'] == DONE)
+
+    # Output reported after the job finished is dropped, not written over the result
+    reporters[0]('late output')
+    time.sleep(JOB_POLL_INTERVAL * 2)
+    assert get_job(job_id)['partial'] == ''
+
+
+def test_duplicate_transcription_drops_its_own_upload(monkeypatch):
+    release = threading.Event()
+
+    def slow_transcription(file_id, temp_path, *args):
+        release.wait(5)
+        return {'transcript': 'done'}
+
+    monkeypatch.setattr(app_module, 'run_transcription', slow_transcription)
+    client = app_module.app.test_client()
+    file_ids = [
+        client.post('/upload', data={'audio': (io.BytesIO(b'RIFF same recording'), 'meeting.wav')}).json['file_id']
+        for _ in range(2)
+    ]
+    paths = [get_temp_file_info(file_id)['path'] for file_id in file_ids]
+
+    first = client.post('/transcribe', json={'file_id': file_ids[0]})
+    second = client.post('/transcribe', json={'file_id': file_ids[1]})
+    release.set()
+    assert second.json['deduplicated'] and second.json['job_id'] == first.json['job_id']
+
+    # The joining request's copy is not read by anyone, so it is removed right away
+    assert get_temp_file_info(file_ids[1]) is None
+    assert not os.path.exists(paths[1])
+    assert get_temp_file_info(file_ids[0]) is not None
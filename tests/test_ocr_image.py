@@ -0,0 +1,11 @@
+import io
+import app as app_module
+
+
+def test_heic_is_refused_up_front_without_pillow_heif(monkeypatch):
+    monkeypatch.setattr(app_module, 'heif_supported', lambda: False)
+    response = app_module.app.test_client().post(
+        '/ocr_image', data={'image': (io.BytesIO(b'not really heic'), 'photo.heic')}
+    )
+    assert response.status_code == 400
+    assert 'HEIC' in response.json['error']
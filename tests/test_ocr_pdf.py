@@ -0,0 +1,66 @@
+import asyncio
+import io
+import threading
+import time
+import ocr
+from pypdf import PdfReader, PdfWriter
+from ocr import group_page_ranges, has_usable_text
+
+
+def test_group_page_ranges_splits_gaps_and_long_runs():
+    assert group_page_ranges([], 4) == []
+    assert group_page_ranges([1, 2, 3, 5, 6, 9], 4) == [(1, 3), (5, 6), (9, 9)]
+    assert group_page_ranges(list(range(1, 11)), 4) == [(1, 4), (5, 8), (9, 10)]
+    assert group_page_ranges([1, 2, 3], 1) == [(1, 1), (2, 2), (3, 3)]
+
+
+def test_has_usable_text_threshold(monkeypatch):
+    monkeypatch.setattr(ocr, 'PDF_TEXT_MIN_CHARS', 20)
+    # Whitespace does not count towards the minimum
+    assert not has_usable_text('a b c d e f g h i j k l m n o p q r s')
+    assert has_usable_text('Quarterly budget review notes')
+    # Text that extracts mostly as symbols comes from a broken font encoding
+    assert not has_usable_text('\ue000\ue001\ue002' * 8 + ' Budget')
+    assert not has_usable_text('#$%&*+=/<>@^~|' * 2 + ' Budget')
+    assert has_usable_text('Budget: 1,200.00 EUR; (net)')
+
+
+def test_page_ranges_are_extracted_only_when_a_worker_is_free(monkeypatch):
+    writer = PdfWriter()
+    for _ in range(12):
+        writer.add_blank_page(width=200, height=200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    reader = PdfReader(buffer)
+
+    lock = threading.Lock()
+    held = {'now': 0, 'most': 0}
+    extract_page_range = ocr.extract_page_range
+
+    def counting_extract(reader, first, last):
+        with lock:
+            held['now'] += 1
+            held['most'] = max(held['most'], held['now'])
+        return extract_page_range(reader, first, last)
+
+    def fake_ocr(pdf_hash, first, last, range_content, on_text=None):
+        time.sleep(0.01)
+        with lock:
+            held['now'] -= 1
+        return f"pages {first}-{last}"
+
+    async def fake_ocr_async(*args):
+        await asyncio.sleep(0.01)
+        return fake_ocr(*args)
+
+    monkeypatch.setattr(ocr, 'PDF_OCR_CONCURRENCY', 2)
+    monkeypatch.setattr(ocr, 'extract_page_range', counting_extract)
+    monkeypatch.setattr(ocr, 'ocr_pdf_range', fake_ocr)
+    monkeypatch.setattr(ocr, 'ocr_pdf_range_async', fake_ocr_async)
+    page_ranges = group_page_ranges(range(1, 13), 1)
+
+    assert len(ocr.ocr_page_ranges(reader, 'test-pdf', page_ranges)) == 12
+    assert held['most'] <= 2
+    held['most'] = 0
+    assert len(asyncio.run(ocr.ocr_page_ranges_async(reader, 'test-pdf', page_ranges))) == 12
+    assert held['most'] <= 2
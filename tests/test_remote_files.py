@@ -0,0 +1,44 @@
+import os
+import time
+import remote_files
+from cache import file_handle_cache
+from registry import connect
+from transcriber import transcribe_audio
+
+
+def test_kept_uploads_are_swept_once_stale(fake_client, tmp_path, monkeypatch):
+    assert file_handle_cache.enabled
+    for index in range(3):
+        path = tmp_path / f"recording{index}.wav"
+        path.write_bytes(b'RIFF' + bytes([index]) * 2048)
+        transcribe_audio(str(path), content_hash=f"test-sweep-{index}")
+
+    # The uploads are kept for reuse, the sweeper must still be running to delete them later
+    assert len(fake_client.files.uploaded) == 3
+    assert remote_files._reaper_threads
+
+    # A file uploaded by another deployment sharing the API key is never swept
+    other = fake_client.files.upload(file=str(path))
+
+    # Once the handle cache forgets them and they are old enough, the sweep deletes them
+    for index in range(3):
+        file_handle_cache.delete(f"test-sweep-{index}")
+    connect().execute('UPDATE remote_files SET created = ?', (time.time() - 60 * 60,))
+    monkeypatch.setattr(remote_files, 'REMOTE_ORPHAN_AGE', 60)
+    remote_files.sweep_orphans()
+    assert list(fake_client.files.uploaded) == [other.name]
+    assert connect().execute('SELECT COUNT(*) FROM remote_files').fetchone()[0] == 0
+
+
+def test_one_process_holds_the_sweeper_lease():
+    connection = connect()
+    connection.execute('DELETE FROM remote_sweeper')
+    assert remote_files._claim_sweeper()
+    # Renewed by its holder
+    assert remote_files._claim_sweeper()
+
+    # A live process holding the lease keeps it, the lease of one that exited is taken over
+    connection.execute('UPDATE remote_sweeper SET pid = ?', (os.getppid(),))
+    assert not remote_files._claim_sweeper()
+    connection.execute('UPDATE remote_sweeper SET pid = ?', (2 ** 22 + 1,))
+    assert remote_files._claim_sweeper()
@@ -0,0 +1,34 @@
+import app as app_module
+from store import get_document, save_document, search_segments
+
+
+def test_search_returns_segments_with_timestamps():
+    transcript = ("[0m1s0ms - 0m4s500ms] We agreed on the quarterly budget.\n"
+                  "[0m4s500ms - 0m9s0ms] Next week we review hiring.\n")
+    document_id = save_document('transcribe', transcript, 'transcribe:test-search', 'meeting.wav')
+
+    results = search_segments('quarter* budget')
+    assert [(result['document_id'], result['start_ms'], result['end_ms']) for result in results] == [
+        (document_id, 1000, 4500)
+    ]
+    assert results[0]['text'] == 'We agreed on the quarterly budget.'
+    # Operators typed by users are searched as words, not parsed
+    assert search_segments('budget OR "hiring') == []
+
+
+def test_youtube_documents_are_keyed_like_other_jobs(monkeypatch):
+    monkeypatch.setattr(app_module, 'download_and_transcribe',
+                        lambda url, include_timestamps, on_text=None: {'transcript': 'A talk', 'title': 'Talk'})
+    result = app_module.run_youtube_transcription('https://www.youtube.com/watch?v=abcdefghijk', True)
+    assert get_document(result['document_id'])['content_key'].startswith('transcribe_youtube:')
+
+
+def test_saving_again_keeps_the_document_id():
+    document_id = save_document('transcribe', 'The first draft mentions zeppelins.', 'transcribe:test-resave', 'draft.wav')
+    assert save_document('transcribe', 'The second draft mentions gondolas.', 'transcribe:test-resave') == document_id
+
+    document = get_document(document_id)
+    assert document['text'] == 'The second draft mentions gondolas.'
+    assert document['title'] == 'draft.wav'
+    assert search_segments('zeppelins') == []
+    assert [result['document_id'] for result in search_segments('gondolas')] == [document_id]
@@ -0,0 +1,47 @@
+from timestamps import shift_timestamps
+from transcriber import merge_chunk_transcripts, remove_overlap
+
+
+def test_shift_timestamps_carries_seconds_into_minutes_past_the_hour():
+    text = "[59m50s500ms - 59m59s900ms] Closing remarks."
+    assert shift_timestamps(text, 20 * 1000) == "[60m10s500ms - 60m19s900ms] Closing remarks."
+    assert shift_timestamps("No timestamps here", 5000) == "No timestamps here"
+
+
+def test_remove_overlap_cuts_text_repeated_from_the_previous_chunk():
+    previous = "we will start with the budget and then move on to hiring for the new team"
+    text = "move on to hiring for the new team. First candidate is Ana"
+    assert remove_overlap(previous, text) == "First candidate is Ana"
+    # Fewer than three words in common is not treated as overlap
+    assert remove_overlap(previous, "the team is ready") == "the team is ready"
+    # A chunk that only repeats the previous one adds nothing
+    assert remove_overlap(previous, "hiring for the new team") == ''
+
+
+def test_merge_keeps_each_segment_in_the_chunk_it_starts_in():
+    chunks = [(0, 60), (60, 120)]
+    results = [
+        (0, "[0m1s0ms - 0m30s0ms] First part.\n[0m58s0ms - 1m2s0ms] Across the boundary."),
+        # The second chunk's audio starts 5 seconds early, so it hears the boundary segment again
+        (55, "[0m3s0ms - 0m7s0ms] Across the boundary.\n[0m10s0ms - 0m40s0ms] Second part."),
+    ]
+    assert merge_chunk_transcripts(chunks, results, include_timestamps=True) == (
+        "[0m1s0ms - 0m30s0ms] First part.\n[0m58s0ms - 1m2s0ms] Across the boundary.\n"
+        "[1m5s0ms - 1m35s0ms] Second part."
+    )
+
+
+def test_merge_without_timestamps_drops_overlap_and_empty_chunks():
+    chunks = [(0, 60), (60, 120), (120, 180)]
+    results = [
+        (0, "one two three four five six"),
+        (55, "   "),
+        (115, "four five six seven eight"),
+    ]
+    # A silent chunk adds nothing, and there is nothing of it to trim from the next chunk
+    assert merge_chunk_transcripts(chunks, results, include_timestamps=False) == (
+        "one two three four five six\nfour five six seven eight"
+    )
+    assert merge_chunk_transcripts([(0, 60), (60, 120)], [(0, "one two"), (55, "three four")], False) == (
+        "one two\nthree four"
+    )
@@ -0,0 +1,98 @@
+import hashlib
+import io
+import os
+import pytest
+import uploads
+from registry import connect, get_temp_file_info
+from uploads import create_upload, write_chunk, finalize_upload, UploadError
+
+
+def chunk_range(upload, index, data):
+    start = index * upload['chunk_size']
+    end = min(start + upload['chunk_size'], len(data)) - 1
+    return f"bytes {start}-{end}/{len(data)}", io.BytesIO(data[start:end + 1])
+
+
+def test_chunks_are_refused_while_finalizing(monkeypatch):
+    data = b'a' * 1000
+    upload = create_upload('talk.wav', len(data))
+    write_chunk(upload['upload_id'], *chunk_range(upload, 0, data))
+
+    # A chunk sent again while the file is being hashed must not change it
+    original_hash_file = uploads.hash_file
+    refused = []
+
+    def hash_file_during_put(path):
+        with pytest.raises(UploadError) as error:
+            write_chunk(upload['upload_id'], *chunk_range(upload, 0, b'b' * 1000))
+        refused.append(error.value.status)
+        return original_hash_file(path)
+
+    monkeypatch.setattr(uploads, 'hash_file', hash_file_during_put)
+    file_id, _, _ = finalize_upload(upload['upload_id'])
+
+    assert refused == [409]
+    temp_file = get_temp_file_info(file_id)
+    with open(temp_file['path'], 'rb') as f:
+        assert f.read() == data
+    assert temp_file['content_hash'] == original_hash_file(temp_file['path'])
+
+
+def test_finalize_waits_for_chunks_being_written():
+    data = b'c' * 1000
+    upload = create_upload('talk.wav', len(data))
+    content_range, body = chunk_range(upload, 0, data)
+    errors = []
+
+    class FinalizingStream:
+        """A request body that tries to finalize the upload while it is being read"""
+
+        def read(self, size=-1):
+            if not errors:
+                with pytest.raises(UploadError) as error:
+                    finalize_upload(upload['upload_id'])
+                errors.append(error.value)
+            return body.read(size)
+
+    # A chunk being sent again counts as missing until it is complete
+    write_chunk(upload['upload_id'], *chunk_range(upload, 0, data))
+    write_chunk(upload['upload_id'], content_range, FinalizingStream())
+    assert errors[0].status == 409
+    assert 'chunks missing' in str(errors[0])
+
+    # A write still registered by a live process holds finalizing back
+    connect().execute('INSERT INTO upload_writes (upload_id, pid) VALUES (?, ?)', (upload['upload_id'], os.getpid()))
+    with pytest.raises(UploadError) as error:
+        finalize_upload(upload['upload_id'])
+    assert 'still being written' in str(error.value)
+    connect().execute('DELETE FROM upload_writes WHERE upload_id = ?', (upload['upload_id'],))
+    assert finalize_upload(upload['upload_id'])[0]
+
+
+def test_failed_resend_unrecords_the_chunk():
+    data = bytes(range(256)) * 4
+    upload = create_upload('talk.wav', len(data), hashlib.sha256(data).hexdigest())
+    write_chunk(upload['upload_id'], *chunk_range(upload, 0, data))
+
+    # The connection drops halfway through sending the chunk again, over the bytes already on disk
+    content_range, _ = chunk_range(upload, 0, data)
+    with pytest.raises(UploadError):
+        write_chunk(upload['upload_id'], content_range, io.BytesIO(b'x' * 100))
+    with pytest.raises(UploadError) as error:
+        finalize_upload(upload['upload_id'])
+    assert error.value.status == 409
+
+    # Sending it again in full repairs the file
+    write_chunk(upload['upload_id'], *chunk_range(upload, 0, data))
+    with pytest.raises(UploadError) as error:
+        finalize_upload(upload['upload_id'], hashlib.sha256(b'something else').hexdigest())
+    assert error.value.status == 422
+    file_id, _, _ = finalize_upload(upload['upload_id'], hashlib.sha256(data).hexdigest())
+    with open(get_temp_file_info(file_id)['path'], 'rb') as f:
+        assert f.read() == data
+
+
+def test_size_must_be_a_number_of_bytes():
+    for size in (True, 0, -1, '1000', 1.5):
+        with pytest.raises(UploadError):
+            create_upload('talk.wav', size)
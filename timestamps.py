@@ -0,0 +1,49 @@
+import re
+
+# Matches transcript timestamps in the format [8m40s242ms - 8m51s12ms]
+TIMESTAMP_PATTERN = re.compile(r'\[(\d+)m(\d+)s(\d+)ms\s*-\s*(\d+)m(\d+)s(\d+)ms\]')
+
+
+def to_milliseconds(minutes, seconds, milliseconds):
+    return (int(minutes) * 60 + int(seconds)) * 1000 + int(milliseconds)
+
+
+def format_timestamp(milliseconds):
+    """Format a position in milliseconds as 8m40s242ms"""
+    milliseconds = max(0, int(round(milliseconds)))
+    minutes, milliseconds = divmod(milliseconds, 60 * 1000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{minutes}m{seconds}s{milliseconds}ms"
+
+
+def shift_timestamps(text, offset_ms):
+    """Add offset_ms to every timestamp range in a transcript"""
+    def shift(match):
+        start = to_milliseconds(*match.groups()[:3]) + offset_ms
+        end = to_milliseconds(*match.groups()[3:]) + offset_ms
+        return f"[{format_timestamp(start)} - {format_timestamp(end)}]"
+
+    return TIMESTAMP_PATTERN.sub(shift, text)
+
+
+def split_segments(text):
+    """Split a timestamped transcript into segments
+
+    Returns:
+        tuple: (preamble, segments) where preamble is any text before the first
+        timestamp and segments is a list of (start_ms, end_ms, text) tuples, the
+        text including its timestamp
+    """
+    matches = list(TIMESTAMP_PATTERN.finditer(text))
+    if not matches:
+        return text, []
+
+    segments = []
+    for index, match in enumerate(matches):
+        end_of_segment = matches[index + 1].start() if index + 1 < len(matches) else len(text)
+        segments.append((
+            to_milliseconds(*match.groups()[:3]),
+            to_milliseconds(*match.groups()[3:]),
+            text[match.start():end_of_segment].strip()
+        ))
+    return text[:matches[0].start()].strip(), segments
@@ -1,121 +1,602 @@
-from google import genai
-from tenacity import retry, stop_after_attempt, wait_exponential
+import asyncio
 import os
 import logging
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
+import difflib
+import time
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from google.genai import types
+from cache import result_cache, file_handle_cache, hash_bytes, hash_file, make_key, FILE_HANDLE_EXPIRY_MARGIN
+from audio import ffmpeg_available, probe_duration, detect_silences, plan_chunks, extract_segment, transcode_for_speech, prepend_tail, CHUNK_EXTENSION, SPEECH_EXTENSION, SPEECH_BITRATE_KBPS
+from timestamps import shift_timestamps, split_segments
+from remote_files import record_upload, schedule_delete, start_reaper
+from gemini_client import call_gemini, call_gemini_async, get_client
+from metrics import track_stage, count_bytes
 
 # Get logger
 logger = logging.getLogger(__name__)
 
 MODEL = 'gemini-2.5-pro-exp-03-25'
-API_KEY = os.getenv('GEMINI_API_KEY')  # Get API key from environment variable
-
-if not API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable is not set")
 
 # Define prompts for with and without timestamps
 PROMPT_WITH_TIMESTAMPS = 'Generate a transcript of the speech. Use timestamps in format [8m40s242ms - 8m51s12ms]'
 PROMPT_WITHOUT_TIMESTAMPS = 'Generate a transcript of the speech. Do not include any timestamps.'
 
-# Initialize client
-client = genai.Client(api_key=API_KEY)
+# Chunked transcription of long recordings
+CHUNKED_TRANSCRIPTION = os.getenv('CHUNKED_TRANSCRIPTION', 'true').lower() in ('1', 'true', 'yes')
+CHUNK_THRESHOLD_SECONDS = int(os.getenv('CHUNK_THRESHOLD_SECONDS', str(15 * 60)))  # Only chunk recordings longer than this
+CHUNK_SECONDS = int(os.getenv('CHUNK_SECONDS', str(5 * 60)))  # Target chunk length
+CHUNK_OVERLAP_SECONDS = float(os.getenv('CHUNK_OVERLAP_SECONDS', '3'))  # Audio shared by neighbouring chunks
+CHUNK_PARALLELISM = int(os.getenv('CHUNK_PARALLELISM', '4'))  # Chunks transcribed at the same time
+CHUNK_SPLIT_AT_SILENCE = os.getenv('CHUNK_SPLIT_AT_SILENCE', 'true').lower() in ('1', 'true', 'yes')
+
+# Speech transcoding before upload
+SPEECH_TRANSCODE = os.getenv('SPEECH_TRANSCODE', 'true').lower() in ('1', 'true', 'yes')
+SPEECH_TRANSCODE_MIN_KB = int(os.getenv('SPEECH_TRANSCODE_MIN_KB', '1024'))  # Smaller files are uploaded as-is
+
+def upload_config_for(filepath):
+    """Return the upload config for an audio file, with the MIME type based on its extension"""
+    # Determine MIME type based on file extension
+    mime_type = "audio/mpeg"  # Default
+    file_ext = filepath.lower().split('.')[-1] if '.' in filepath else ''
+    
+    mime_types = {
+        'mp3': 'audio/mpeg',
+        'wav': 'audio/wav',
+        'aiff': 'audio/aiff',
+        'aac': 'audio/aac',
+        'ogg': 'audio/ogg',
+        'flac': 'audio/flac'
+    }
+    
+    if file_ext in mime_types:
+        mime_type = mime_types[file_ext]
+        
+    logger.info(f"Using MIME type: {mime_type}")
+    
+    return {
+        "mime_type": mime_type,
+    }
 
-# Add retry decorator for the file upload
-@retry(
-    stop=stop_after_attempt(10),  # Try 10 times
-    wait=wait_exponential(multiplier=1, min=4, max=10),  # Wait between attempts
-    reraise=True
-)
+# Uploads go through the shared rate limiter, which retries rate limited and transient failures
 def upload_file(client, filepath):
     try:
         logger.info("Uploading the file...")
+        upload_config = upload_config_for(filepath)
+        count_bytes('out', 'gemini_upload', os.path.getsize(filepath))
         
-        # Determine MIME type based on file extension
-        mime_type = "audio/mpeg"  # Default
-        file_ext = filepath.lower().split('.')[-1] if '.' in filepath else ''
-        
-        mime_types = {
-            'mp3': 'audio/mpeg',
-            'wav': 'audio/wav',
-            'aiff': 'audio/aiff',
-            'aac': 'audio/aac',
-            'ogg': 'audio/ogg',
-            'flac': 'audio/flac'
-        }
-        
-        if file_ext in mime_types:
-            mime_type = mime_types[file_ext]
-            
-        logger.info(f"Using MIME type: {mime_type}")
-        
-        upload_config = {
-            "mime_type": mime_type,
-        }
-        
-        return client.files.upload(
-                file=filepath,
-                config=upload_config
-                )
+        with track_stage('gemini_upload'):
+            myfile = call_gemini(lambda: client.files.upload(
+                    file=filepath,
+                    config=upload_config
+                    ), 'upload')
+        record_upload(myfile.name)
+        return myfile
     except Exception as e:
-        logger.error(f"Upload attempt failed: {str(e)}")
+        logger.error(f"Upload failed: {str(e)}")
         raise
 
-# Add retry for content generation
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    reraise=True
-)
+def transcode_for_upload(filepath):
+    """Re-encode audio as compact mono speech before it is uploaded, when that makes it smaller
+
+    Files under SPEECH_TRANSCODE_MIN_KB and files whose bitrate is already close
+    to the speech bitrate are left alone.
+
+    Returns:
+        string: Path of the transcoded temp file, or None if the original should be uploaded
+    """
+    if not SPEECH_TRANSCODE or not ffmpeg_available():
+        return None
+    size = os.path.getsize(filepath)
+    if size < SPEECH_TRANSCODE_MIN_KB * 1024:
+        return None
+    duration = probe_duration(filepath)
+    if duration and size * 8 / duration / 1000 < SPEECH_BITRATE_KBPS * 1.5:
+        return None
+
+    temp_file = tempfile.NamedTemporaryFile(suffix=f".{SPEECH_EXTENSION}", delete=False)
+    temp_file.close()
+    try:
+        start_time = time.time()
+        with track_stage('transcode'):
+            transcode_for_speech(filepath, temp_file.name)
+    except Exception as e:
+        logger.warning(f"Could not transcode audio, uploading the original: {str(e)}")
+        os.unlink(temp_file.name)
+        return None
+
+    transcoded_size = os.path.getsize(temp_file.name)
+    if transcoded_size >= size:
+        os.unlink(temp_file.name)
+        return None
+    logger.info(f"Transcoded audio for upload in {time.time() - start_time:.1f}s: "
+                f"{size/1024/1024:.2f}MB -> {transcoded_size/1024/1024:.2f}MB")
+    return temp_file.name
+
+def upload_file_cached(client, filepath, content_key):
+    """Upload a file, reusing a live remote copy of the same content when there is one
+
+    Args:
+        client: Gemini client
+        filepath: Path to the file to upload
+        content_key: Identifies the file content (e.g. its SHA-256)
+
+    Returns:
+        tuple: (Part referencing the remote file, remote file name, True if the
+        remote file is kept for reuse and must not be deleted by the caller)
+    """
+    handle = live_handle(content_key)
+    if handle is not None:
+        try:
+            # Make sure the file was not deleted remotely before reusing it
+            call_gemini(lambda: client.files.get(name=handle["name"]), 'file lookup')
+            return reuse_handle(handle)
+        except Exception as e:
+            forget_handle(content_key, handle, e)
+
+    # The remote copy is reused by the key of the original content, even when transcoded
+    transcoded_path = transcode_for_upload(filepath)
+    try:
+        myfile = upload_file(client, transcoded_path or filepath)
+    finally:
+        remove_transcoded(transcoded_path)
+    return remember_upload(client, content_key, myfile)
+
+def live_handle(content_key):
+    """Return the handle cache entry of a remote file that can still be reused, or None"""
+    handle = file_handle_cache.get(content_key)
+    if handle is not None and handle["expires"] > time.time():
+        return handle
+    return None
+
+def reuse_handle(handle):
+    """Return what upload_file_cached returns for a remote file uploaded earlier"""
+    logger.info(f"Reusing remote file {handle['name']} uploaded earlier")
+    return types.Part.from_uri(file_uri=handle["uri"], mime_type=handle["mime_type"]), handle["name"], True
+
+def forget_handle(content_key, handle, error):
+    """Drop a handle cache entry whose remote file could not be looked up"""
+    logger.info(f"Cached remote file {handle['name']} is no longer available: {str(error)}")
+    file_handle_cache.delete(content_key)
+
+def remove_transcoded(transcoded_path):
+    if transcoded_path:
+        os.unlink(transcoded_path)
+
+def remember_upload(client, content_key, myfile):
+    """Record an uploaded file in the handle cache so later requests can reuse it
+
+    Returns:
+        tuple: Same as upload_file_cached
+    """
+    if not file_handle_cache.enabled:
+        return myfile, myfile.name, False
+
+    # Files kept for reuse are never deleted by the caller, the orphan sweep removes them once they go stale
+    start_reaper(client)
+
+    # Stop reusing the file well before Gemini expires it
+    ttl = file_handle_cache.ttl
+    if myfile.expiration_time:
+        ttl = min(ttl, myfile.expiration_time.timestamp() - time.time() - FILE_HANDLE_EXPIRY_MARGIN)
+    file_handle_cache.set(content_key, {
+        "name": myfile.name,
+        "uri": myfile.uri,
+        "mime_type": myfile.mime_type,
+        "expires": time.time() + ttl,
+    }, ttl=ttl)
+    return myfile, myfile.name, True
+
+# Content generation goes through the shared rate limiter, which retries rate limited and transient failures
 def generate_content(client, model, contents):
     logger.info("Generating content...")
-    return client.models.generate_content(
-        model=model,
-        contents=contents
-    )
+    with track_stage('generation'):
+        return call_gemini(lambda: client.models.generate_content(
+            model=model,
+            contents=contents
+        ), 'generation')
+
+def generate_content_stream(client, model, contents, on_text):
+    """Generate content as a stream, passing the text produced so far to on_text
+
+    A failed stream is retried from the start.
+
+    Returns:
+        string: The complete generated text
+    """
+    logger.info("Generating content (streaming)...")
+
+    def stream():
+        text = ''
+        for chunk in client.models.generate_content_stream(
+            model=model,
+            contents=contents
+        ):
+            if chunk.text:
+                text += chunk.text
+                on_text(text)
+        return text
+
+    with track_stage('generation'):
+        return call_gemini(stream, 'streamed generation')
 
-def transcribe_audio(filepath, include_timestamps=True):
+def transcript_prompt(include_timestamps):
+    return PROMPT_WITH_TIMESTAMPS if include_timestamps else PROMPT_WITHOUT_TIMESTAMPS
+
+def transcript_cache_key(content_id, include_timestamps):
+    """Result cache key for the transcript of some content with the current prompt and model"""
+    return make_key(content_id, transcript_prompt(include_timestamps), MODEL)
+
+def cached_transcript(cache_key):
+    """Return the transcript of audio already transcribed with the same prompt, or None"""
+    transcript = result_cache.get(cache_key)
+    if transcript is not None:
+        logger.info(f"Transcript found in cache. Length: {len(transcript)} chars")
+    return transcript
+
+def chunking_duration(filepath):
+    """Return the duration of a recording long enough to be transcribed in chunks, or None"""
+    duration = probe_duration(filepath) if CHUNKED_TRANSCRIPTION and ffmpeg_available() else None
+    return duration if duration and duration > CHUNK_THRESHOLD_SECONDS else None
+
+def store_transcript(cache_key, transcript):
+    """Cache a finished transcript"""
+    transcript_preview = transcript[:100] + "..." if len(transcript) > 100 else transcript
+    logger.info(f"Transcription successfully generated. Length: {len(transcript)} chars. Preview: {transcript_preview}")
+    result_cache.set(cache_key, transcript)
+    logger.info("Transcription process completed successfully")
+
+def transcribe_audio(filepath, include_timestamps=True, on_text=None, content_hash=None):
     """Transcribe audio file
     
     Args:
         filepath: Path to the audio file
         include_timestamps: Whether to include timestamps in the transcript (default: True)
+        on_text: Optional callback receiving the transcript produced so far while it is generated
+        content_hash: SHA-256 of the file if already known (default: computed from the file)
         
     Returns:
         string: The transcribed text
     """
     try:
         logger.info(f"Starting transcription process for file at: {filepath}")
+        client = get_client()
+        
+        # Return a cached transcript if this audio was already transcribed with the same prompt
+        prompt = transcript_prompt(include_timestamps)
+        if content_hash is None:
+            content_hash = hash_file(filepath)
+        cache_key = transcript_cache_key(content_hash, include_timestamps)
+        transcript = cached_transcript(cache_key)
+        if transcript is not None:
+            return transcript
         
-        # Upload file with retry
+        # Long recordings are split into chunks and transcribed in parallel
+        duration = chunking_duration(filepath)
+        if duration:
+            transcript = transcribe_audio_chunked(filepath, content_hash, duration, prompt, include_timestamps, on_text)
+            store_transcript(cache_key, transcript)
+            return transcript
+        
+        # Upload file with retry, unless the same audio is still on the Gemini API
         logger.info("Step 1: Uploading file to Gemini API")
-        myfile = upload_file(client, filepath)
-        logger.info(f"File uploaded successfully to Gemini API with ID: {myfile.name}")
+        myfile, remote_name, keep_remote = upload_file_cached(client, filepath, content_hash)
+        logger.info(f"File available on Gemini API with ID: {remote_name}")
 
-        # Generate content with retry
-        logger.info("Step 2: Generating transcript from audio")
-        prompt = PROMPT_WITH_TIMESTAMPS if include_timestamps else PROMPT_WITHOUT_TIMESTAMPS
-        logger.info(f"Using prompt: {prompt}")
+        try:
+            # Generate content with retry
+            logger.info("Step 2: Generating transcript from audio")
+            logger.info(f"Using prompt: {prompt}")
+            if on_text:
+                transcript = generate_content_stream(client, MODEL, [prompt, myfile], on_text)
+            else:
+                response = generate_content(client, MODEL, [prompt, myfile])
+                
+                # Get the transcribed text
+                transcript = response.text
+        finally:
+            # Cleanup the uploaded file from Google's servers in the background. Files kept
+            # for reuse are deleted by the orphan sweep once their cache entry expires
+            if not keep_remote:
+                logger.info("Step 3: Scheduling deletion of the uploaded file from Gemini API")
+                schedule_delete(client, remote_name)
+        
+        store_transcript(cache_key, transcript)
+        return transcript
+
+    except Exception as e:
+        logger.error(f"An error occurred during transcription: {str(e)}")
+        raise
+
+def transcribe_chunk(chunk_path, chunk_key, prompt):
+    """Upload a single chunk (or reuse its earlier upload) and transcribe it"""
+    client = get_client()
+    myfile, remote_name, keep_remote = upload_file_cached(client, chunk_path, chunk_key)
+    try:
         response = generate_content(client, MODEL, [prompt, myfile])
+        return response.text or ''
+    finally:
+        if not keep_remote:
+            schedule_delete(client, remote_name)
+
+def transcribe_audio_chunked(filepath, content_hash, duration, prompt, include_timestamps, on_text=None):
+    """Transcribe a long recording as overlapping chunks processed in parallel
+
+    Args:
+        filepath: Path to the audio file
+        content_hash: SHA-256 of the audio file, identifying chunks for upload reuse
+        duration: Length of the audio in seconds
+        prompt: Prompt sent with every chunk
+        include_timestamps: Whether the prompt asks for timestamps
+        on_text: Optional callback receiving the merged transcript of the chunks finished so far
+
+    Returns:
+        string: The merged transcript
+    """
+    silences = detect_silences(filepath) if CHUNK_SPLIT_AT_SILENCE else None
+    chunks = plan_chunks(duration, CHUNK_SECONDS, silences)
+    logger.info(f"Splitting {duration:.0f}s of audio into {len(chunks)} chunks "
+                f"({'at silences' if silences else 'fixed windows'}, {CHUNK_PARALLELISM} in parallel)")
+
+    chunk_dir = tempfile.mkdtemp()
+    try:
+        def process(index):
+            start, end = chunks[index]
+            # Each chunk carries a little audio from its neighbours so no word is lost at a cut
+            offset = max(0.0, start - CHUNK_OVERLAP_SECONDS)
+            chunk_duration = min(duration, end + CHUNK_OVERLAP_SECONDS) - offset
+            chunk_path = os.path.join(chunk_dir, f"chunk{index:04d}.{CHUNK_EXTENSION}")
+            extract_segment(filepath, offset, chunk_duration, chunk_path)
+            # Encoded chunks differ byte-wise between runs, so identify them by source and position
+            chunk_key = hash_bytes(f"{content_hash}:{offset:.3f}:{chunk_duration:.3f}".encode('utf-8'))
+            text = transcribe_chunk(chunk_path, chunk_key, prompt)
+            logger.info(f"Chunk {index + 1}/{len(chunks)} transcribed. Length: {len(text)} chars")
+            return offset, text
+
+        results = []
+        with ThreadPoolExecutor(max_workers=CHUNK_PARALLELISM) as executor:
+            # Results arrive in chunk order, so the transcript can be published as it grows
+            for result in executor.map(process, range(len(chunks))):
+                results.append(result)
+                if on_text:
+                    on_text(merge_chunk_transcripts(chunks[:len(results)], results, include_timestamps))
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    return merge_chunk_transcripts(chunks, results, include_timestamps)
+
+def transcribe_segments(segments, content_id, prompt, include_timestamps, on_text=None):
+    """Transcribe audio arriving as consecutive chunks, starting on each as soon as it is complete
+
+    Used when the audio is still being downloaded: chunks are encoded for
+    speech and transcribed in parallel while later ones are produced, and
+    merged in order. Each chunk is sent with the end of the previous one, so no
+    word is lost at a cut.
+
+    Args:
+        segments: Iterable of (path, start, end) for each finished chunk, in order, with start and end in seconds
+        content_id: Identifies the audio, for reuse of chunk uploads
+        prompt: Prompt sent with every chunk
+        include_timestamps: Whether the prompt asks for timestamps
+        on_text: Optional callback receiving the merged transcript of the chunks finished so far
+
+    Returns:
+        string: The merged transcript
+    """
+    chunk_dir = tempfile.mkdtemp()
+
+    def process(index, path, start, end, previous_path):
+        chunk_path = os.path.join(chunk_dir, f"chunk{index:04d}.{CHUNK_EXTENSION}")
+        offset = start
+        if previous_path and CHUNK_OVERLAP_SECONDS > 0:
+            prepend_tail(previous_path, path, CHUNK_OVERLAP_SECONDS, chunk_path)
+            # The cut falls on a packet boundary, measure how much audio was actually prepended
+            offset = max(0.0, end - (probe_duration(chunk_path) or end - start))
+        else:
+            transcode_for_speech(path, chunk_path)
+        chunk_key = hash_bytes(f"{content_id}:{offset:.3f}:{end - offset:.3f}".encode('utf-8'))
+        text = transcribe_chunk(chunk_path, chunk_key, prompt)
+        logger.info(f"Chunk {index + 1} ({start:.0f}s-{end:.0f}s) transcribed. Length: {len(text)} chars")
+        return offset, text
+
+    chunks = []
+    futures = []
+    results = []
+
+    def collect(wait):
+        # Results are taken in chunk order, so the transcript can be published as it grows
+        while len(results) < len(futures) and (wait or futures[len(results)].done()):
+            results.append(futures[len(results)].result())
+            if on_text:
+                on_text(merge_chunk_transcripts(chunks[:len(results)], results, include_timestamps))
+
+    try:
+        with ThreadPoolExecutor(max_workers=CHUNK_PARALLELISM) as executor:
+            try:
+                previous_path = None
+                for index, (path, start, end) in enumerate(segments):
+                    chunks.append((start, end))
+                    futures.append(executor.submit(process, index, path, start, end, previous_path))
+                    previous_path = path
+                    collect(wait=False)
+                collect(wait=True)
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    logger.info(f"Transcribed {len(chunks)} chunks while they arrived")
+    return merge_chunk_transcripts(chunks, results, include_timestamps)
+
+def merge_chunk_transcripts(chunks, results, include_timestamps):
+    """Merge chunk transcripts in order, removing text repeated by the overlap
+
+    Args:
+        chunks: (start, end) seconds of each chunk without overlap
+        results: (offset, text) of each chunk, offset being where its audio starts
+        include_timestamps: Whether the transcripts contain timestamps
+
+    Returns:
+        string: The merged transcript
+    """
+    parts = []
+    previous_text = ''
+    for index, ((start, end), (offset, text)) in enumerate(zip(chunks, results)):
+        is_first = index == 0
+        is_last = index == len(chunks) - 1
+
+        preamble, segments = split_segments(shift_timestamps(text, int(offset * 1000))) if include_timestamps else (text, [])
+        if segments:
+            # Keep each segment only in the chunk whose own time range it starts in
+            kept = [segment_text for segment_start, _, segment_text in segments
+                    if (is_first or segment_start >= start * 1000) and (is_last or segment_start < end * 1000)]
+            if is_first and preamble:
+                kept.insert(0, preamble)
+            text = '\n'.join(kept)
+        elif not is_first:
+            text = remove_overlap(previous_text, text)
+
+        if text.strip():
+            parts.append(text.strip())
+        previous_text = text
+
+    return '\n'.join(parts)
+
+def remove_overlap(previous_text, text, window_words=80):
+    """Drop the start of text that repeats the end of previous_text
+
+    Compares the last words of the previous chunk with the first words of the
+    next one and cuts the next chunk after the longest run they share.
+    """
+    normalize = lambda word: re.sub(r'\W', '', word.lower())
+    previous_words = [normalize(word) for word in previous_text.split()[-window_words:]]
+    word_matches = list(re.finditer(r'\S+', text))
+    words = [normalize(match.group()) for match in word_matches[:window_words]]
+
+    matcher = difflib.SequenceMatcher(None, previous_words, words, autojunk=False)
+    match = matcher.find_longest_match(0, len(previous_words), 0, len(words))
+    if match.size < 3:
+        return text
+
+    cut = match.b + match.size
+    return text[word_matches[cut].start():] if cut < len(word_matches) else ''
+
+# Asyncio variants, used by jobs in the async serving mode. Gemini calls are made with the
+# SDK's asyncio client, blocking file and ffmpeg work runs in worker threads
+
+async def upload_file_async(client, filepath):
+    """Awaitable variant of upload_file"""
+    try:
+        logger.info("Uploading the file...")
+        upload_config = upload_config_for(filepath)
+        count_bytes('out', 'gemini_upload', os.path.getsize(filepath))
+        with track_stage('gemini_upload'):
+            myfile = await call_gemini_async(lambda: client.aio.files.upload(
+                    file=filepath,
+                    config=upload_config
+                    ), 'upload')
+        await asyncio.to_thread(record_upload, myfile.name)
+        return myfile
+    except Exception as e:
+        logger.error(f"Upload failed: {str(e)}")
+        raise
+
+async def upload_file_cached_async(client, filepath, content_key):
+    """Awaitable variant of upload_file_cached"""
+    # The handle cache is on disk, it is read and written in worker threads
+    handle = await asyncio.to_thread(live_handle, content_key)
+    if handle is not None:
+        try:
+            # Make sure the file was not deleted remotely before reusing it
+            await call_gemini_async(lambda: client.aio.files.get(name=handle["name"]), 'file lookup')
+            return reuse_handle(handle)
+        except Exception as e:
+            await asyncio.to_thread(forget_handle, content_key, handle, e)
+
+    transcoded_path = await asyncio.to_thread(transcode_for_upload, filepath)
+    try:
+        myfile = await upload_file_async(client, transcoded_path or filepath)
+    finally:
+        await asyncio.to_thread(remove_transcoded, transcoded_path)
+    return await asyncio.to_thread(remember_upload, client, content_key, myfile)
+
+async def generate_content_async(client, model, contents):
+    """Awaitable variant of generate_content"""
+    logger.info("Generating content...")
+    with track_stage('generation'):
+        return await call_gemini_async(lambda: client.aio.models.generate_content(
+            model=model,
+            contents=contents
+        ), 'generation')
+
+async def generate_content_stream_async(client, model, contents, on_text):
+    """Awaitable variant of generate_content_stream"""
+    logger.info("Generating content (streaming)...")
+
+    async def stream():
+        text = ''
+        async for chunk in await client.aio.models.generate_content_stream(
+            model=model,
+            contents=contents
+        ):
+            if chunk.text:
+                text += chunk.text
+                on_text(text)
+        return text
+
+    with track_stage('generation'):
+        return await call_gemini_async(stream, 'streamed generation')
+
+async def transcribe_audio_async(filepath, include_timestamps=True, on_text=None, content_hash=None):
+    """Awaitable variant of transcribe_audio
+
+    Long recordings are transcribed in chunks by transcribe_audio_chunked in a worker thread.
+    """
+    try:
+        logger.info(f"Starting transcription process for file at: {filepath}")
+        client = get_client()
         
-        # Get the transcribed text
-        transcript = response.text
-        transcript_preview = transcript[:100] + "..." if len(transcript) > 100 else transcript
-        logger.info(f"Transcription successfully generated. Length: {len(transcript)} chars. Preview: {transcript_preview}")
+        # Return a cached transcript if this audio was already transcribed with the same prompt
+        prompt = transcript_prompt(include_timestamps)
+        if content_hash is None:
+            content_hash = await asyncio.to_thread(hash_file, filepath)
+        cache_key = transcript_cache_key(content_hash, include_timestamps)
+        transcript = await asyncio.to_thread(cached_transcript, cache_key)
+        if transcript is not None:
+            return transcript
         
-        # Cleanup files from Google's servers
-        logger.info("Step 3: Cleaning up files from Gemini API")
-        delete_count = 0
-        for f in client.files.list():
-            logger.info(f"Deleting file: {f.name}")
-            client.files.delete(name=f.name)
-            delete_count += 1
+        # Long recordings are split into chunks and transcribed in parallel
+        duration = await asyncio.to_thread(chunking_duration, filepath)
+        if duration:
+            transcript = await asyncio.to_thread(
+                transcribe_audio_chunked, filepath, content_hash, duration, prompt, include_timestamps, on_text
+            )
+            await asyncio.to_thread(store_transcript, cache_key, transcript)
+            return transcript
+        
+        # Upload file with retry, unless the same audio is still on the Gemini API
+        logger.info("Step 1: Uploading file to Gemini API")
+        myfile, remote_name, keep_remote = await upload_file_cached_async(client, filepath, content_hash)
+        logger.info(f"File available on Gemini API with ID: {remote_name}")
+
+        try:
+            # Generate content with retry
+            logger.info("Step 2: Generating transcript from audio")
+            if on_text:
+                transcript = await generate_content_stream_async(client, MODEL, [prompt, myfile], on_text)
+            else:
+                response = await generate_content_async(client, MODEL, [prompt, myfile])
+                transcript = response.text
+        finally:
+            if not keep_remote:
+                logger.info("Step 3: Scheduling deletion of the uploaded file from Gemini API")
+                schedule_delete(client, remote_name)
         
-        logger.info(f"Cleanup complete. Deleted {delete_count} files from Gemini API.")
-        logger.info("Transcription process completed successfully")
-            
+        await asyncio.to_thread(store_transcript, cache_key, transcript)
         return transcript
 
     except Exception as e:
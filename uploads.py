@@ -0,0 +1,315 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+import uuid
+from cache import hash_file
+from registry import connect, register_schema, register_temp_file, process_alive
+from metrics import track_stage, count_bytes
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Resumable uploads: a file is sent as fixed-size chunks, in any order and in parallel,
+# each chunk can be retried on its own and an interrupted upload resumed later
+MAX_RESUMABLE_UPLOAD_MB = int(os.getenv('MAX_RESUMABLE_UPLOAD_MB', '2048'))  # Largest file accepted
+UPLOAD_CHUNK_MB = int(os.getenv('UPLOAD_CHUNK_MB', '8'))  # Size of the chunks clients send
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', str(24 * 60 * 60)))  # Seconds an unfinished upload can be resumed
+
+WRITE_BLOCK_SIZE = 64 * 1024  # Chunks are copied to disk in blocks of this size
+CONTENT_RANGE_PATTERN = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+# Upload sessions live in the shared registry, so any server process can take any chunk
+register_schema("""
+CREATE TABLE IF NOT EXISTS uploads (
+    upload_id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    sha256 TEXT,
+    file_id TEXT,
+    finalizing INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS uploads_expires ON uploads (expires);
+CREATE TABLE IF NOT EXISTS upload_chunks (
+    upload_id TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    PRIMARY KEY (upload_id, chunk_index)
+);
+CREATE TABLE IF NOT EXISTS upload_writes (
+    write_id INTEGER PRIMARY KEY,
+    upload_id TEXT NOT NULL,
+    pid INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS upload_writes_upload ON upload_writes (upload_id);
+""")
+
+
+class UploadError(Exception):
+    """Raised when an upload request cannot be honoured, with the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _purge_expired_uploads():
+    """Delete unfinished uploads nobody resumed in time, finished ones are owned by the temp file registry"""
+    rows = connect().execute(
+        'DELETE FROM uploads WHERE expires <= ? RETURNING upload_id, path, file_id',
+        (time.time(),)
+    ).fetchall()
+    for row in rows:
+        connect().execute('DELETE FROM upload_chunks WHERE upload_id = ?', (row['upload_id'],))
+        connect().execute('DELETE FROM upload_writes WHERE upload_id = ?', (row['upload_id'],))
+        if row['file_id'] is None:
+            try:
+                os.unlink(row['path'])
+            except FileNotFoundError:
+                pass
+            logger.info(f"Removed expired upload {row['upload_id']}")
+
+
+def _load_upload(upload_id):
+    row = connect().execute('SELECT * FROM uploads WHERE upload_id = ? AND expires > ?',
+                            (upload_id, time.time())).fetchone()
+    if row is None:
+        raise UploadError('Invalid or expired upload ID', 404)
+    return row
+
+
+def _chunk_count(upload):
+    return max(1, -(-upload['size'] // upload['chunk_size']))
+
+
+def _check_sha256(sha256):
+    if sha256 is not None and not re.fullmatch(r'[0-9a-f]{64}', str(sha256)):
+        raise UploadError('sha256 must be a hex SHA-256 digest')
+
+
+def create_upload(filename, size, sha256=None):
+    """Start a resumable upload
+
+    The file is preallocated on disk so chunks can be written at their offset
+    in any order.
+
+    Args:
+        filename: Name of the file, its extension is kept
+        size: Size of the file in bytes
+        sha256: Optional SHA-256 of the whole file, checked when the upload is finalized
+
+    Returns:
+        dict: Status of the new upload, see upload_status
+    """
+    # JSON true would pass for 1 byte, bool being a subclass of int
+    if isinstance(size, bool) or not isinstance(size, int) or size <= 0:
+        raise UploadError('File size must be a positive number of bytes')
+    if size > MAX_RESUMABLE_UPLOAD_MB * 1024 * 1024:
+        raise UploadError(f"File too large. Maximum size is {MAX_RESUMABLE_UPLOAD_MB}MB.", 413)
+    _check_sha256(sha256)
+    _purge_expired_uploads()
+
+    extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    suffix = f".{extension}" if re.fullmatch(r'[a-z0-9]{1,5}', extension) else ''
+    temp_file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    with temp_file:
+        temp_file.truncate(size)
+
+    upload_id = str(uuid.uuid4())
+    now = time.time()
+    connect().execute(
+        'INSERT INTO uploads (upload_id, path, filename, size, chunk_size, sha256, created, expires) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (upload_id, temp_file.name, filename, size, UPLOAD_CHUNK_MB * 1024 * 1024, sha256, now, now + UPLOAD_SESSION_TTL)
+    )
+    logger.info(f"Started resumable upload {upload_id}: {filename} ({size/1024/1024:.2f}MB)")
+    return upload_status(upload_id)
+
+
+def upload_status(upload_id):
+    """Return what was received of an upload
+
+    Returns:
+        dict: "upload_id", "size", "chunk_size", "received_bytes", indexes of the
+        chunks still "missing", and the "file_id" once finalized
+    """
+    upload = _load_upload(upload_id)
+    received = {row['chunk_index'] for row in connect().execute(
+        'SELECT chunk_index FROM upload_chunks WHERE upload_id = ?', (upload_id,))}
+    missing = [index for index in range(_chunk_count(upload)) if index not in received]
+    received_bytes = sum(min(upload['chunk_size'], upload['size'] - index * upload['chunk_size']) for index in received)
+    status = {
+        'upload_id': upload_id,
+        'size': upload['size'],
+        'chunk_size': upload['chunk_size'],
+        'received_bytes': received_bytes,
+        'missing': missing,
+        'expires': upload['expires'],
+    }
+    if upload['file_id']:
+        status['file_id'] = upload['file_id']
+    return status
+
+
+def parse_content_range(header):
+    """Return (first byte, last byte, total size) of a "bytes first-last/total" Content-Range header"""
+    match = CONTENT_RANGE_PATTERN.match(header or '')
+    if not match:
+        raise UploadError('Content-Range header must look like "bytes first-last/total"', 416)
+    return tuple(int(value) for value in match.groups())
+
+
+def write_chunk(upload_id, content_range, stream, chunk_sha256=None):
+    """Write one chunk of an upload to disk, streaming it from the request body
+
+    Chunks must start at a multiple of the upload's chunk size and span a whole
+    chunk (or the rest of the file). Sending a chunk again overwrites it, so
+    failed chunks can simply be retried; the chunk counts as missing until the
+    new copy has arrived in full and matches its checksum. Once the upload is
+    being finalized, chunks are refused with a 409.
+
+    Args:
+        upload_id: ID returned by create_upload
+        content_range: Value of the Content-Range header
+        stream: File-like object the chunk is read from
+        chunk_sha256: Optional SHA-256 of the chunk, the chunk is rejected if it does not match
+
+    Returns:
+        dict: Status of the upload, see upload_status
+    """
+    upload = _load_upload(upload_id)
+    first, last, total = parse_content_range(content_range)
+    index, offset = divmod(first, upload['chunk_size'])
+    length = last - first + 1
+    if (total != upload['size'] or offset != 0 or last >= total
+            or length != min(upload['chunk_size'], total - first)):
+        raise UploadError(f"Range must cover exactly one chunk of {upload['chunk_size']} bytes "
+                          f"in a {upload['size']} byte file", 416)
+
+    write_id = _start_write(upload_id, index)
+    try:
+        digest = hashlib.sha256()
+        received = 0
+        with track_stage('upload_chunk'), open(upload['path'], 'r+b') as f:
+            f.seek(first)
+            while received < length:
+                block = stream.read(min(WRITE_BLOCK_SIZE, length - received))
+                if not block:
+                    break
+                digest.update(block)
+                f.write(block)
+                received += len(block)
+        count_bytes('in', 'upload_chunk', received)
+
+        # A dropped connection leaves the chunk unrecorded, the client sends it again
+        if received != length or stream.read(1):
+            raise UploadError(f"Chunk {index} has {'fewer' if received < length else 'more'} bytes than its range")
+        if chunk_sha256 and digest.hexdigest() != chunk_sha256.lower():
+            raise UploadError(f"Chunk {index} does not match its checksum", 422)
+
+        connect().execute('INSERT OR IGNORE INTO upload_chunks (upload_id, chunk_index) VALUES (?, ?)', (upload_id, index))
+    finally:
+        connect().execute('DELETE FROM upload_writes WHERE write_id = ?', (write_id,))
+    return upload_status(upload_id)
+
+
+def _start_write(upload_id, index):
+    """Record a chunk write in progress, refusing it once the upload is being finalized
+
+    Finalizing hashes the file, bytes written after that would no longer match
+    the hash the file is registered with. The chunk is unrecorded while it is
+    written, so a copy that fails halfway is sent again instead of finalized.
+
+    Returns:
+        int: ID of the write, to delete once it is done
+    """
+    connection = connect()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        upload = connection.execute('SELECT finalizing, file_id FROM uploads WHERE upload_id = ?',
+                                    (upload_id,)).fetchone()
+        if upload is None:
+            raise UploadError('Invalid or expired upload ID', 404)
+        if upload['file_id']:
+            raise UploadError('Upload already finalized', 409)
+        if upload['finalizing']:
+            raise UploadError('Upload is being finalized, no more chunks can be sent', 409)
+        connection.execute('DELETE FROM upload_chunks WHERE upload_id = ? AND chunk_index = ?', (upload_id, index))
+        write_id = connection.execute('INSERT INTO upload_writes (upload_id, pid) VALUES (?, ?)',
+                                      (upload_id, os.getpid())).lastrowid
+        connection.execute('COMMIT')
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+    return write_id
+
+
+def _claim_finalize(upload):
+    """Mark an upload as being finalized, once every chunk arrived and none is being written
+
+    Only one request gets to finalize, even across server processes.
+    """
+    upload_id = upload['upload_id']
+    connection = connect()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        received = connection.execute('SELECT COUNT(*) FROM upload_chunks WHERE upload_id = ?',
+                                      (upload_id,)).fetchone()[0]
+        if received < _chunk_count(upload):
+            raise UploadError(f"Upload incomplete, {_chunk_count(upload) - received} chunks missing", 409)
+        writes = connection.execute('SELECT write_id, pid FROM upload_writes WHERE upload_id = ?',
+                                    (upload_id,)).fetchall()
+        # Writes left behind by a server process that stopped never finish
+        stale = [(write['write_id'],) for write in writes if not process_alive(write['pid'])]
+        connection.executemany('DELETE FROM upload_writes WHERE write_id = ?', stale)
+        if len(stale) < len(writes):
+            raise UploadError('Chunks are still being written, finalize once they are done', 409)
+        claimed = connection.execute(
+            'UPDATE uploads SET finalizing = 1 WHERE upload_id = ? AND finalizing = 0', (upload_id,)
+        ).rowcount
+        if not claimed:
+            raise UploadError('Upload is being finalized, check its status in a moment', 409)
+        connection.execute('COMMIT')
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+
+
+def finalize_upload(upload_id, sha256=None):
+    """Check that an upload is complete and register it as a temp file
+
+    Finalizing twice returns the same file ID, so the request can be retried.
+
+    Args:
+        upload_id: ID returned by create_upload
+        sha256: Optional SHA-256 of the whole file, for clients that hash it
+            while the chunks are being sent instead of before starting the upload
+
+    Returns:
+        tuple: (file ID usable with /transcribe, original filename, size in bytes)
+    """
+    _check_sha256(sha256)
+    upload = _load_upload(upload_id)
+    if upload['file_id']:
+        return upload['file_id'], upload['filename'], upload['size']
+
+    _claim_finalize(upload)
+    try:
+        with track_stage('upload_finalize'):
+            content_hash = hash_file(upload['path'])
+        if any(expected and content_hash != expected for expected in (upload['sha256'], sha256)):
+            raise UploadError('Uploaded file does not match its checksum', 422)
+    except Exception:
+        connect().execute('UPDATE uploads SET finalizing = 0 WHERE upload_id = ?', (upload_id,))
+        raise
+
+    # The temp file registry owns the file from here on, the session only remembers its ID for retries
+    file_id = register_temp_file(upload['path'], content_hash=content_hash)
+    connect().execute('UPDATE uploads SET file_id = ? WHERE upload_id = ?', (file_id, upload_id))
+    logger.info(f"Finalized upload {upload_id} as file_id {file_id}")
+    return file_id, upload['filename'], upload['size']
@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from metrics import track_stage, count_bytes
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# YouTube audio download cache
+YOUTUBE_CACHE_DIR = os.getenv('YOUTUBE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'voxlogai-youtube'))
+YOUTUBE_CACHE_MAX_MB = int(os.getenv('YOUTUBE_CACHE_MAX_MB', '1000'))  # Size cap for downloaded audio, 0 disables the cache
+# Smallest audio stream that is still fine for speech, falling back to the formats used before
+YOUTUBE_AUDIO_FORMAT = os.getenv(
+    'YOUTUBE_AUDIO_FORMAT',
+    'worstaudio[ext=m4a][abr>=?32]/bestaudio[ext=m4a]/worstaudio[ext=mp3][abr>=?32]/bestaudio[ext=mp3]/bestaudio'
+)
+
+YOUTUBE_CACHE_MIN_AGE = 60 * 60  # Entries used this recently are never evicted, they may be in use by a job
+AUDIO_EXTENSIONS = ['.m4a', '.mp3', '.webm', '.opus', '.ogg']
+
+VIDEO_ID_PATTERN = re.compile(r'(?:youtube\.com/watch\?v=|youtu\.be/)([a-zA-Z0-9_-]{11})')
+
+
+def extract_video_id(youtube_url):
+    """Return the 11-character video ID of a YouTube URL, or None"""
+    match = VIDEO_ID_PATTERN.search(youtube_url)
+    return match.group(1) if match else None
+
+
+def _entry_dir(video_id):
+    return os.path.join(YOUTUBE_CACHE_DIR, video_id)
+
+
+def _find_audio_file(directory):
+    """Return the downloaded audio file in a directory, preferring common audio extensions"""
+    files = [f for f in os.listdir(directory) if f != 'info.json']
+    logger.info(f"Files in directory: {files}")
+    if not files:
+        return None
+
+    # Check for common audio extensions first
+    for ext in AUDIO_EXTENSIONS:
+        for file in files:
+            if file.endswith(ext):
+                logger.info(f"Found audio file with {ext} extension: {file}")
+                return os.path.join(directory, file)
+
+    # If no audio file with known extension, just use the first file
+    logger.info(f"No known audio format found, using first file: {files[0]}")
+    return os.path.join(directory, files[0])
+
+
+def _cached_audio(video_id):
+    """Return (audio path, title) of a cached download, or None"""
+    directory = _entry_dir(video_id)
+    try:
+        with open(os.path.join(directory, 'info.json'), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        audio_path = os.path.join(directory, info['file'])
+        if not os.path.exists(audio_path):
+            return None
+        # Mark as recently used for LRU eviction
+        os.utime(os.path.join(directory, 'info.json'))
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+    return audio_path, info['title']
+
+
+def _run_yt_dlp(youtube_url, directory, progress_hook=None):
+    """Download the audio of a video into directory and return its title"""
+    # yt-dlp is slow to import and only needed for downloads, keep it out of server startup
+    import yt_dlp
+
+    ydl_opts = {
+        'format': YOUTUBE_AUDIO_FORMAT,
+        # Fixed output name to avoid path issues
+        'outtmpl': os.path.join(directory, 'audio.%(ext)s'),
+        # No post-processing to avoid ffmpeg dependency
+        'writethumbnail': False,
+        'noplaylist': True,
+    }
+    if progress_hook:
+        ydl_opts['progress_hooks'] = [progress_hook]
+
+    try:
+        with track_stage('youtube_download'), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info_dict = ydl.extract_info(youtube_url, download=True)
+            video_title = info_dict.get('title', 'Unknown Title')
+            logger.info(f"Downloaded audio ({info_dict.get('format_id')}, {info_dict.get('abr')}kbps) from: {video_title}")
+            return video_title
+    except yt_dlp.utils.DownloadError as e:
+        logger.error(f"YouTube download error: {str(e)}")
+        raise Exception(f'Error downloading YouTube video: {str(e)}')
+
+
+def download_audio(youtube_url, progress_hook=None):
+    """Download the audio of a YouTube video, reusing an earlier download of the same video
+
+    Args:
+        youtube_url: URL of the video
+        progress_hook: Optional yt-dlp progress hook, called while the audio is downloaded
+
+    Returns:
+        dict: "path" of the audio file, video "title", and "temp_dir" to delete
+        with release_audio once done when the audio was not kept in the cache
+    """
+    video_id = extract_video_id(youtube_url)
+    if video_id and YOUTUBE_CACHE_MAX_MB > 0:
+        cached = _cached_audio(video_id)
+        if cached:
+            logger.info(f"YouTube audio found in cache: {video_id}")
+            return {'path': cached[0], 'title': cached[1], 'temp_dir': None}
+        os.makedirs(YOUTUBE_CACHE_DIR, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(dir=YOUTUBE_CACHE_DIR, prefix='.partial-')
+    else:
+        temp_dir = tempfile.mkdtemp()
+
+    logger.info(f"Downloading audio from YouTube: {youtube_url}")
+    try:
+        video_title = _run_yt_dlp(youtube_url, temp_dir, progress_hook)
+        audio_path = _find_audio_file(temp_dir)
+        if not audio_path:
+            raise Exception("No files found after YouTube download")
+        count_bytes('in', 'youtube_download', os.path.getsize(audio_path))
+    except Exception:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+    if not video_id or YOUTUBE_CACHE_MAX_MB <= 0:
+        return {'path': audio_path, 'title': video_title, 'temp_dir': temp_dir}
+
+    # Publish the finished download under its video ID
+    with open(os.path.join(temp_dir, 'info.json'), 'w', encoding='utf-8') as f:
+        json.dump({'title': video_title, 'file': os.path.basename(audio_path), 'url': youtube_url}, f)
+    try:
+        os.rename(temp_dir, _entry_dir(video_id))
+    except OSError:
+        # Another request downloaded the same video in the meantime, use theirs
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        cached = _cached_audio(video_id)
+        if not cached:
+            raise Exception("YouTube download disappeared from the cache")
+        return {'path': cached[0], 'title': cached[1], 'temp_dir': None}
+
+    _evict()
+    return {'path': os.path.join(_entry_dir(video_id), os.path.basename(audio_path)), 'title': video_title, 'temp_dir': None}
+
+
+def release_audio(download):
+    """Delete a download that was not kept in the cache"""
+    if download['temp_dir']:
+        shutil.rmtree(download['temp_dir'], ignore_errors=True)
+        logger.info(f"Deleted temp directory: {download['temp_dir']}")
+
+
+def _entries():
+    """List (directory, size, last use) for every cached video"""
+    entries = []
+    try:
+        with os.scandir(YOUTUBE_CACHE_DIR) as it:
+            for item in it:
+                if item.name.startswith('.') or not item.is_dir():
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(item.path))
+                    last_use = os.stat(os.path.join(item.path, 'info.json')).st_mtime
+                except FileNotFoundError:
+                    continue
+                entries.append((item.path, size, last_use))
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _evict():
+    """Drop the least recently used downloads until the cache fits in YOUTUBE_CACHE_MAX_MB"""
+    # Leftovers of downloads interrupted by a crash or restart
+    with os.scandir(YOUTUBE_CACHE_DIR) as it:
+        for item in it:
+            if item.name.startswith('.partial-') and time.time() - item.stat().st_mtime > 24 * 60 * 60:
+                shutil.rmtree(item.path, ignore_errors=True)
+
+    max_bytes = YOUTUBE_CACHE_MAX_MB * 1024 * 1024
+    entries = _entries()
+    total_size = sum(size for _, size, _ in entries)
+    if total_size <= max_bytes:
+        return
+
+    for path, size, last_use in sorted(entries, key=lambda entry: entry[2]):
+        if time.time() - last_use < YOUTUBE_CACHE_MIN_AGE:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total_size -= size
+        logger.info(f"Evicted cached YouTube audio: {os.path.basename(path)}")
+        if total_size <= max_bytes:
+            break
+
+
+def youtube_cache_stats():
+    """Return the number and total size of cached downloads"""
+    entries = _entries()
+    return {
+        'entries': len(entries),
+        'size_bytes': sum(size for _, size, _ in entries),
+        'max_bytes': YOUTUBE_CACHE_MAX_MB * 1024 * 1024,
+    }